@@ -0,0 +1,126 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "datasets",
+#     "vllm",
+#     "transformers",
+#     "huggingface-hub[hf_transfer]",
+#     "torch",
+#     "rich",
+#     "typer",
+# ]
+# ///
+"""
+Benchmark vLLM generation passes with and without length-bucketed batching.
+
+Runs every generation pass of a column config over the same rows twice, once batching rows in
+source order and once batching them by prompt length, and reports generated tokens per second.
+Prefix caching is disabled so that neither run reuses the KV cache of the other.
+Run it from this directory so with_vllm.py can be imported.
+"""
+import time
+
+import typer
+from datasets import Dataset, load_dataset
+from rich import print as rprint
+from rich.table import Table
+from vllm import LLM
+
+from with_vllm import ProcessorConfig, check_cuda_availability, load_processor_config, process_columns
+
+
+def _generate(
+    *,
+    dataset: Dataset,
+    llm: LLM,
+    processor_config: ProcessorConfig,
+    length_bucketing: bool,
+) -> tuple[Dataset, float]:
+    """Run every generation pass and return the generated dataset and the elapsed seconds."""
+    start = time.perf_counter()
+    for level in processor_config.column_levels:
+        dataset = process_columns(
+            dataset=dataset,
+            llm=llm,
+            processor_config=processor_config,
+            column_names=level,
+            length_bucketing=length_bucketing,
+        )
+    return dataset, time.perf_counter() - start
+
+
+def main(
+    *,
+    repo_id: str,
+    config: str = './config.yml',
+    split: str = "train",
+    num_rows: int = 2000,
+    vllm_model: str = "meta-llama/Llama-3.1-8B-Instruct",
+    batch_size: int = 512,
+    warmup_rows: int = 64,
+):
+    check_cuda_availability()
+
+    # Both modes generate the same prompts: with prefix caching, the second one would reuse the
+    # KV cache of the first and skip most of its prefill
+    llm = LLM(
+        model=vllm_model,
+        trust_remote_code=True,
+        gpu_memory_utilization=0.9,
+        max_model_len=29456,
+        enable_prefix_caching=False,
+    )
+    tokenizer = llm.get_tokenizer()
+
+    dataset = load_dataset(repo_id, split=split)
+    dataset = dataset.select(range(min(num_rows, dataset.num_rows)))
+
+    processor_config = load_processor_config(
+        dataset=dataset,
+        config_path=config,
+        num_rows=dataset.num_rows,
+        batch_size=batch_size,
+        vllm_model=vllm_model,
+    )
+    generated_columns = processor_config.sorted_columns
+
+    # Compile CUDA graphs and warm the allocator before timing anything
+    _generate(
+        dataset=dataset.select(range(min(warmup_rows, dataset.num_rows))),
+        llm=llm,
+        processor_config=processor_config,
+        length_bucketing=False,
+    )
+
+    table = Table(title=f"Length bucketing ({dataset.num_rows} rows, batch size {batch_size})")
+    for header in ("Batching", "Time (s)", "Generated tokens", "Tokens/s", "Speedup"):
+        table.add_column(header)
+
+    baseline = None
+    for length_bucketing in (False, True):
+        generated, elapsed = _generate(
+            dataset=dataset,
+            llm=llm,
+            processor_config=processor_config,
+            length_bucketing=length_bucketing,
+        )
+        tokens = sum(
+            len(ids)
+            for column in generated_columns
+            for ids in tokenizer(generated[column], add_special_tokens=False)["input_ids"]
+        )
+        throughput = tokens / elapsed
+        baseline = baseline or throughput
+        table.add_row(
+            "length-bucketed" if length_bucketing else "source order",
+            f"{elapsed:.1f}",
+            str(tokens),
+            f"{throughput:.0f}",
+            f"{throughput / baseline:.2f}x",
+        )
+
+    rprint(table)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,170 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "rich",
+#     "typer",
+# ]
+# ///
+"""
+Startup time benchmark for the generation scripts.
+
+Every scenario runs in a fresh Python process, so module imports are measured cold: the
+--help of each script, importing it, and optionally --validate-only against a real source
+dataset and config. The median of the repeats is reported and written as JSON. The benchmark
+fails when a median exceeds --max-seconds, or regressed against the JSON of a previous run
+passed as --baseline. Run it with the Python environment of the scripts.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import typer
+from rich import print as rprint
+from rich.table import Table
+
+SCRIPTS = ("with_inference_client.py", "with_vllm.py")
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_command(args: list[str], repeats: int) -> list[float]:
+    """Return the wall time of each run of a Python command, in seconds."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args],
+            cwd=SCRIPTS_DIR,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def scenarios(scripts: list[str], repo_id: str | None, config: str | None) -> list[tuple[str, list[str]]]:
+    """Return the name and Python arguments of every scenario to time."""
+    commands = []
+    for script in scripts:
+        module = os.path.splitext(script)[0]
+        commands.append((f"{module} --help", [script, "--help"]))
+        commands.append((f"import {module}", ["-c", f"import {module}"]))
+        if repo_id and config:
+            commands.append((
+                f"{module} --validate-only",
+                [script, repo_id, "validate-only", "--config", os.path.abspath(config), "--validate-only"],
+            ))
+    return commands
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> bool:
+    """Print the startup time of every scenario against a baseline, and return whether none regressed."""
+    with open(baseline_path) as f:
+        baseline = {result["scenario"]: result for result in json.load(f)["results"]}
+
+    table = Table(title=f"Startup time against {baseline_path}")
+    for header in ("Scenario", "Baseline s", "Median s", "Change"):
+        table.add_column(header)
+
+    regressions = False
+    for result in results:
+        previous = baseline.get(result["scenario"])
+        if previous is None or not previous["median_s"]:
+            table.add_row(result["scenario"], "-", f"{result['median_s']:.2f}", "new")
+            continue
+        change = result["median_s"] / previous["median_s"] - 1
+        regressed = change > tolerance
+        regressions |= regressed
+        table.add_row(
+            result["scenario"],
+            f"{previous['median_s']:.2f}",
+            f"{result['median_s']:.2f}",
+            f"[{'red' if regressed else 'green'}]{change:+.1%}[/]",
+        )
+
+    rprint(table)
+    return not regressions
+
+
+def main(
+    *,
+    scripts: str = ",".join(SCRIPTS),
+    repeats: int = 5,
+    repo_id: str | None = None,
+    config: str | None = None,
+    max_seconds: float | None = 1.0,
+    output: str = "startup_results.json",
+    baseline: str | None = None,
+    tolerance: float = 0.2,
+):
+    """
+    Time the startup of every script in fresh processes and save the results as JSON.
+
+    Args:
+        scripts: Comma-separated scripts to time (default: with_inference_client.py,with_vllm.py).
+        repeats: Number of runs of each scenario (default: 5).
+        repo_id: Source dataset of the --validate-only scenario, timed only with config.
+        config: YAML configuration of the --validate-only scenario, timed only with repo_id.
+        max_seconds: Fail if the median of a scenario exceeds this many seconds (default: 1.0).
+            The --validate-only scenario includes the Hub metadata requests.
+        output: Path of the JSON results (default: startup_results.json).
+        baseline: JSON results of a previous run to compare against.
+        tolerance: Relative startup time increase reported as a regression (default: 0.2).
+    """
+    results = []
+    for scenario, args in scenarios(scripts.split(","), repo_id, config):
+        rprint(f"[bold blue]Timing {scenario}[/]")
+        try:
+            timings = time_command(args, repeats)
+        except subprocess.CalledProcessError as e:
+            rprint(f"[bold red]{scenario} failed:[/]\n{e.stderr.decode(errors='replace')}")
+            raise typer.Exit(code=1)
+        results.append({
+            "scenario": scenario,
+            "median_s": statistics.median(timings),
+            "min_s": min(timings),
+            "max_s": max(timings),
+            "timings_s": timings,
+        })
+
+    table = Table(title=f"Startup time ({repeats} runs)")
+    for header in ("Scenario", "Median s", "Min s", "Max s"):
+        table.add_column(header)
+    too_slow = False
+    for result in results:
+        slow = max_seconds is not None and result["median_s"] > max_seconds
+        too_slow |= slow
+        table.add_row(
+            result["scenario"],
+            f"[{'red' if slow else 'green'}]{result['median_s']:.2f}[/]",
+            f"{result['min_s']:.2f}",
+            f"{result['max_s']:.2f}",
+        )
+    rprint(table)
+
+    with open(output, "w") as f:
+        json.dump({
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "settings": {
+                "python": sys.version.split()[0],
+                "repeats": repeats,
+                "repo_id": repo_id,
+                "config": config,
+            },
+            "results": results,
+        }, f, indent=2)
+    rprint(f"[bold green]Results written to {output}[/]")
+
+    if too_slow:
+        rprint(f"[bold red]Startup took over {max_seconds}s[/]")
+    regressed = baseline is not None and not compare(results, baseline, tolerance)
+    if too_slow or regressed:
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
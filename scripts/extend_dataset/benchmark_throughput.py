@@ -0,0 +1,519 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "datasets",
+#     "huggingface-hub",
+#     "pyyaml",
+#     "rich",
+#     "typer",
+# ]
+# ///
+"""
+Offline throughput benchmarks for the generation scripts, without spending provider credits.
+
+The inference client pipeline is pointed at a local mock_inference_server.py process, and the
+vLLM path runs on simulated engines. Every backend runs over a synthetic dataset for every
+column DAG shape, and the results are written as JSON. The simulated engines answer every
+prompt deterministically, so the vLLM outputs are checked cell by cell against their rows.
+Pass the JSON of a previous run as --baseline to compare throughput for regressions. Run it
+from this directory so the sibling scripts can be imported. The vLLM backends don't need vllm.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Callable
+
+import requests
+import typer
+import yaml
+from datasets import Dataset
+from rich import print as rprint
+from rich.table import Table
+
+BACKENDS = ("threads", "async", "vllm", "vllm-streaming")
+DAG_SHAPES = ("independent", "chain", "fanout", "diamond")
+
+
+def build_columns(shape: str, num_columns: int) -> dict[str, dict]:
+    """
+    Build a column config of the given DAG shape over the source column `text`.
+
+    independent: every column reads `text`. chain: each column reads the previous one.
+    fanout: one root column read by all the others. diamond: a root, parallel middle
+    columns reading it, and a last column reading every middle column.
+    """
+    names = [f"col_{idx}" for idx in range(num_columns)]
+    if shape == "independent":
+        references = {name: ["text"] for name in names}
+    elif shape == "chain":
+        references = {name: [names[idx - 1] if idx else "text"] for idx, name in enumerate(names)}
+    elif shape == "fanout":
+        references = {name: [names[0] if idx else "text"] for idx, name in enumerate(names)}
+    elif shape == "diamond":
+        if num_columns < 3:
+            raise ValueError("The diamond shape needs at least 3 columns")
+        references = {names[0]: ["text"], **{name: [names[0]] for name in names[1:-1]}, names[-1]: names[1:-1]}
+    else:
+        raise ValueError(f"Unknown DAG shape: {shape}. Expected one of {DAG_SHAPES}.")
+
+    return {
+        name: {
+            "modelName": "mock-model",
+            "modelProvider": "mock",
+            "prompt": f"Process the following for {name}: " + " ".join(f"{{{{{ref}}}}}" for ref in refs),
+            "columnsReferences": refs,
+        }
+        for name, refs in references.items()
+    }
+
+
+def synthetic_dataset(num_rows: int, words_per_row: int = 64, seed: int = 0) -> Dataset:
+    rng = random.Random(seed)
+    vocabulary = [f"word{idx}" for idx in range(1000)]
+    return Dataset.from_dict({
+        "text": [" ".join(rng.choices(vocabulary, k=rng.randint(1, words_per_row))) for _ in range(num_rows)],
+    })
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    """Return the p50/p95/p99 of latencies in seconds, in milliseconds."""
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    values = sorted(values)
+    return {
+        f"p{p}": round(values[max(0, math.ceil(p / 100 * len(values)) - 1)] * 1000, 3)
+        for p in (50, 95, 99)
+    }
+
+
+class ThreadSampler:
+    """Samples the number of live threads in the background and keeps the peak."""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.max_threads = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.max_threads = max(self.max_threads, threading.active_count())
+
+    def __enter__(self) -> "ThreadSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+class MockServerProcess:
+    """Runs mock_inference_server.py in a child process, so its threads don't count as ours."""
+
+    def __init__(self, **server_options) -> None:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_inference_server.py")]
+        command += ["--port", str(self.port)]
+        for name, value in server_options.items():
+            if value is not None:
+                command += [f"--{name.replace('_', '-')}", str(value)]
+        self._process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                self.stats()
+                return
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("The mock inference server did not start")
+
+    def stats(self) -> dict:
+        response = requests.get(f"{self.url}/stats", timeout=5)
+        response.raise_for_status()
+        return response.json()
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+
+def simulated_answer(prompt: str, response_tokens: tuple[int, int]) -> str:
+    """Answer of SimulatedLLM to a prompt: a digest of the prompt, then filler words up to response_tokens words."""
+    num_words = random.Random(prompt).randint(*response_tokens)
+    return " ".join([hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]] + ["token"] * (num_words - 1))
+
+
+def check_outputs(output: Dataset, dataset: Dataset, processor_config, answer: Callable[[str], str]) -> None:
+    """
+    Check that the generated dataset keeps the source rows in order, and that every generated
+    cell is the simulated answer to the prompt rendered from its own row.
+    """
+    if output.select_columns(dataset.column_names).to_list() != dataset.to_list():
+        raise RuntimeError("The generated dataset doesn't hold the source rows in their order")
+
+    for index, row in enumerate(output):
+        for column in processor_config.sorted_columns:
+            expected = answer(processor_config.templates[column].render(row)).strip()
+            if row[column] != expected:
+                raise RuntimeError(f"Row {index} of {column} isn't the answer to the prompt of the row: {row[column]!r}")
+
+
+class SimulatedLLM:
+    """
+    Stand-in for vllm.LLM in batched mode.
+
+    Each llm.chat call takes step_latency seconds per group of max_num_seqs prompts, like an
+    engine running full batches, and answers with simulated_answer.
+    """
+
+    def __init__(self, model: str, *, step_latency: float, max_num_seqs: int, response_tokens: tuple[int, int]) -> None:
+        self.model = model
+        self.step_latency = step_latency
+        self.max_num_seqs = max_num_seqs
+        self.response_tokens = response_tokens
+        self.cell_latencies: list[float] = []
+
+    def get_tokenizer(self):
+        return lambda texts, add_special_tokens=True: {"input_ids": [text.split() for text in texts]}
+
+    def chat(self, messages: list[list[dict]], sampling_params=None, **kwargs) -> list:
+        latency = self.step_latency * math.ceil(len(messages) / self.max_num_seqs)
+        time.sleep(latency)
+        # Every prompt of the call waits for the whole call
+        self.cell_latencies.extend([latency] * len(messages))
+        return [
+            SimpleNamespace(
+                outputs=[SimpleNamespace(text=simulated_answer(message[-1]["content"], self.response_tokens))],
+                prompt_token_ids=message[-1]["content"].split(),
+                num_cached_tokens=0,
+            )
+            for message in messages
+        ]
+
+
+def run_inference_client(
+    *,
+    engine: str,
+    dataset: Dataset,
+    config_path: str,
+    server: MockServerProcess,
+    max_workers: int,
+    max_concurrent_requests: int,
+) -> dict:
+    from with_inference_client import Pipeline
+
+    class TimedPipeline(Pipeline):
+        """Pipeline reading the synthetic dataset and timing every cell."""
+
+        def _load_source_dataset(self, **kwargs):
+            return dataset.to_iterable_dataset()
+
+        def process_node(self, node, row, bill_to=None, queued_at=None):
+            start = time.perf_counter()
+            try:
+                return super().process_node(node, row, bill_to=bill_to, queued_at=queued_at)
+            finally:
+                cell_latencies.append(time.perf_counter() - start)
+
+        async def aprocess_node(self, node, row, bill_to=None):
+            start = time.perf_counter()
+            try:
+                return await super().aprocess_node(node, row, bill_to=bill_to)
+            finally:
+                cell_latencies.append(time.perf_counter() - start)
+
+    cell_latencies: list[float] = []
+    pipeline = TimedPipeline(
+        repo_id="synthetic",
+        config=config_path,
+        num_rows=dataset.num_rows,
+        base_url=server.url,
+        max_workers=max_workers,
+        max_concurrent_requests=max_concurrent_requests,
+    )
+    server_before = server.stats()
+
+    with ThreadSampler() as threads:
+        start = time.perf_counter()
+        pipeline.run(engine=engine)
+        elapsed = time.perf_counter() - start
+
+    server_after = server.stats()
+    return {
+        "rows": pipeline.completed_rows,
+        "elapsed_s": elapsed,
+        "cell_latencies": cell_latencies,
+        "max_threads": threads.max_threads,
+        "retries": sum(limiter.throttled for limiter in pipeline.rate_limiters.values()),
+        "server": {
+            "requests": server_after["requests"] - server_before["requests"],
+            "rate_limited": server_after["rate_limited"] - server_before["rate_limited"],
+            "max_in_flight": server_after["max_in_flight"],
+        },
+    }
+
+
+def run_vllm(
+    *,
+    streaming: bool,
+    dataset: Dataset,
+    config_path: str,
+    latency_ms: float,
+    batch_size: int,
+    response_tokens: tuple[int, int],
+) -> dict:
+    import with_vllm
+
+    processor_config = with_vllm.load_processor_config(
+        dataset=dataset,
+        config_path=config_path,
+        num_rows=dataset.num_rows,
+        batch_size=batch_size,
+    )
+
+    with ThreadSampler() as threads:
+        start = time.perf_counter()
+        if streaming:
+            cell_latencies = []
+
+            class TimedEngine(with_vllm.SimulatedStreamingEngine):
+                async def generate(self, messages, sampling_params):
+                    request_start = time.perf_counter()
+                    try:
+                        return await super().generate(messages, sampling_params)
+                    finally:
+                        cell_latencies.append(time.perf_counter() - request_start)
+
+            output = asyncio.run(with_vllm.stream_columns(
+                dataset=dataset,
+                engine=TimedEngine(latency=latency_ms / 1000),
+                processor_config=processor_config,
+            ))
+            answer = lambda prompt: f"Generated from: {prompt}"
+        else:
+            llms = []
+
+            def llm_factory(model: str) -> SimulatedLLM:
+                llms.append(SimulatedLLM(
+                    model,
+                    step_latency=latency_ms / 1000,
+                    max_num_seqs=256,
+                    response_tokens=response_tokens,
+                ))
+                return llms[-1]
+
+            output = with_vllm.generate_passes(
+                dataset=dataset,
+                passes=processor_config.model_schedule,
+                llm_factory=llm_factory,
+                processor_config=processor_config,
+            )
+            cell_latencies = [latency for llm in llms for latency in llm.cell_latencies]
+            answer = lambda prompt: simulated_answer(prompt, response_tokens)
+        elapsed = time.perf_counter() - start
+
+    check_outputs(output, dataset, processor_config, answer)
+
+    return {
+        "rows": output.num_rows,
+        "elapsed_s": elapsed,
+        "cell_latencies": cell_latencies,
+        "max_threads": threads.max_threads,
+        "retries": 0,
+    }
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> bool:
+    """Print the throughput of every scenario against a baseline, and return whether none regressed."""
+    with open(baseline_path) as f:
+        baseline = {(result["backend"], result["shape"]): result for result in json.load(f)["results"]}
+
+    table = Table(title=f"Throughput against {baseline_path}")
+    for header in ("Backend", "Shape", "Baseline rows/s", "Rows/s", "Change"):
+        table.add_column(header)
+
+    regressions = False
+    for result in results:
+        previous = baseline.get((result["backend"], result["shape"]))
+        if previous is None or not previous["rows_per_s"]:
+            table.add_row(result["backend"], result["shape"], "-", f"{result['rows_per_s']:.1f}", "new")
+            continue
+        change = result["rows_per_s"] / previous["rows_per_s"] - 1
+        regressed = change < -tolerance
+        regressions |= regressed
+        table.add_row(
+            result["backend"],
+            result["shape"],
+            f"{previous['rows_per_s']:.1f}",
+            f"{result['rows_per_s']:.1f}",
+            f"[{'red' if regressed else 'green'}]{change:+.1%}[/]",
+        )
+
+    rprint(table)
+    return not regressions
+
+
+def main(
+    *,
+    backends: str = ",".join(BACKENDS),
+    shapes: str = ",".join(DAG_SHAPES),
+    num_rows: int = 200,
+    num_columns: int = 3,
+    max_workers: int = 16,
+    max_concurrent_requests: int = 100,
+    batch_size: int = 512,
+    latency_ms: float = 50,
+    latency_distribution: str = "lognormal",
+    latency_spread: float = 0.5,
+    rate_limit_probability: float = 0,
+    min_response_tokens: int = 20,
+    max_response_tokens: int = 200,
+    seed: int = 0,
+    output: str = "benchmark_results.json",
+    baseline: str | None = None,
+    tolerance: float = 0.1,
+):
+    """
+    Run every backend over every DAG shape and save the results as JSON.
+
+    Args:
+        backends: Comma-separated backends among threads, async, vllm and vllm-streaming.
+        shapes: Comma-separated column DAG shapes among independent, chain, fanout and diamond.
+        num_rows: Number of synthetic source rows (default: 200).
+        num_columns: Number of generated columns per DAG (default: 3).
+        max_workers: Worker threads of the inference client pipeline (default: 16).
+        max_concurrent_requests: Connection pool size of the async engine (default: 100).
+        batch_size: Rows per vLLM batch (default: 512).
+        latency_ms: Median latency of a mock request, or of a simulated vLLM step (default: 50).
+        latency_distribution: Mock server latency distribution, "constant", "uniform" or "lognormal".
+        latency_spread: Half-width in ms for "uniform", sigma for "lognormal" (default: 0.5).
+        rate_limit_probability: Share of mock requests rejected with a 429 (default: 0).
+        min_response_tokens: Minimum number of words per completion (default: 20).
+        max_response_tokens: Maximum number of words per completion (default: 200).
+        seed: Random seed of the dataset and the mock server (default: 0).
+        output: Path of the JSON results (default: benchmark_results.json).
+        baseline: JSON results of a previous run to compare against.
+        tolerance: Relative throughput drop reported as a regression (default: 0.1).
+    """
+    selected_backends = backends.split(",")
+    if unknown := set(selected_backends) - set(BACKENDS):
+        raise ValueError(f"Unknown backends: {unknown}. Expected some of {BACKENDS}.")
+
+    dataset = synthetic_dataset(num_rows, seed=seed)
+    response_tokens = (min_response_tokens, max_response_tokens)
+
+    server = None
+    if {"threads", "async"} & set(selected_backends):
+        server = MockServerProcess(
+            latency_ms=latency_ms,
+            latency_distribution=latency_distribution,
+            latency_spread=latency_spread,
+            rate_limit_probability=rate_limit_probability,
+            min_response_tokens=min_response_tokens,
+            max_response_tokens=max_response_tokens,
+            seed=seed,
+        )
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for shape in shapes.split(","):
+                config_path = os.path.join(tmp_dir, f"{shape}.yml")
+                with open(config_path, "w") as f:
+                    yaml.safe_dump({"columns": build_columns(shape, num_columns)}, f)
+
+                for backend in selected_backends:
+                    rprint(f"[bold blue]Benchmarking {backend} on the {shape} DAG[/]")
+                    if backend in ("threads", "async"):
+                        run = run_inference_client(
+                            engine=backend,
+                            dataset=dataset,
+                            config_path=config_path,
+                            server=server,
+                            max_workers=max_workers,
+                            max_concurrent_requests=max_concurrent_requests,
+                        )
+                    else:
+                        run = run_vllm(
+                            streaming=backend == "vllm-streaming",
+                            dataset=dataset,
+                            config_path=config_path,
+                            latency_ms=latency_ms,
+                            batch_size=batch_size,
+                            response_tokens=response_tokens,
+                        )
+
+                    cell_latencies = run.pop("cell_latencies")
+                    results.append({
+                        "backend": backend,
+                        "shape": shape,
+                        "columns": num_columns,
+                        **run,
+                        "cells": len(cell_latencies),
+                        "rows_per_s": run["rows"] / run["elapsed_s"],
+                        "cells_per_s": len(cell_latencies) / run["elapsed_s"],
+                        "cell_latency_ms": percentiles(cell_latencies),
+                    })
+    finally:
+        if server is not None:
+            server.stop()
+
+    table = Table(title=f"Throughput ({num_rows} rows, {num_columns} columns)")
+    for header in ("Backend", "Shape", "Rows/s", "Cells/s", "p50 ms", "p95 ms", "p99 ms", "Max threads", "Retries"):
+        table.add_column(header)
+    for result in results:
+        table.add_row(
+            result["backend"],
+            result["shape"],
+            f"{result['rows_per_s']:.1f}",
+            f"{result['cells_per_s']:.1f}",
+            *(f"{result['cell_latency_ms'][p]:.1f}" for p in ("p50", "p95", "p99")),
+            str(result["max_threads"]),
+            str(result["retries"]),
+        )
+    rprint(table)
+
+    with open(output, "w") as f:
+        json.dump({
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "settings": {
+                "num_rows": num_rows,
+                "num_columns": num_columns,
+                "max_workers": max_workers,
+                "max_concurrent_requests": max_concurrent_requests,
+                "batch_size": batch_size,
+                "latency_ms": latency_ms,
+                "latency_distribution": latency_distribution,
+                "latency_spread": latency_spread,
+                "rate_limit_probability": rate_limit_probability,
+                "response_tokens": list(response_tokens),
+                "seed": seed,
+            },
+            "results": results,
+        }, f, indent=2)
+    rprint(f"[bold green]Results written to {output}[/]")
+
+    if baseline and not compare(results, baseline, tolerance):
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,77 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "rich",
+#     "typer",
+# ]
+# ///
+"""
+Check that the code shared by the generation scripts is identical in all of them.
+
+The generation scripts run as single files, e.g. with `hf jobs uv run <script URL>`, so they
+can't import a common module. The code they share lives between the shared code markers of
+each script instead, and with_inference_client.py holds the reference copy. Run this after
+changing that section, with --write to copy it into the other scripts.
+"""
+import difflib
+import os
+
+import typer
+from rich import print as rprint
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REFERENCE = "with_inference_client.py"
+COPIES = ("with_vllm.py",)
+BEGIN_MARKER = "# === Shared code: begin ===\n"
+END_MARKER = "# === Shared code: end ===\n"
+
+
+def split_shared_code(text: str, script: str) -> tuple[str, str, str]:
+    """Split a script into the code before its shared section, the shared section and the code after it."""
+    if text.count(BEGIN_MARKER) != 1 or text.count(END_MARKER) != 1:
+        raise ValueError(f"{script} must contain exactly one shared code section")
+    before, rest = text.split(BEGIN_MARKER)
+    shared, after = rest.split(END_MARKER)
+    return before, shared, after
+
+
+def main(*, write: bool = False):
+    """
+    Compare the shared code section of every script with the reference copy.
+
+    Args:
+        write: Replace the shared code of the other scripts with the reference copy instead
+            of failing when they differ (default: False).
+    """
+    with open(os.path.join(SCRIPTS_DIR, REFERENCE)) as f:
+        _, reference, _ = split_shared_code(f.read(), REFERENCE)
+
+    outdated = []
+    for script in COPIES:
+        path = os.path.join(SCRIPTS_DIR, script)
+        with open(path) as f:
+            before, shared, after = split_shared_code(f.read(), script)
+        if shared == reference:
+            continue
+
+        if write:
+            with open(path, "w") as f:
+                f.write(before + BEGIN_MARKER + reference + END_MARKER + after)
+            rprint(f"[bold green]Updated the shared code of {script}[/]")
+            continue
+
+        outdated.append(script)
+        diff = difflib.unified_diff(
+            reference.splitlines(keepends=True), shared.splitlines(keepends=True), REFERENCE, script)
+        rprint(f"[bold red]The shared code of {script} differs from {REFERENCE}:[/]")
+        print("".join(diff))
+
+    if outdated:
+        rprint("[bold red]Run check_shared_code.py --write to copy the reference shared code.[/]")
+        raise typer.Exit(code=1)
+    if not write:
+        rprint(f"[bold green]✓[/] Shared code is identical in {', '.join((REFERENCE, *COPIES))}.")
+
+
+if __name__ == "__main__":
+    typer.run(main)
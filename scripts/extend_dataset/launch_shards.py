@@ -0,0 +1,127 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "datasets",
+#     "huggingface-hub[hf_transfer]",
+#     "rich",
+#     "typer",
+# ]
+# ///
+"""
+Run with_inference_client.py or with_vllm.py over several source shards in parallel processes.
+
+Every worker processes one contiguous shard of the source dataset and writes its output shard
+to a shared directory. Once all of them succeed, the shards are merged back in source order
+and pushed as a single split. Options after `--` are forwarded to every worker:
+
+    python launch_shards.py with_inference_client.py me/source me/out --num-shards 4 -- \\
+        --config topics_extraction.config.yml
+"""
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import typer
+from rich import print as rprint
+
+app = typer.Typer()
+
+
+def _visible_gpus() -> list[str] | None:
+    """GPUs workers can be assigned, from CUDA_VISIBLE_DEVICES or nvidia-smi (None when unknown)."""
+    if "CUDA_VISIBLE_DEVICES" in os.environ:
+        return [gpu for gpu in os.environ["CUDA_VISIBLE_DEVICES"].split(",") if gpu.strip()]
+    if shutil.which("nvidia-smi") is None:
+        return None
+    result = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return [str(gpu) for gpu, line in enumerate(result.stdout.splitlines()) if line.startswith("GPU ")]
+
+
+@app.command(context_settings={"allow_extra_args": True, "ignore_unknown_options": True})
+def main(
+    ctx: typer.Context,
+    script: str,
+    repo_id: str,
+    destination: str,
+    *,
+    num_shards: int | None = None,
+    destination_split: str = "train",
+    output_dir: str | None = None,
+    gpus_per_shard: int | None = None,
+    create_pr: bool = False,
+    merge: bool = True,
+):
+    """
+    Launch one worker process per shard, then merge their outputs.
+
+    Args:
+        script: Generation script run by every worker.
+        repo_id: The dataset repository ID to augment.
+        destination: Destination repository ID of the merged dataset.
+        num_shards: Number of shards, and of worker processes (defaults to CPU count).
+        destination_split: Split name of the merged dataset (default: "train").
+        output_dir: Directory for the worker shards and logs (defaults to a temporary directory).
+        gpus_per_shard: GPUs made visible to each worker through CUDA_VISIBLE_DEVICES, 0 to leave it
+            unchanged (default: 1 for with_vllm.py, 0 otherwise).
+        create_pr: Whether to push the merged dataset as a pull request.
+        merge: Merge and push the shards once every worker succeeded (default: True).
+    """
+    num_shards = num_shards or multiprocessing.cpu_count()
+    if gpus_per_shard is None:
+        # vLLM workers sharing a GPU each try to claim most of its memory
+        gpus_per_shard = 1 if os.path.basename(script) == "with_vllm.py" else 0
+    gpus = _visible_gpus() if gpus_per_shard else None
+    if gpus is not None and num_shards * gpus_per_shard > len(gpus):
+        raise typer.BadParameter(
+            f"{num_shards} shards with {gpus_per_shard} GPU(s) each need {num_shards * gpus_per_shard} GPUs, "
+            f"but {len(gpus)} are visible: lower --num-shards or pass --gpus-per-shard 0 to share them"
+        )
+    output_dir = output_dir or tempfile.mkdtemp(prefix="extend_dataset_shards_")
+    os.makedirs(output_dir, exist_ok=True)
+
+    processes = []
+    for shard_index in range(num_shards):
+        env = dict(os.environ)
+        if gpus_per_shard:
+            first_gpu = shard_index * gpus_per_shard
+            shard_gpus = range(first_gpu, first_gpu + gpus_per_shard)
+            # Index into the devices already made visible to the launcher, if any
+            env["CUDA_VISIBLE_DEVICES"] = ",".join(gpus[gpu] if gpus else str(gpu) for gpu in shard_gpus)
+
+        command = [
+            sys.executable, script, repo_id, destination,
+            "--num-shards", str(num_shards),
+            "--shard-index", str(shard_index),
+            "--output-dir", output_dir,
+            "--destination-split", destination_split,
+            *ctx.args,
+        ]
+        log = open(os.path.join(output_dir, f"shard-{shard_index:05d}-of-{num_shards:05d}.log"), "w")
+        processes.append((subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT), log))
+
+    rprint(f"[bold green]Started {num_shards} workers, logs in {output_dir}[/]")
+
+    failed = []
+    for shard_index, (process, log) in enumerate(processes):
+        if process.wait() != 0:
+            failed.append(shard_index)
+        log.close()
+
+    if failed:
+        rprint(f"[bold red]Shards {failed} failed, see their logs in {output_dir}[/]")
+        raise typer.Exit(code=1)
+
+    if merge:
+        # Imported here so that launching the workers doesn't need to load datasets
+        from merge_shards import main as merge_shards
+
+        merge_shards(destination=destination, split=destination_split, shards_dir=output_dir, create_pr=create_pr)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,160 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "datasets",
+#     "huggingface-hub[hf_transfer]",
+#     "rich",
+#     "typer",
+# ]
+# ///
+"""
+Merge the output shards of a sharded run and push them as a single split.
+
+Workers started with --num-shards N --shard-index i write one output shard each, either to a
+shared local directory (--output-dir) or staged in the destination repo under shards/<split>/.
+The shards are concatenated in shard order, rows are restored to their source order within
+each shard, and staged shards are removed from the repo once the split is pushed. The column
+fingerprints written with the shards are recorded for the merged split, if all shards agree.
+"""
+import json
+import os
+import re
+from collections import defaultdict
+from glob import glob
+
+import typer
+from datasets import Dataset, concatenate_datasets, load_dataset
+from huggingface_hub import HfApi, hf_hub_download
+from huggingface_hub.errors import EntryNotFoundError
+from rich import print as rprint
+
+SOURCE_INDEX_COLUMN = "__source_row_index__"
+SHARD_PATTERN = re.compile(r"shard-(\d{5})-of-(\d{5})")
+FINGERPRINTS_PATH = ".fingerprints/{split}.json"
+
+
+def _list_shard_files(*, destination: str, split: str, shards_dir: str | None) -> dict[str, list[str]]:
+    """Map every shard name to its Parquet files, found in shards_dir or staged in the destination repo."""
+    files = defaultdict(list)
+    if shards_dir:
+        for name in os.listdir(shards_dir):
+            if SHARD_PATTERN.fullmatch(name):
+                files[name] = sorted(glob(os.path.join(shards_dir, name, f"{split}-*.parquet")))
+        return files
+
+    for path in HfApi().list_repo_files(destination, repo_type="dataset"):
+        parts = path.split("/")
+        if len(parts) == 4 and parts[:2] == ["shards", split] and SHARD_PATTERN.fullmatch(parts[2]):
+            # A shard without any rows is only staged with its fingerprints
+            shard = files[parts[2]]
+            if parts[3].endswith(".parquet"):
+                shard.append(f"hf://datasets/{destination}/{path}")
+    return files
+
+
+def _check_shards(shard_names: list[str]) -> None:
+    """Check that the shards come from a single run and that none of them is missing."""
+    if not shard_names:
+        raise ValueError("No shards found")
+
+    matches = [SHARD_PATTERN.fullmatch(name) for name in shard_names]
+    totals = {int(match.group(2)) for match in matches}
+    if len(totals) > 1:
+        raise ValueError(f"Found shards of runs with different numbers of shards: {sorted(totals)}")
+
+    num_shards = totals.pop()
+    if missing := sorted(set(range(num_shards)) - {int(match.group(1)) for match in matches}):
+        raise ValueError(f"Missing shards {missing} of {num_shards}")
+
+
+def _shard_fingerprints(
+    *,
+    destination: str,
+    split: str,
+    shards_dir: str | None,
+    shard_names: list[str],
+) -> dict | None:
+    """Return the column fingerprints written with the shards, or None unless every shard has the same ones."""
+    fingerprints = []
+    for name in shard_names:
+        try:
+            if shards_dir:
+                path = os.path.join(shards_dir, name, "fingerprints.json")
+            else:
+                path = hf_hub_download(destination, f"shards/{split}/{name}/fingerprints.json", repo_type="dataset")
+            with open(path) as f:
+                fingerprints.append(json.load(f))
+        except (EntryNotFoundError, FileNotFoundError):
+            return None
+
+    if any(shard_fingerprints != fingerprints[0] for shard_fingerprints in fingerprints):
+        rprint("[yellow]Warning: shards were generated with different column configs, no fingerprints are recorded.")
+        return None
+    return fingerprints[0] if fingerprints else None
+
+
+def merge_shards(shard_files: dict[str, list[str]]) -> Dataset:
+    """Concatenate shards in shard order, with the rows of each shard sorted back into source order."""
+    _check_shards(list(shard_files))
+
+    shards = []
+    for name in sorted(shard_files):
+        if not shard_files[name]:
+            # Shard without any rows
+            continue
+        shard = load_dataset("parquet", data_files=shard_files[name], split="train")
+        shards.append(shard.sort(SOURCE_INDEX_COLUMN).remove_columns(SOURCE_INDEX_COLUMN))
+
+    return concatenate_datasets(shards)
+
+
+def main(
+    *,
+    destination: str,
+    split: str = "train",
+    shards_dir: str | None = None,
+    create_pr: bool = False,
+    keep_shards: bool = False,
+):
+    """
+    Merge shards and push the merged split to the destination repo.
+
+    Args:
+        destination: Destination repository ID, where shards are staged unless shards_dir is set.
+        split: Split written by the workers (their --destination-split).
+        shards_dir: Local directory the workers wrote their shards to (their --output-dir).
+        create_pr: Whether to push the merged split as a pull request.
+        keep_shards: Keep the shards staged in the destination repo after the merge.
+    """
+    shard_files = _list_shard_files(destination=destination, split=split, shards_dir=shards_dir)
+    dataset = merge_shards(shard_files)
+    rprint(f"[bold green]Merged {len(shard_files)} shards into {dataset.num_rows} rows[/]")
+
+    commit_info = dataset.push_to_hub(destination, split=split, create_pr=create_pr)
+
+    fingerprints = _shard_fingerprints(
+        destination=destination, split=split, shards_dir=shards_dir, shard_names=sorted(shard_files))
+    if fingerprints is not None:
+        # With create_pr, the fingerprints go to the pull request opened by push_to_hub
+        HfApi().upload_file(
+            path_or_fileobj=json.dumps(fingerprints, indent=2, sort_keys=True).encode("utf-8"),
+            path_in_repo=FINGERPRINTS_PATH.format(split=split),
+            repo_id=destination,
+            repo_type="dataset",
+            revision=commit_info.pr_revision,
+            commit_message=f"Record the column fingerprints of the {split} split",
+        )
+
+    if not shards_dir and not keep_shards:
+        HfApi().delete_folder(
+            f"shards/{split}",
+            repo_id=destination,
+            repo_type="dataset",
+            commit_message=f"Remove the merged shards of the {split} split",
+        )
+
+    rprint(f"[bold green]Dataset successfully pushed to https://huggingface.co/datasets/{destination}[/]")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,242 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "typer",
+# ]
+# ///
+"""
+Local OpenAI-compatible chat completions server with simulated latency, rate limits and
+response lengths, to measure the pipeline offline without spending provider credits.
+
+Point the inference client pipeline at it with --base-url, or start it in-process from a
+benchmark with MockInferenceServer. GET /stats returns the request counters.
+"""
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import typer
+
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "lognormal")
+
+
+class MockInferenceServer:
+    """
+    Threaded HTTP server answering /chat/completions requests like an inference provider.
+
+    Every request sleeps for a latency drawn from latency_distribution around latency_ms:
+    uniform within ± latency_spread ms, or lognormal with median latency_ms and sigma
+    latency_spread. A rate_limit_probability share of requests is rejected with a 429 and a
+    Retry-After header, and completions are response_tokens words long.
+    """
+
+    def __init__(
+        self,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 100,
+        latency_distribution: str = "constant",
+        latency_spread: float = 0,
+        rate_limit_probability: float = 0,
+        retry_after: float = 1,
+        response_tokens: tuple[int, int] = (20, 200),
+        seed: int | None = None,
+    ) -> None:
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown latency distribution: {latency_distribution}. Expected one of {LATENCY_DISTRIBUTIONS}.")
+
+        self.latency_ms = latency_ms
+        self.latency_distribution = latency_distribution
+        self.latency_spread = latency_spread
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.response_tokens = response_tokens
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockInferenceServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve in the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "MockInferenceServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "max_in_flight": self.max_in_flight,
+        }
+
+    def _sample_latency(self) -> float:
+        """Return the latency of a request, in seconds."""
+        with self._lock:
+            if self.latency_distribution == "uniform":
+                latency_ms = self._random.uniform(
+                    self.latency_ms - self.latency_spread, self.latency_ms + self.latency_spread)
+            elif self.latency_distribution == "lognormal":
+                latency_ms = self._random.lognormvariate(math.log(self.latency_ms), self.latency_spread)
+            else:
+                latency_ms = self.latency_ms
+        return max(0.0, latency_ms) / 1000
+
+    def _respond(self, body: dict) -> tuple[int, dict, dict]:
+        """Return the status, headers and JSON payload answering a chat completion request."""
+        with self._lock:
+            self.requests += 1
+            rate_limited = self._random.random() < self.rate_limit_probability
+            num_tokens = self._random.randint(*self.response_tokens)
+            if rate_limited:
+                self.rate_limited += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        try:
+            time.sleep(self._sample_latency())
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        if rate_limited:
+            return 429, {"Retry-After": str(self.retry_after)}, {"error": "Rate limit exceeded"}
+
+        prompt = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+        return 200, {}, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(["token"] * num_tokens)},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": num_tokens,
+                "total_tokens": len(prompt) // 4 + num_tokens,
+            },
+        }
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections alive between requests, like a real provider
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path.rstrip("/").endswith("/chat/completions"):
+                    status, headers, payload = server._respond(body)
+                else:
+                    status, headers, payload = 404, {}, {"error": f"Unknown route {self.path}"}
+                self._send(status, headers, payload)
+
+            def do_GET(self) -> None:
+                if self.path.rstrip("/") == "/stats":
+                    status, payload = 200, server.stats()
+                else:
+                    status, payload = 404, {"error": f"Unknown route {self.path}"}
+                self._send(status, {}, payload)
+
+            def _send(self, status: int, headers: dict, payload: dict) -> None:
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        return Handler
+
+
+def main(
+    *,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    latency_ms: float = 100,
+    latency_distribution: str = "constant",
+    latency_spread: float = 0,
+    rate_limit_probability: float = 0,
+    retry_after: float = 1,
+    min_response_tokens: int = 20,
+    max_response_tokens: int = 200,
+    seed: int | None = None,
+):
+    """
+    Serve mock chat completions until interrupted.
+
+    Args:
+        host: Interface to listen on (default: 127.0.0.1).
+        port: Port to listen on (default: 8000).
+        latency_ms: Median latency of a request in milliseconds (default: 100).
+        latency_distribution: "constant", "uniform" or "lognormal" (default: "constant").
+        latency_spread: Half-width in milliseconds for "uniform", sigma for "lognormal".
+        rate_limit_probability: Share of requests rejected with a 429 (default: 0).
+        retry_after: Retry-After header of 429 responses, in seconds (default: 1).
+        min_response_tokens: Minimum number of words per completion (default: 20).
+        max_response_tokens: Maximum number of words per completion (default: 200).
+        seed: Random seed, for reproducible runs.
+    """
+    server = MockInferenceServer(
+        host=host,
+        port=port,
+        latency_ms=latency_ms,
+        latency_distribution=latency_distribution,
+        latency_spread=latency_spread,
+        rate_limit_probability=rate_limit_probability,
+        retry_after=retry_after,
+        response_tokens=(min_response_tokens, max_response_tokens),
+        seed=seed,
+    )
+    print(f"Serving mock chat completions on {server.url}/v1/chat/completions")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    typer.run(main)
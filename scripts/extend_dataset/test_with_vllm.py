@@ -0,0 +1,143 @@
+"""
+CPU checks of the vLLM generation scheduling, run with `pytest` from this directory.
+
+Models are replaced by stubs answering every prompt with their model name and the prompt, so
+the tests need neither vLLM nor a GPU.
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+import yaml
+from datasets import Dataset
+
+from with_vllm import (
+    SimulatedStreamingEngine,
+    _model_schedule,
+    _topological_levels,
+    generate_passes,
+    load_processor_config,
+    stream_columns,
+)
+
+
+class StubLLM:
+    """Stand-in for vllm.LLM answering every prompt with `<model>(<prompt>)`."""
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+
+    def answer(self, prompt: str) -> str:
+        return f"{self.model}({prompt})"
+
+    def chat(self, messages: list[list[dict]], sampling_params=None, **kwargs) -> list:
+        return [
+            SimpleNamespace(
+                outputs=[SimpleNamespace(text=self.answer(message[-1]['content']), token_ids=[])],
+                prompt_token_ids=[],
+                num_cached_tokens=0,
+            )
+            for message in messages
+        ]
+
+
+class EchoLLM(StubLLM):
+    """Stand-in for vllm.LLM answering like SimulatedStreamingEngine."""
+
+    def answer(self, prompt: str) -> str:
+        return f"Generated from: {prompt}"
+
+
+@pytest.fixture
+def dataset() -> Dataset:
+    return Dataset.from_dict({"text": [f"row{idx}" for idx in range(5)]})
+
+
+def _processor_config(tmp_path, dataset: Dataset, columns: dict[str, tuple[str, list[str]]]):
+    """Load a config of columns given as name -> (model, referenced columns)."""
+    path = tmp_path / "config.yml"
+    path.write_text(yaml.safe_dump({"columns": {
+        name: {
+            "modelName": model,
+            "modelProvider": "local",
+            "prompt": f"{name.upper()} " + " ".join(f"{{{{{ref}}}}}" for ref in references),
+            "columnsReferences": references,
+        }
+        for name, (model, references) in columns.items()
+    }}))
+    return load_processor_config(dataset=dataset, config_path=str(path), num_rows=dataset.num_rows, batch_size=2)
+
+
+def test_model_schedule_swaps_back_to_a_model(tmp_path, dataset):
+    processor_config = _processor_config(tmp_path, dataset, {
+        "a": ("m1", ["text"]),
+        "b": ("m2", ["a"]),
+        "c": ("m1", ["b"]),
+    })
+
+    assert _topological_levels(processor_config.columns, processor_config.reverse_graph) == [["a"], ["b"], ["c"]]
+    assert processor_config.model_schedule == [("m1", ["a"]), ("m2", ["b"]), ("m1", ["c"])]
+
+
+def test_model_schedule_runs_every_ready_column_of_a_model(tmp_path, dataset):
+    processor_config = _processor_config(tmp_path, dataset, {
+        "a": ("m1", ["text"]),
+        "b": ("m2", ["a"]),
+        "c": ("m1", ["text"]),
+        "d": ("m1", ["a"]),
+    })
+
+    # m1 generates its three columns over two dependency levels before m2 is loaded once
+    assert _model_schedule(
+        processor_config.columns, processor_config.reverse_graph, processor_config.column_model,
+    ) == [("m1", ["a", "c"]), ("m1", ["d"]), ("m2", ["b"])]
+
+
+def test_generate_passes_loads_models_in_schedule_order(tmp_path, dataset):
+    processor_config = _processor_config(tmp_path, dataset, {
+        "a": ("m1", ["text"]),
+        "b": ("m2", ["a"]),
+        "c": ("m1", ["b"]),
+    })
+    loaded = []
+
+    def llm_factory(model: str) -> StubLLM:
+        loaded.append(model)
+        return StubLLM(model)
+
+    output = generate_passes(
+        dataset=dataset,
+        passes=processor_config.model_schedule,
+        llm_factory=llm_factory,
+        processor_config=processor_config,
+    )
+
+    assert loaded == ["m1", "m2", "m1"]
+    assert output.to_list() == [
+        {"text": text, "a": f"m1(A {text})", "b": f"m2(B m1(A {text}))", "c": f"m1(C m2(B m1(A {text})))"}
+        for text in dataset["text"]
+    ]
+
+
+def test_streaming_matches_batch_generation(tmp_path, dataset):
+    processor_config = _processor_config(tmp_path, dataset, {
+        "a": ("m1", ["text"]),
+        "b": ("m1", ["a"]),
+        "c": ("m1", ["a", "text"]),
+    })
+    batch = generate_passes(
+        dataset=dataset,
+        passes=processor_config.model_schedule,
+        llm_factory=EchoLLM,
+        processor_config=processor_config,
+    )
+    # Latencies vary with the prompt so that requests complete out of row order
+    engine = SimulatedStreamingEngine(latency=lambda messages: 0.001 * (hash(messages[-1]['content']) % 7))
+
+    streamed = asyncio.run(stream_columns(
+        dataset=dataset, engine=engine, processor_config=processor_config, max_rows_in_flight=2,
+    ))
+
+    assert engine.max_in_flight > 1
+    assert streamed.column_names == batch.column_names
+    assert streamed.to_list() == batch.to_list()
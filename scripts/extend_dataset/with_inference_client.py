@@ -7,28 +7,1205 @@
 #     "typer",
 # ]
 # ///
+from __future__ import annotations
 
+import asyncio
+import bisect
+import hashlib
+import json
 import multiprocessing
+import os
 import random
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
 import time
 import traceback
-from collections import defaultdict, deque
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Callable
 
 import requests
 import typer
 import yaml
-from datasets import Dataset, load_dataset
-from huggingface_hub import InferenceClient
 from rich import print as rprint
 from rich.console import Console
 from rich.panel import Panel
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn
 
+# datasets, pyarrow and the inference clients take seconds to import, so they are only imported
+# where they are used. --help and --validate-only never need them.
+if TYPE_CHECKING:
+    import pyarrow.parquet as pq
+    from datasets import Dataset, Features, IterableDataset
+    from huggingface_hub import AsyncInferenceClient, CommitOperationAdd, InferenceClient
+
+
+# === Shared code: begin ===
+# The generation scripts run as single files (e.g. `hf jobs uv run <script URL>`), so the code they
+# share is copied into both. This section is identical in with_inference_client.py and with_vllm.py:
+# edit it in with_inference_client.py, then run `python check_shared_code.py --write`.
+
+
+class CompletionCache:
+    """
+    Persistent, content-addressed cache of model completions backed by SQLite.
+
+    Entries are keyed by a hash of the provider, model, sampling parameters and materialized
+    prompt, so reruns with an unchanged column config reuse previous completions. When the
+    cache grows over max_size_mb, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 1024) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, completion TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    @staticmethod
+    def make_key(provider: str, model: str, params: dict, prompt: str) -> str:
+        payload = json.dumps([provider, model, params, prompt], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT completion FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, completion: str) -> None:
+        size = len(key) + len(completion.encode("utf-8"))
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, completion, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, completion, size, time.time()),
+            )
+            self._size += size - (previous[0] if previous else 0)
+            self.writes += 1
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Evict down to 90% of the limit so we don't evict again on the very next write
+        target = int(self.max_size * 0.9)
+        while self._size > target:
+            oldest = self._conn.execute(
+                "SELECT key, size FROM completions ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not oldest:
+                break
+
+            to_delete = []
+            for key, size in oldest:
+                if self._size <= target:
+                    break
+                to_delete.append((key,))
+                self._size -= size
+
+            self._conn.executemany("DELETE FROM completions WHERE key = ?", to_delete)
+            self.evictions += len(to_delete)
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return "\n".join([
+            f"[bold blue]Completion cache[/] ({self.path})",
+            f"• Hits: [cyan]{self.hits}[/] / {lookups} lookups ({hit_rate:.1%})",
+            f"• Writes: [cyan]{self.writes}[/]",
+            f"• Evictions: [cyan]{self.evictions}[/]",
+            f"• Size: [cyan]{self._size / 1024 / 1024:.1f}[/] / {self.max_size / 1024 / 1024:.0f} MB",
+        ])
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class PromptTemplate:
+    """
+    A column prompt parsed once into literal segments and {{column}} placeholder slots.
+
+    Rendering formats all slots with a single pre-built format string, instead of scanning the
+    prompt for every key of the row. Placeholders that can't be filled are kept verbatim.
+    """
+
+    PLACEHOLDER_PATTERN = re.compile(r"\{\{([^{}]+)\}\}")
+
+    def __init__(self, template: str) -> None:
+        self.template = template
+        self.literals = self.PLACEHOLDER_PATTERN.split(template)[::2]
+        self.placeholders = self.PLACEHOLDER_PATTERN.findall(template)
+        self.columns = set(self.placeholders)
+
+        escaped = [literal.replace("{", "{{").replace("}", "}}") for literal in self.literals]
+        self._format = "".join(
+            f"{literal}{{{idx}}}" for idx, literal in enumerate(escaped[:-1])
+        ) + escaped[-1]
+
+    def render(self, row: dict) -> str:
+        return self._format.format(*[
+            str(row[name]) if name in row else f"{{{{{name}}}}}"
+            for name in self.placeholders
+        ])
+
+    def render_batch(self, batch: dict[str, list], num_rows: int) -> list[str]:
+        """Render the template for every row of a columnar batch."""
+        columns = [
+            batch[name] if name in batch else [f"{{{{{name}}}}}"] * num_rows
+            for name in self.placeholders
+        ]
+        return [
+            self._format.format(*[str(value) for value in values])
+            for values in zip(*columns)
+        ] if columns else [self.template] * num_rows
+
+
+# YAML column keys holding generation parameters, mapped to their sampling parameter names
+GENERATION_PARAMS = {
+    'maxTokens': 'max_tokens',
+    'stop': 'stop',
+    'temperature': 'temperature',
+    'topP': 'top_p',
+    'guided': 'guided',
+}
+
+
+GUIDED_OUTPUT_TYPES = ('json', 'regex', 'choice')
+
+
+def _generation_params(column: str, config: dict) -> dict:
+    """
+    Collect the generation parameters set in a column config, keyed by sampling parameter name.
+
+    `guided` constrains the output with exactly one of a JSON schema (`json`), a regular
+    expression (`regex`) or a list of allowed answers (`choice`).
+    """
+    params = {name: config[key] for key, name in GENERATION_PARAMS.items() if config.get(key) is not None}
+    if isinstance(params.get('stop'), str):
+        params['stop'] = [params['stop']]
+
+    if 'guided' in params:
+        guided = params['guided']
+        if not isinstance(guided, dict) or len(guided) != 1 or next(iter(guided)) not in GUIDED_OUTPUT_TYPES:
+            raise ValueError(f"guided of {column} must set exactly one of {GUIDED_OUTPUT_TYPES}, got {guided}")
+        if isinstance(guided.get('json'), str):
+            params['guided'] = {'json': json.loads(guided['json'])}
+
+    return params
+
+
+# Source columns carried through generation: all of them, only the ones the prompts reference, or
+# only those while the untouched ones are joined back by row index when the output is written
+SOURCE_PROJECTIONS = ("all", "referenced", "join")
+
+
+def _referenced_source_columns(source_columns: set[str], columns: dict[str, dict]) -> set[str]:
+    """Return the source columns read by the generated columns, as columnsReferences or prompt placeholders."""
+    referenced = set()
+    for config in columns.values():
+        referenced.update(config.get('columnsReferences') or [])
+        referenced.update(PromptTemplate(config['prompt']).columns)
+    return referenced & source_columns
+
+
+# Per-column fingerprints of a generated split, committed next to its data files. Paths starting
+# with a dot are ignored when the dataset is loaded.
+FINGERPRINTS_PATH = ".fingerprints/{split}.json"
+
+
+def _column_fingerprints(columns: dict[str, dict], targets: dict[str, tuple[str, str]]) -> dict[str, str]:
+    """
+    Fingerprint every generated column from its prompt, (provider, model) target, generation
+    parameters, dtype and the fingerprints of the generated columns it references.
+
+    Changing the config of a column changes the fingerprint of all its descendants, so comparing
+    fingerprints with a previous run finds every column that has to be regenerated.
+    """
+    fingerprints = {}
+
+    def fingerprint(column: str, visiting: frozenset = frozenset()) -> str:
+        if column in visiting:
+            raise ValueError(f"Circular dependencies detected between columns: {sorted(visiting)}")
+        if column not in fingerprints:
+            config = columns[column]
+            payload = {
+                "prompt": config['prompt'],
+                "target": list(targets[column]),
+                "params": _generation_params(column, config),
+                "dtype": config.get('dtype'),
+                # Source columns only contribute their name
+                "references": {
+                    ref: fingerprint(ref, visiting | {column}) if ref in columns else None
+                    for ref in sorted(config.get('columnsReferences') or [])
+                },
+            }
+            payload = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+            fingerprints[column] = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        return fingerprints[column]
+
+    for column in columns:
+        fingerprint(column)
+    return fingerprints
+
+
+def _stale_columns(
+    fingerprints: dict[str, str],
+    previous_fingerprints: dict[str, str],
+    available_columns: set[str],
+) -> tuple[set[str], set[str]]:
+    """
+    Compare column fingerprints with the ones recorded in a previous output.
+
+    Returns:
+        The configured columns to regenerate, because they changed or are missing from the
+        previous output, and the columns of the previous output to drop before regenerating,
+        which also covers generated columns removed from the config since.
+    """
+    stale = {
+        column for column, fingerprint in fingerprints.items()
+        if column not in available_columns or previous_fingerprints.get(column) != fingerprint
+    }
+    dropped = (stale | (previous_fingerprints.keys() - fingerprints.keys())) & available_columns
+    return stale, dropped
+
+
+def _load_fingerprints(repo_id: str, split: str) -> dict[str, str]:
+    """Load the column fingerprints recorded with a generated split, or none if it has no record."""
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.errors import EntryNotFoundError
+
+    try:
+        path = hf_hub_download(repo_id, FINGERPRINTS_PATH.format(split=split), repo_type="dataset")
+    except EntryNotFoundError:
+        rprint(f"[yellow]Warning: {repo_id} has no column fingerprints for {split}, every column is regenerated.")
+        return {}
+
+    with open(path) as f:
+        return json.load(f)["columns"]
+
+
+def _hub_split_metadata(repo_id: str, split: str, subset: str | None = None) -> tuple[list[str] | None, int | None]:
+    """
+    Read the column names and row count of a Hub dataset split without loading the dataset.
+
+    The split info of the dataset card is used when it has both, otherwise the footers of the
+    split's Parquet files: the ones pushed by the datasets library (or these scripts), then the
+    Hub's Parquet conversion. Values that can't be determined are None, including when the Hub
+    can't be reached or repo_id isn't a Hub dataset, e.g. a local directory.
+    """
+    try:
+        return _read_hub_split_metadata(repo_id, split, subset)
+    except _hub_unavailable_errors():
+        return None, None
+
+
+def _hub_unavailable_errors() -> tuple[type[Exception], ...]:
+    """Return the errors of Hub requests that can't be answered, as opposed to bugs."""
+    import importlib
+
+    from huggingface_hub.errors import HfHubHTTPError, HFValidationError
+
+    errors = [HfHubHTTPError, HFValidationError, OSError]
+    # Connection errors of the HTTP client of huggingface_hub aren't OSErrors
+    for module in ("httpx", "httpx2"):
+        try:
+            errors.append(importlib.import_module(module).TransportError)
+        except ImportError:
+            pass
+    return tuple(errors)
+
+
+def _read_hub_split_metadata(repo_id: str, split: str, subset: str | None) -> tuple[list[str] | None, int | None]:
+    from huggingface_hub import HfApi
+    from huggingface_hub.errors import RevisionNotFoundError
+
+    api = HfApi()
+    config_name = subset or "default"
+    columns = None
+
+    card_data = api.dataset_info(repo_id).card_data
+    infos = card_data.get("dataset_info") if card_data else None
+    for info in (infos if isinstance(infos, list) else [infos] if infos else []):
+        if info.get("config_name", "default") != config_name:
+            continue
+        columns = [feature["name"] for feature in info.get("features", []) if "name" in feature] or None
+        num_rows = next((s.get("num_examples") for s in info.get("splits", []) if s.get("name") == split), None)
+        if columns and num_rows is not None:
+            return columns, num_rows
+
+    for revision, prefix in ((None, f"{subset or 'data'}/{split}-"), ("refs/convert/parquet", f"{config_name}/{split}/")):
+        try:
+            files = [
+                path for path in api.list_repo_files(repo_id, repo_type="dataset", revision=revision)
+                if path.startswith(prefix) and path.endswith(".parquet")
+            ]
+        except RevisionNotFoundError:
+            continue
+        if files:
+            return _parquet_metadata(repo_id, files, revision=revision)
+
+    return columns, None
+
+
+def _parquet_metadata(repo_id: str, files: list[str], revision: str | None = None) -> tuple[list[str], int]:
+    """Sum the row counts in the footers of Parquet files of a dataset repo, reading only the footers."""
+    import pyarrow.parquet as pq
+    from huggingface_hub import HfFileSystem
+
+    fs = HfFileSystem()
+    num_rows = 0
+    for path in files:
+        with fs.open(f"datasets/{repo_id}/{path}", revision=revision) as f:
+            metadata = pq.read_metadata(f)
+        num_rows += metadata.num_rows
+    return metadata.schema.to_arrow_schema().names, num_rows
+
+
+class LatencyHistogram:
+    """Histogram of durations in seconds, with fixed bucket bounds like a Prometheus histogram."""
+
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self) -> None:
+        # The last bucket counts durations over the largest bound
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket, like Prometheus' histogram_quantile."""
+        rank = q * self.count
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if idx == len(self.BUCKETS):
+                    return self.BUCKETS[-1]
+                lower = self.BUCKETS[idx - 1] if idx else 0.0
+                return lower + (self.BUCKETS[idx] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            **{f"p{int(q * 100)}": self.quantile(q) for q in (0.5, 0.95, 0.99)},
+        }
+
+
+class RunMetrics:
+    """
+    Per-column request metrics of a run, shared by every worker.
+
+    Latency covers a single model request. Queue wait is the time a ready cell spent before its
+    request was sent (worker pool, connection slots and rate limiter delays), and source wait
+    the time spent blocked on the source stream, so a slow run can be attributed to the
+    provider, the scheduler or the source. Metrics can be served in the Prometheus text format
+    during the run, and written as a JSON summary at the end.
+    """
+
+    COUNTERS = (
+        "requests",
+        "cache_hits",
+        "rate_limited",
+        "retries",
+        "failures",
+        "prompt_tokens",
+        "completion_tokens",
+        "rate_limit_wait",
+    )
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.rows_completed = 0
+        self.rows_failed = 0
+        self.source_wait = 0.0
+        self.columns = defaultdict(lambda: {
+            **dict.fromkeys(self.COUNTERS, 0),
+            "latency": LatencyHistogram(),
+            "queue_wait": LatencyHistogram(),
+        })
+
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def increment(self, column: str, counter: str, value: float = 1) -> None:
+        with self._lock:
+            self.columns[column][counter] += value
+
+    def observe_request(self, column: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        with self._lock:
+            metrics = self.columns[column]
+            metrics["requests"] += 1
+            metrics["prompt_tokens"] += prompt_tokens
+            metrics["completion_tokens"] += completion_tokens
+            metrics["latency"].observe(latency)
+
+    def observe_queue_wait(self, column: str, seconds: float) -> None:
+        with self._lock:
+            self.columns[column]["queue_wait"].observe(seconds)
+
+    def latency_quantile(self, column: str, q: float, min_count: int = 1) -> float | None:
+        """Return a quantile of the request latency of a column, or None before min_count requests."""
+        with self._lock:
+            if column not in self.columns or self.columns[column]["latency"].count < min_count:
+                return None
+            return self.columns[column]["latency"].quantile(q)
+
+    def add_source_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.source_wait += seconds
+
+    def row_completed(self, count: int = 1) -> None:
+        with self._lock:
+            self.rows_completed += count
+
+    def row_failed(self, count: int = 1) -> None:
+        with self._lock:
+            self.rows_failed += count
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed = self.elapsed
+            columns = {
+                column: {
+                    **{counter: metrics[counter] for counter in self.COUNTERS},
+                    "completion_tokens_per_s": metrics["completion_tokens"] / elapsed if elapsed else 0.0,
+                    "latency_s": metrics["latency"].to_dict(),
+                    "queue_wait_s": metrics["queue_wait"].to_dict(),
+                }
+                for column, metrics in self.columns.items()
+            }
+            totals = {
+                counter: sum(metrics[counter] for metrics in columns.values()) for counter in self.COUNTERS
+            }
+            return {
+                "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+                "elapsed_s": elapsed,
+                "rows_completed": self.rows_completed,
+                "rows_failed": self.rows_failed,
+                "rows_per_s": self.rows_completed / elapsed if elapsed else 0.0,
+                "source_wait_s": self.source_wait,
+                "totals": {
+                    **totals,
+                    "completion_tokens_per_s": totals["completion_tokens"] / elapsed if elapsed else 0.0,
+                },
+                "columns": columns,
+            }
+
+    def write_json(self, path: str) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def add(name: str, kind: str, help_text: str, samples: list[tuple[str, float]]) -> None:
+            lines.extend([f"# HELP extend_dataset_{name} {help_text}", f"# TYPE extend_dataset_{name} {kind}"])
+            lines.extend(f"extend_dataset_{sample} {value}" for sample, value in samples)
+
+        with self._lock:
+            columns = sorted(self.columns.items())
+            for counter, help_text in (
+                ("requests", "Model requests that returned a completion."),
+                ("cache_hits", "Cells served from the completion cache."),
+                ("rate_limited", "Requests rejected with a 429."),
+                ("retries", "Requests retried after a 429."),
+                ("failures", "Cells that failed."),
+                ("prompt_tokens", "Prompt tokens of the model requests."),
+                ("completion_tokens", "Completion tokens of the model requests."),
+                ("rate_limit_wait", "Seconds requests were delayed by the rate limiter."),
+            ):
+                name = f"{counter}_seconds_total" if counter == "rate_limit_wait" else f"{counter}_total"
+                add(name, "counter", help_text, [
+                    (f'{name}{{column="{column}"}}', metrics[counter]) for column, metrics in columns
+                ])
+
+            for histogram, help_text in (
+                ("latency", "Latency of a model request."),
+                ("queue_wait", "Time a ready cell waited before its request was sent."),
+            ):
+                name = f"request_{histogram}_seconds" if histogram == "latency" else f"{histogram}_seconds"
+                samples = []
+                for column, metrics in columns:
+                    cumulative = 0
+                    for bound, count in zip((*LatencyHistogram.BUCKETS, "+Inf"), metrics[histogram].counts):
+                        cumulative += count
+                        samples.append((f'{name}_bucket{{column="{column}",le="{bound}"}}', cumulative))
+                    samples.append((f'{name}_sum{{column="{column}"}}', metrics[histogram].sum))
+                    samples.append((f'{name}_count{{column="{column}"}}', metrics[histogram].count))
+                add(name, "histogram", help_text, samples)
+
+            add("rows_completed_total", "counter", "Rows generated.", [("rows_completed_total", self.rows_completed)])
+            add("rows_failed_total", "counter", "Rows with failed cells.", [("rows_failed_total", self.rows_failed)])
+            add("source_wait_seconds_total", "counter", "Seconds spent waiting on the source stream.",
+                [("source_wait_seconds_total", self.source_wait)])
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> None:
+        """Serve the metrics on http://host:port/metrics from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                data = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def summary(self) -> str:
+        summary = self.to_dict()
+        lines = [
+            "[bold blue]Run metrics[/]",
+            f"• Rows: [cyan]{summary['rows_completed']}[/] completed, {summary['rows_failed']} failed "
+            f"({summary['rows_per_s']:.2f} rows/s)",
+            f"• Source wait: [cyan]{summary['source_wait_s']:.1f}s[/]",
+        ]
+        for column, metrics in summary["columns"].items():
+            latency, queue_wait = metrics["latency_s"], metrics["queue_wait_s"]
+            lines.append(
+                f"• [cyan]{column}[/]: {metrics['requests']} requests "
+                f"(p50 {latency['p50']:.2f}s, p95 {latency['p95']:.2f}s, p99 {latency['p99']:.2f}s), "
+                f"queue wait p95 {queue_wait['p95']:.2f}s, "
+                f"{metrics['prompt_tokens']} → {metrics['completion_tokens']} tokens "
+                f"({metrics['completion_tokens_per_s']:.1f} tokens/s), {metrics['cache_hits']} cache hits, "
+                f"{metrics['rate_limited']} rate limited, {metrics['retries']} retries, {metrics['failures']} failures"
+            )
+        return "\n".join(lines)
+
+
+# === Shared code: end ===
+
+
+class DedupTable:
+    """
+    Futures (or tasks) of the requests of deduplicated cells, by (column, prompt).
+
+    Entries stay while their request is in flight, so duplicates wait on it. Completed entries are
+    kept for later duplicates up to max_completed of them, dropping the least recently used ones,
+    so the table doesn't grow with the number of unique prompts in the stream.
+    """
+
+    def __init__(self, max_completed: int) -> None:
+        self.max_completed = max_completed
+        self._entries: dict[tuple[str, str], object] = {}
+        self._completed: OrderedDict[tuple[str, str], None] = OrderedDict()
+
+    def get(self, key: tuple[str, str]):
+        """Return the future of a prompt, or None if it was never requested or was dropped."""
+        if key in self._completed:
+            self._completed.move_to_end(key)
+        return self._entries.get(key)
+
+    def add(self, key: tuple[str, str], future) -> None:
+        self._entries[key] = future
+
+    def complete(self, key: tuple[str, str]) -> None:
+        """Record that the request of a prompt succeeded, dropping the least recently used completed ones."""
+        if key not in self._entries:
+            return
+        self._completed[key] = None
+        while len(self._completed) > self.max_completed:
+            dropped, _ = self._completed.popitem(last=False)
+            del self._entries[dropped]
+
+    def discard(self, key: tuple[str, str]) -> None:
+        """Forget a prompt, e.g. after its request failed, so that later duplicates retry it."""
+        self._entries.pop(key, None)
+        self._completed.pop(key, None)
+
+
+class RowCheckpointer:
+    """
+    Periodically writes completed rows to local Parquet shards so interrupted runs can resume.
+
+    Each row is tagged with its index in the source dataset. Shards live in a directory named
+    after the hash of the run configuration, so a changed config never resumes from stale rows.
+    The number of rows isn't part of that configuration: a run with fewer rows only restores
+    the checkpointed rows it would have generated.
+    """
+
+    INDEX_COLUMN = "__source_row_index__"
+
+    def __init__(self, directory: str, every: int = 1000) -> None:
+        self.directory = directory
+        self.every = every
+        self._buffer: list[dict] = []
+        os.makedirs(directory, exist_ok=True)
+        self._num_shards = len(self._shard_files())
+
+    def _shard_files(self) -> list[str]:
+        return sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.startswith("rows-") and name.endswith(".parquet")
+        )
+
+    def checkpointed_indices(self, num_rows: int | None = None) -> set[int]:
+        """Return the source indices of the rows checkpointed by previous runs, below num_rows if given."""
+        import pyarrow.parquet as pq
+
+        files = self._shard_files()
+        if not files:
+            return set()
+        indices = pq.ParquetDataset(files).read(columns=[self.INDEX_COLUMN]).column(0).to_pylist()
+        return {index for index in indices if num_rows is None or index < num_rows}
+
+    def iter_rows(self, with_index: bool = False, num_rows: int | None = None):
+        """
+        Yield the rows checkpointed by previous runs, without their source index unless with_index,
+        and only the ones with a source index below num_rows if given.
+        """
+        from datasets import Dataset
+
+        files = self._shard_files()
+        if not files:
+            return
+
+        for row in Dataset.from_parquet(files):
+            index = row[self.INDEX_COLUMN] if with_index else row.pop(self.INDEX_COLUMN)
+            if num_rows is None or index < num_rows:
+                yield row
+
+    def clear(self) -> None:
+        shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        self._buffer.clear()
+        self._num_shards = 0
+
+    def add(self, index: int, row: dict) -> None:
+        self._buffer.append({**row, self.INDEX_COLUMN: index})
+        if len(self._buffer) >= self.every:
+            self.flush()
+
+    def flush(self) -> None:
+        from datasets import Dataset
+
+        if not self._buffer:
+            return
+
+        path = os.path.join(self.directory, f"rows-{self._num_shards:05d}.parquet")
+        # Write to a temporary file first so a crash never leaves a truncated shard behind
+        Dataset.from_list(self._buffer).to_parquet(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        self._num_shards += 1
+        self._buffer.clear()
+
+
+class ShardedDatasetWriter:
+    """
+    Streams finished rows into Parquet shards instead of holding the whole output in memory.
+
+    Rows are encoded with the output features and appended to Arrow record batches, which are
+    written to the current shard until it reaches max_shard_size_mb. When a repo_id is given,
+    every closed shard is uploaded in the background while generation continues, so pushing
+    the dataset at the end is a single commit of files that are already on the Hub, along with
+    the dataset card metadata of the split.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        features: Features,
+        *,
+        split: str = "train",
+        max_shard_size_mb: float = 500,
+        rows_per_batch: int = 1000,
+        repo_id: str | None = None,
+        create_pr: bool = False,
+        path_in_repo: str = "data",
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.features = features
+        self.split = split
+        self.max_shard_size = int(max_shard_size_mb * 1024 * 1024)
+        self.rows_per_batch = rows_per_batch
+        self.repo_id = repo_id
+        self.create_pr = create_pr
+        self.path_in_repo = path_in_repo
+        self.num_rows = 0
+        self.num_bytes = 0
+        self.files: list[str] = []
+
+        self._schema = features.arrow_schema
+        self._buffer: list[dict] = []
+        self._writer: pq.ParquetWriter | None = None
+        self._shard_size = 0
+        self._uploads = []
+
+        if repo_id:
+            from huggingface_hub import HfApi
+
+            self._api = HfApi()
+            self._api.create_repo(repo_id, repo_type="dataset", exist_ok=True)
+            self._upload_executor = ThreadPoolExecutor(max_workers=1)
+
+    def write(self, row: dict) -> None:
+        self._buffer.append(self.features.encode_example(row))
+        self.num_rows += 1
+        if len(self._buffer) >= self.rows_per_batch:
+            self._write_batch()
+
+    def _write_batch(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if not self._buffer:
+            return
+
+        batch = pa.RecordBatch.from_pylist(self._buffer, schema=self._schema)
+        self._buffer.clear()
+
+        if self._writer is None:
+            path = os.path.join(self.directory, f"{self.split}-{len(self.files):05d}.parquet")
+            self._writer = pq.ParquetWriter(path, self._schema)
+            self._shard_size = 0
+
+        self._writer.write_batch(batch)
+        self._shard_size += batch.nbytes
+        self.num_bytes += batch.nbytes
+        if self._shard_size >= self.max_shard_size:
+            self._close_shard()
+
+    def _close_shard(self) -> None:
+        self._writer.close()
+        path = self._writer.where
+        self._writer = None
+        self.files.append(path)
+
+        if self.repo_id:
+            self._uploads.append(self._upload_executor.submit(self._upload_shard, path))
+
+    def _upload_shard(self, path: str) -> CommitOperationAdd:
+        from huggingface_hub import CommitOperationAdd
+
+        operation = CommitOperationAdd(
+            path_in_repo=f"{self.path_in_repo}/{os.path.basename(path)}", path_or_fileobj=path)
+        self._api.preupload_lfs_files(
+            self.repo_id,
+            additions=[operation],
+            repo_type="dataset",
+            create_pr=self.create_pr,
+        )
+        return operation
+
+    def close(self) -> None:
+        """Write any buffered rows and close the current shard."""
+        self._write_batch()
+        if self._writer is not None:
+            self._close_shard()
+
+    def to_dataset(self) -> Dataset:
+        """Return the written rows as a memory-mapped dataset."""
+        from datasets import Dataset
+
+        self.close()
+        if not self.files:
+            return Dataset.from_dict({}, features=self.features)
+        return Dataset.from_parquet(self.files, features=self.features)
+
+    def push(
+        self,
+        commit_message: str = "Upload dataset",
+        additions: list[CommitOperationAdd] | None = None,
+        update_card: bool = True,
+    ) -> None:
+        """
+        Commit the uploaded shards, replacing the previous data files of the split.
+
+        Args:
+            commit_message: Message of the commit
+            additions: Other files committed along with the shards, such as metadata
+            update_card: Whether to update the features, split sizes and data files of the dataset
+                card in the same commit, which staged shards don't need
+        """
+        from huggingface_hub import CommitOperationDelete
+        from huggingface_hub.hf_api import RepoFile
+
+        if not self.repo_id:
+            raise ValueError("Cannot push a dataset writer without a repo_id")
+
+        self.close()
+        additions = [*(upload.result() for upload in self._uploads), *(additions or [])]
+        self._upload_executor.shutdown()
+
+        new_files = {operation.path_in_repo for operation in additions}
+        repo_files = [
+            entry for entry in self._api.list_repo_tree(self.repo_id, repo_type="dataset", recursive=True)
+            if isinstance(entry, RepoFile)
+        ]
+        deleted = [
+            entry for entry in repo_files
+            if entry.path.startswith(f"{self.path_in_repo}/{self.split}-") and entry.path not in new_files
+        ]
+        deletions = [CommitOperationDelete(path_in_repo=entry.path) for entry in deleted]
+        if update_card:
+            additions.append(self._card_operation(
+                [entry.path for entry in repo_files], deleted_size=sum(entry.size for entry in deleted)))
+
+        self._api.create_commit(
+            self.repo_id,
+            operations=[*additions, *deletions],
+            commit_message=commit_message,
+            repo_type="dataset",
+            create_pr=self.create_pr,
+        )
+
+    def _card_operation(self, repo_files: list[str], deleted_size: int) -> CommitOperationAdd:
+        """
+        Return the README.md of the repo with the features, size and data files of the split,
+        the way push_to_hub updates them. Loading the dataset checks the split sizes of the card,
+        so a card left with the previous row count fails with NonMatchingSplitsSizesError.
+        """
+        from datasets.info import DatasetInfo, DatasetInfosDict
+        from datasets.splits import SplitDict, SplitInfo
+        from datasets.utils.metadata import MetadataConfigs
+        from huggingface_hub import CommitOperationAdd, DatasetCard, DatasetCardData
+        from huggingface_hub.errors import EntryNotFoundError
+
+        try:
+            card = DatasetCard.load(self.repo_id, repo_type="dataset")
+            card_data = card.data
+        except EntryNotFoundError:
+            card = None
+            card_data = DatasetCardData()
+
+        # Without a config, the splits are the ones found in the names of the data files
+        configs = MetadataConfigs.from_dataset_card_data(card_data)
+        pattern = re.compile(rf"{re.escape(self.path_in_repo)}/(\w+)-\d+(?:-of-\d+)?\.parquet")
+        data_files = configs.get("default", {}).get("data_files") or [
+            {"split": split, "path": f"{self.path_in_repo}/{split}-*"}
+            for split in dict.fromkeys(match.group(1) for match in map(pattern.fullmatch, repo_files) if match)
+        ]
+        if isinstance(data_files, (str, dict)):
+            data_files = [data_files]
+        other_splits = [files for files in data_files if not (isinstance(files, dict) and files.get("split") == self.split)]
+        data_files = [*other_splits, {"split": self.split, "path": f"{self.path_in_repo}/{self.split}-*"}]
+
+        info = DatasetInfosDict.from_dataset_card_data(card_data).get("default") or DatasetInfo(config_name="default")
+        info.features = self.features
+        info.download_checksums = None
+        # The split sizes are checked all together, so they're only recorded when the card has
+        # the sizes of the other splits too
+        if all(isinstance(files, dict) and files.get("split") in (info.splits or {}) for files in other_splits):
+            info.splits = info.splits or SplitDict()
+            info.splits.pop(self.split, None)
+            info.splits[self.split] = SplitInfo(name=self.split, num_bytes=self.num_bytes, num_examples=self.num_rows)
+            info.download_size = (info.download_size or 0) - deleted_size + sum(os.path.getsize(path) for path in self.files)
+            info.dataset_size = sum(split.num_bytes or 0 for split in info.splits.values())
+            info.size_in_bytes = info.download_size + info.dataset_size
+        else:
+            info.splits = info.download_size = info.dataset_size = info.size_in_bytes = None
+
+        DatasetInfosDict({"default": info}).to_dataset_card_data(card_data)
+        MetadataConfigs({"default": {**configs.get("default", {}), "data_files": data_files}}).to_dataset_card_data(card_data)
+        content = str(card) if card is not None else f"---\n{card_data}\n---\n"
+        return CommitOperationAdd(path_in_repo="README.md", path_or_fileobj=content.encode())
+
+
+class AdaptiveRateLimiter:
+    """
+    AIMD rate limiter shared by every request sent to one provider.
+
+    A provider is only throttled once it has a requests/tokens-per-minute limit or has answered
+    429, until then requests are sent as soon as a worker is free. A throttled provider hands out
+    one send slot at a time: waiting requests check again when they wake up, so they follow the
+    rate as it changes instead of keeping slots booked at an older rate. The rate grows additively
+    after each success. A 429 pauses every worker until its Retry-After delay has passed, so
+    throttled workers don't retry all at once. Without Retry-After the provider gives no hint, so
+    the rate is also halved and the pause is an exponential backoff. The rate never drops below
+    a fraction of the rate measured when throttling started, so a few transient 429s can't slow
+    the rest of the run down to min_rate.
+    """
+
+    # Seconds of recent requests used to measure the rate a provider starts throttling from
+    RATE_WINDOW = 10.0
+    # Lowest rate after 429s, as a fraction of the rate measured when throttling started
+    FLOOR_FRACTION = 0.25
+    # Longest a waiting request sleeps before checking the rate again
+    MAX_WAIT = 1.0
+
+    def __init__(
+        self,
+        *,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        increase: float = 0.5,
+        min_rate: float = 0.1,
+        max_rate: float = 1000.0,
+    ) -> None:
+        self.max_rate = min(max_rate, requests_per_minute / 60) if requests_per_minute else max_rate
+        self.min_rate = min(min_rate, self.max_rate)
+        self.rate = self.max_rate
+        self.floor = self.min_rate
+        self.increase = increase
+        self.tokens_per_second = tokens_per_minute / 60 if tokens_per_minute else None
+        self.throttling = bool(requests_per_minute or tokens_per_minute)
+        self.requests = 0
+        self.throttled = 0
+
+        self._lock = threading.Lock()
+        self._last_sent = float("-inf")
+        self._recent_sends = deque()
+        self._paused_until = 0.0
+        self._consecutive_throttles = 0
+        self._token_budget = float(tokens_per_minute or 0)
+        self._token_capacity = float(tokens_per_minute or 0)
+        self._tokens_updated = time.monotonic()
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Take the send slot for a request and return 0 if it's due, otherwise return how many
+        seconds to wait before calling again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.throttling:
+                slot = max(self._paused_until, self._last_sent + 1 / self.rate)
+                if self.tokens_per_second:
+                    self._refill_tokens(now)
+                    missing = min(tokens, self._token_capacity) - self._token_budget
+                    if missing > 0:
+                        slot = max(slot, now + missing / self.tokens_per_second)
+                if slot > now:
+                    return min(slot - now, self.MAX_WAIT)
+            else:
+                self._recent_sends.append(now)
+                while self._recent_sends[0] < now - self.RATE_WINDOW:
+                    self._recent_sends.popleft()
+
+            self._last_sent = now
+            self._token_budget -= tokens
+            self.requests += 1
+            return 0.0
+
+    def _refill_tokens(self, now: float) -> None:
+        elapsed = now - self._tokens_updated
+        self._token_budget = min(self._token_capacity, self._token_budget + elapsed * self.tokens_per_second)
+        self._tokens_updated = now
+
+    def on_success(self, extra_tokens: int = 0) -> None:
+        """Record a successful request, correcting the reserved tokens with the actual usage."""
+        with self._lock:
+            self._consecutive_throttles = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self._token_budget -= extra_tokens
+
+    def on_rate_limited(self, retry_after: float | None = None, tokens: int = 0) -> None:
+        """Record a 429 response, refunding the tokens reserved for the rejected request."""
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            self._token_budget += tokens
+
+            # Requests already in flight when the provider started throttling shouldn't
+            # halve the rate again, they belong to the same congestion event
+            if now < self._paused_until:
+                return
+
+            if not self.throttling:
+                # Start from the rate the provider accepted until it pushed back
+                self.throttling = True
+                sent = len(self._recent_sends)
+                measured = sent / max(now - self._recent_sends[0], 1.0) if sent else self.min_rate
+                self.rate = min(self.max_rate, measured)
+                self.floor = max(self.min_rate, min(self.rate, self.FLOOR_FRACTION * measured))
+                self._recent_sends.clear()
+
+            self._consecutive_throttles += 1
+            if retry_after is None:
+                self.rate = max(self.floor, self.rate / 2)
+                retry_after = min(60.0, 2 ** (self._consecutive_throttles - 1) * random.uniform(0.5, 1.5))
+            self._paused_until = now + retry_after
+
+
+class InferenceClientPool:
+    """
+    Inference clients shared by all workers, created once per (provider, bill_to, timeout).
+
+    Reusing clients lets requests reuse kept-alive HTTP connections instead of paying for a new
+    session and TLS handshake per cell. Each provider also gets a connection pool size, which
+    bounds the number of requests in flight to it at any time. With a base_url, every client
+    sends its requests to that OpenAI-compatible endpoint instead of the provider.
+    """
+
+    def __init__(
+        self,
+        max_connections: dict[str, int],
+        default_max_connections: int,
+        base_url: str | None = None,
+    ) -> None:
+        self.max_connections = max_connections
+        self.default_max_connections = default_max_connections
+        self.base_url = base_url
+
+        self._lock = threading.Lock()
+        self._clients: dict[tuple, InferenceClient] = {}
+        self._async_clients: dict[tuple, AsyncInferenceClient] = {}
+        self._slots: dict[str, threading.BoundedSemaphore] = {}
+        self._async_slots: dict[str, asyncio.Semaphore] = {}
+
+    def pool_size(self, provider: str) -> int:
+        return self.max_connections.get(provider, self.default_max_connections)
+
+    def get(self, provider: str, bill_to: str | None = None, timeout: float | None = None) -> InferenceClient:
+        from huggingface_hub import InferenceClient
+
+        key = (provider, bill_to, timeout)
+        if key not in self._clients:
+            with self._lock:
+                if key not in self._clients:
+                    self._clients[key] = InferenceClient(
+                        provider=provider, bill_to=bill_to, base_url=self.base_url, timeout=timeout)
+                    self._slots.setdefault(provider, threading.BoundedSemaphore(self.pool_size(provider)))
+        return self._clients[key]
+
+    def get_async(self, provider: str, bill_to: str | None = None, timeout: float | None = None) -> AsyncInferenceClient:
+        from huggingface_hub import AsyncInferenceClient
+
+        # Only used from the event loop thread, so no locking is needed
+        key = (provider, bill_to, timeout)
+        if key not in self._async_clients:
+            self._async_clients[key] = AsyncInferenceClient(
+                provider=provider, bill_to=bill_to, base_url=self.base_url, timeout=timeout)
+            self._async_slots.setdefault(provider, asyncio.Semaphore(self.pool_size(provider)))
+        return self._async_clients[key]
+
+    def connection(self, provider: str) -> threading.BoundedSemaphore:
+        """Return the context manager guarding a connection slot of the provider."""
+        return self._slots[provider]
+
+    def async_connection(self, provider: str) -> asyncio.Semaphore:
+        return self._async_slots[provider]
+
+    def close(self) -> None:
+        for client in self._clients.values():
+            client.close()
+        self._clients.clear()
+
+    async def aclose(self) -> None:
+        for client in self._async_clients.values():
+            await client.close()
+        self._async_clients.clear()
+
+
+def _configure_http_pool(max_connections: int) -> None:
+    """
+    Size huggingface_hub's HTTP connection pools so every concurrent request can keep its
+    connection alive between requests (httpx only keeps 20 idle connections by default).
+    """
+    try:
+        from huggingface_hub import set_async_client_factory, set_client_factory
+        from huggingface_hub.utils import _http
+        httpx = getattr(_http, "httpx2", None) or _http.httpx
+        request_hook = _http.hf_request_event_hook
+    except (ImportError, AttributeError):
+        # Older huggingface_hub versions manage their own sessions, keep their defaults
+        return
+
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    async_event_hooks = {
+        name: [hook]
+        for name, hook in (
+            ("request", getattr(_http, "async_hf_request_event_hook", None)),
+            ("response", getattr(_http, "async_hf_response_event_hook", None)),
+        )
+        if hook is not None
+    }
+
+    set_client_factory(lambda: httpx.Client(
+        limits=limits,
+        event_hooks={"request": [request_hook]},
+        follow_redirects=True,
+        timeout=None,
+    ))
+    set_async_client_factory(lambda: httpx.AsyncClient(
+        limits=limits,
+        event_hooks=async_event_hooks,
+        follow_redirects=True,
+        timeout=None,
+    ))
+
 
 class Pipeline:
     """A parallel pipeline for generating dataset rows using language models."""
 
+    # Instructions of a request packing the prompts of several rows (packRows)
+    PACK_PROMPT = (
+        "Complete each of the {count} tasks below independently. Reply with only a JSON array of "
+        "{count} strings, where string i is the complete output of task i, and nothing else."
+    )
+    # Maximum time a cell waits for its pack to fill up before the pack is sent anyway
+    PACK_WAIT_SECONDS = 0.5
+    # Consecutive 5xx, timeout or 429 errors of a request before it moves to the next provider
+    FAILOVER_AFTER = 2
+    # Completed prompts of deduplicated columns remembered for later duplicates
+    DEDUP_MAX_COMPLETED = 10_000
+    # Requests of a column measured before its latency percentile is trusted for hedging
+    HEDGE_MIN_REQUESTS = 20
+    # Request timeout of hedged columns without requestTimeout, which also bounds how long the
+    # losing request of a hedge keeps running
+    HEDGE_REQUEST_TIMEOUT = 120.0
+
     def __init__(
         self,
         *,
@@ -38,9 +1215,21 @@ class Pipeline:
         config: str | None = None,
         num_rows: int | None = None,
         bill_to: str | None = None,
+        base_url: str | None = None,
         max_workers: int | None = None,
+        max_rows_in_flight: int | None = None,
+        max_concurrent_requests: int = 100,
+        cache: CompletionCache | None = None,
+        checkpoint_dir: str | None = None,
+        checkpoint_every: int = 1000,
+        resume: bool = False,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        previous_fingerprints: dict[str, str] | None = None,
+        retry_failed: bool = True,
+        source_projection: str = "all",
+        validate_only: bool = False,
         debug: bool = False,
-        request_delay: float = 0
     ) -> None:
         """
         Initialize the pipeline.
@@ -48,60 +1237,222 @@ class Pipeline:
         Args:
             config: Path or URL to YAML configuration file
             num_rows: Number of rows to generate (if None with source_dataset, uses entire dataset)
+            base_url: OpenAI-compatible endpoint receiving every request instead of the column
+                providers, e.g. a self-hosted server (optional)
             max_workers: Maximum number of concurrent workers (defaults to CPU count - 1)
+            max_rows_in_flight: Maximum number of source rows pulled from the stream and not yet
+                completed (defaults to 2 * max_workers, times the largest packRows of the columns)
+            max_concurrent_requests: Default connection pool size (maximum number of in-flight
+                requests) per provider with the async engine (default: 100). With the threads
+                engine the default is max_workers. Columns can override it with maxConnections.
+            cache: Optional completion cache checked before each model call
+            checkpoint_dir: Directory where completed rows are checkpointed (disabled if None)
+            checkpoint_every: Number of completed rows per checkpoint shard (default: 1000)
+            resume: Skip source rows already checkpointed for the same configuration
+            num_shards: Number of contiguous shards the source dataset is split into (default: 1)
+            shard_index: Index of the source shard processed by this pipeline. With several shards,
+                num_rows applies to the shard and output rows keep their index within the shard.
+            previous_fingerprints: Column fingerprints recorded with the source dataset, when it is the
+                output of a previous run. Columns with an unchanged fingerprint are copied through, and
+                only the changed columns and their descendants are generated again.
+            retry_failed: Re-run failed cells, and the cells they skipped, once after the main pass
+                (default: True). Cells that still fail are left null in their row.
+            source_projection: Source columns streamed during generation (default: "all"). With
+                "referenced", only the columns the prompts reference are read, with Parquet column
+                pruning, and the output keeps just those and the generated columns. With "join",
+                the other source columns are read back in a second pass over the source and joined
+                by row index when the output is written, in source order. Generated columns reused
+                from a previous output are always kept.
+            validate_only: Only validate the config against the source columns read from the Hub
+                metadata and display the summary, without opening the source stream. Such a
+                pipeline can't be run.
             debug: Enable debug logging (default: False)
-            request_delay: Delay in seconds between API requests (default: 0)
 
         Raises:
-            ValueError: If no root nodes are found in the dependency graph
+            ValueError: If no root nodes are found or the dependency graph contains a cycle
         """
+        if source_projection not in SOURCE_PROJECTIONS:
+            raise ValueError(f"Unknown source projection: {source_projection}. Expected one of {SOURCE_PROJECTIONS}.")
+
         self.debug = debug
         self.console = Console()
-        self.request_delay = request_delay
         self.bill_to = bill_to
+        self.base_url = base_url
+        self.cache = cache
 
         with self.console.status("[bold green]Loading configuration..."):
             self.config = self._load_config(config)
 
-            # Handle source dataset if specified
-            self.source_dataset = self._load_source_dataset(repo_id=repo_id, subset=subset, split=split)
-            self.source_columns = set()
-
-            # Get columns from source dataset
-            available_columns = set(self.source_dataset.features.keys())
-            self.source_columns = available_columns
-
+            self.num_shards = num_shards
+            self.shard_index = shard_index
             self.num_rows = num_rows
-            # If num_rows is None, get the dataset size
-            if self.num_rows is None:
-                self.num_rows = self._get_dataset_size(repo_id, split, subset)
+            self._source = {"repo_id": repo_id, "subset": subset, "split": split}
+            if validate_only:
+                # Opening the stream imports datasets and resolves data files, the metadata is enough
+                self.source_dataset = None
+                source_columns, source_rows = _hub_split_metadata(repo_id, split, subset)
+                if source_columns is None:
+                    raise ValueError(f"Could not read the columns of {repo_id} ({split}) from the Hub metadata")
+                self.source_columns = set(source_columns)
+                if self.num_rows is None and num_shards == 1:
+                    self.num_rows = source_rows
+            else:
+                # Handle source dataset if specified
+                self.source_dataset = self._open_source_dataset()
+
+                # Get columns from source dataset
+                self.source_columns = set(self.source_dataset.features.keys())
+
+                # If num_rows is None, get the dataset size (unknown for a shard of the stream)
+                if self.num_rows is None and num_shards == 1:
+                    self.num_rows = self._get_dataset_size(repo_id, split, subset)
+
+            # Fingerprint the full config, before it is narrowed down to the columns to regenerate
+            columns = self.config.get('columns', {})
+            self.column_fingerprints = _column_fingerprints(
+                columns, {col: (config['modelProvider'], config['modelName']) for col, config in columns.items()})
+            self.reused_columns: list[str] = []
+            if previous_fingerprints is not None:
+                stale, dropped = _stale_columns(self.column_fingerprints, previous_fingerprints, self.source_columns)
+                self.reused_columns = sorted(set(columns) - stale)
+                if dropped and self.source_dataset is not None:
+                    self.source_dataset = self.source_dataset.remove_columns(sorted(dropped))
+                    self.source_columns -= dropped
+                self.config['columns'] = {col: config for col, config in columns.items() if col in stale}
 
             # Validate no overlap between source and generated columns
             generated_columns = set(self.config.get('columns', {}).keys())
             if overlap := (self.source_columns & generated_columns):
                 raise ValueError(f"Columns defined in both source dataset and generation config: {overlap}")
 
-            self.results: list[dict] = []
+            self.source_projection = source_projection
+            self.source_features = self.source_dataset.features if self.source_dataset is not None else None
+            self.projected_columns: list[str] | None = None
+            if source_projection != "all":
+                projected = _referenced_source_columns(self.source_columns, self.config.get('columns', {}))
+                projected |= set(self.reused_columns)
+                self.projected_columns = (
+                    [col for col in self.source_features if col in projected] if self.source_features is not None
+                    else sorted(projected)
+                )
+                if self.source_dataset is not None:
+                    # The stream only had its features resolved so far, reopen it reading fewer columns
+                    self.source_dataset = self._open_source_dataset(columns=self.projected_columns)
+
+            self.completed_rows = 0
+            self.retry_failed = retry_failed
+            self.failed_cells: dict[int, dict[str, str]] = {}  # source index -> column -> error
+            self._partial_rows: dict[int, tuple[dict, dict[str, str]]] = {}
+            self.metrics = RunMetrics()
+            self.dedup_stats = defaultdict(lambda: {"cells": 0, "requests": 0})
+            self.pack_stats = defaultdict(lambda: {"cells": 0, "requests": 0, "fallbacks": 0})
+            self.hedge_stats = defaultdict(lambda: {
+                "hedges": 0,
+                "hedges_won": 0,
+                "failovers": 0,
+                "latency": LatencyHistogram(),
+                "unhedged_latency": LatencyHistogram(),
+            })
+            self._stats_lock = threading.Lock()
             self.max_workers = max_workers or max(1, multiprocessing.cpu_count() - 1)
+            self.max_concurrent_requests = max_concurrent_requests
+            self.clients: InferenceClientPool | None = None
 
             # Build dependency graph
             self._build_dependency_graph()
+            self._compile_prompts()
+            self._build_generation_params()
+            self._build_row_packing()
+            self._build_request_policies()
+            self._build_rate_limiters()
+
+            # A worker sending a pack of rows keeps all of them in flight
+            self.max_rows_in_flight = max_rows_in_flight or 2 * self.max_workers * max(self.pack_rows.values(), default=1)
+
+            self.checkpointer = None
+            self._checkpointed_indices: set[int] = set()
+            if checkpoint_dir and not validate_only:
+                config_hash = self._config_hash(repo_id=repo_id, subset=subset, split=split)
+                self.checkpointer = RowCheckpointer(os.path.join(checkpoint_dir, config_hash), every=checkpoint_every)
+                if resume:
+                    self._checkpointed_indices = self.checkpointer.checkpointed_indices(self.num_rows)
+                else:
+                    self.checkpointer.clear()
+
             self._display_configuration_summary()
 
-    def _get_dataset_size(self, repo_id: str, split: str, subset: str | None = None) -> int | None:
-        # Load dataset info (not the actual dataset)
-        from datasets import load_dataset_builder
+    @property
+    def output_features(self) -> Features:
+        """
+        Features of the generated dataset: source columns followed by generated columns.
 
-        builder = load_dataset_builder(repo_id, subset)
-        info = builder.info
+        With several shards, rows also keep their index within the shard so the shards can be
+        merged back in source order.
+        """
+        source_features = self.source_features if self.source_projection == "join" else self.source_dataset.features
+        return self._row_features(source_features, with_index=self.num_shards > 1)
+
+    @property
+    def _indexed_rows(self) -> bool:
+        """Whether generated rows keep their source index, to merge shards or join source columns back."""
+        return self.num_shards > 1 or self.source_projection == "join"
+
+    def _row_features(self, source_features: Features, with_index: bool) -> Features:
+        from datasets import Features, Value
+
+        features = Features({
+            **source_features,
+            **{col: Value("string") for col in self.config.get('columns', {})},
+        })
+        if with_index:
+            features[RowCheckpointer.INDEX_COLUMN] = Value("int64")
+        return features
+
+    def _open_source_dataset(self, columns: list[str] | None = None) -> IterableDataset:
+        """Open the source stream of this pipeline's shard, reading only the given columns if set."""
+        dataset = self._load_source_dataset(**self._source, columns=columns)
+        if self.num_shards > 1:
+            dataset = self._shard_source_dataset(dataset, self.num_shards, self.shard_index)
+        return dataset
 
-        # Get the number of examples in the specified split
-        if hasattr(info, 'splits') and split in info.splits:
-            return info.splits[split].num_examples
-        else:
-            # Fallback if split info is not available
+    def _shard_source_dataset(self, dataset: IterableDataset, num_shards: int, shard_index: int) -> IterableDataset:
+        """
+        Select a contiguous shard of the source, so shards concatenate back in source order: a range
+        of its data files, or a range of its rows when it has fewer data files than shards. In that
+        case every worker streams the rows before its range to skip them.
+        """
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(f"Shard index {shard_index} is out of range for {num_shards} shards")
+        if num_shards <= dataset.num_shards:
+            return dataset.shard(num_shards=num_shards, index=shard_index, contiguous=True)
+
+        _, source_rows = _hub_split_metadata(**self._source)
+        if source_rows is None:
+            raise ValueError(
+                f"The source dataset has {dataset.num_shards} data files, fewer than the {num_shards} shards, "
+                f"and its number of rows can't be read from the Hub metadata to split its rows instead")
+        # Same row ranges as Dataset.shard(contiguous=True)
+        shard_rows, remainder = divmod(source_rows, num_shards)
+        start = shard_index * shard_rows + min(shard_index, remainder)
+        return dataset.skip(start).take(shard_rows + (shard_index < remainder))
+
+    def _get_dataset_size(self, repo_id: str, split: str, subset: str | None = None) -> int | None:
+        # Read the size from the Hub metadata, instead of resolving the dataset builder
+        _, num_rows = _hub_split_metadata(repo_id, split, subset)
+        if num_rows is None:
             self.console.print("[yellow]Warning: Could not determine dataset size. Using streaming mode.")
-            return None
+        return num_rows
+
+    def _config_hash(self, *, repo_id: str, subset: str | None, split: str) -> str:
+        """Hash everything that determines the content of the generated rows."""
+        payload = {"repo_id": repo_id, "subset": subset, "split": split, "config": self.config}
+        if self.num_shards > 1:
+            payload["shard"] = [self.shard_index, self.num_shards]
+        if self.projected_columns is not None:
+            # Checkpointed rows only hold the projected source columns
+            payload["source_columns"] = self.projected_columns
+        payload = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
 
     @staticmethod
     def _load_config(yml_source: str) -> dict:
@@ -153,156 +1504,804 @@ class Pipeline:
         if not self.root_nodes and self.config.get('columns'):
             raise ValueError("No root nodes found! Circular dependencies may exist.")
 
-    def get_client_for_node(self, node, bill_to: str | None = None) -> InferenceClient:
-        config = self.config['columns'][node]
+        # Kahn's algorithm over generated columns: anything left unsorted is part of a cycle
+        generated_columns = self.config.get('columns', {})
+        in_degree = {
+            col: sum(1 for dep in self.reverse_graph[col] if dep in generated_columns)
+            for col in generated_columns
+        }
+        ready = deque(col for col, degree in in_degree.items() if degree == 0)
+        self.topological_order = []
+        while ready:
+            col = ready.popleft()
+            self.topological_order.append(col)
+            for dependent in self.graph[col]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(self.topological_order) < len(generated_columns):
+            cyclic = sorted(set(generated_columns) - set(self.topological_order))
+            raise ValueError(f"Circular dependencies detected between columns: {cyclic}")
+
+    def _compile_prompts(self) -> None:
+        """Parse every column prompt once and check its placeholders against the column references."""
+        self.templates: dict[str, PromptTemplate] = {}
+        generated_columns = self.config.get('columns', {})
+        for col, config in generated_columns.items():
+            template = PromptTemplate(config['prompt'])
+            references = set(config.get('columnsReferences') or [])
+
+            # Generated columns must be referenced to be available when the prompt is rendered
+            if unreferenced := {name for name in template.columns - references if name in generated_columns}:
+                raise ValueError(f"Prompt of {col} uses columns missing from its columnsReferences: {unreferenced}")
+            if unknown := template.columns - references - self.source_columns - set(generated_columns):
+                self.console.print(
+                    f"[yellow]Warning: Prompt of {col} uses unknown columns {unknown}, they will be left as-is.")
+
+            self.templates[col] = template
+
+    def _build_generation_params(self) -> None:
+        """Validate the generation parameters of every column."""
+        self.generation_params = {
+            col: _generation_params(col, config) for col, config in self.config.get('columns', {}).items()
+        }
+        for col, params in self.generation_params.items():
+            if guided := {'regex', 'choice'} & set(params.get('guided', {})):
+                self.console.print(
+                    f"[yellow]Warning: guided {guided.pop()} of {col} is sent as a vLLM-style extra parameter, "
+                    f"providers that don't support it will ignore it.")
+
+    def _build_row_packing(self) -> None:
+        """Validate the number of rows packed into each request of every column (packRows)."""
+        self.pack_rows = {}
+        for col, config in self.config.get('columns', {}).items():
+            pack_rows = config.get('packRows') or 1
+            if not isinstance(pack_rows, int) or pack_rows < 1:
+                raise ValueError(f"packRows of {col} must be a positive integer, got {pack_rows}")
+            if pack_rows > 1 and 'guided' in self.generation_params[col]:
+                raise ValueError(f"packRows of {col} can't be combined with guided, packed answers are a JSON array")
+            self.pack_rows[col] = pack_rows
+
+    def _build_request_policies(self) -> None:
+        """Validate the request timeout, alternate providers and hedging percentile of every column."""
+        self.providers: dict[str, list[str]] = {}
+        self.request_timeouts: dict[str, float] = {}
+        self.hedge_percentiles: dict[str, float] = {}
+        for col, config in self.config.get('columns', {}).items():
+            alternates = config.get('alternateProviders') or []
+            if isinstance(alternates, str):
+                alternates = [alternates]
+            # Requests fail over from the column provider to its alternates, in order
+            self.providers[col] = [config['modelProvider']] + [
+                provider for provider in dict.fromkeys(alternates) if provider != config['modelProvider']
+            ]
+
+            if (timeout := config.get('requestTimeout')) is not None:
+                if not isinstance(timeout, (int, float)) or timeout <= 0:
+                    raise ValueError(f"requestTimeout of {col} must be a positive number of seconds, got {timeout}")
+                self.request_timeouts[col] = float(timeout)
+
+            if (percentile := config.get('hedgePercentile')) is not None:
+                if not isinstance(percentile, (int, float)) or not 0 < percentile < 100:
+                    raise ValueError(f"hedgePercentile of {col} must be between 0 and 100, got {percentile}")
+                self.hedge_percentiles[col] = float(percentile)
+                self.request_timeouts.setdefault(col, self.HEDGE_REQUEST_TIMEOUT)
+
+    def _completion_kwargs(self, node: str, num_rows: int = 1) -> dict:
+        """Map the generation parameters of a column to chat completion arguments, for a request of num_rows rows."""
+        params = self.generation_params[node]
+        kwargs = {name: value for name, value in params.items() if name != 'guided'}
+        if num_rows > 1:
+            # Stop sequences would cut the JSON array short, they are applied to each answer instead
+            kwargs.pop('stop', None)
+            if 'max_tokens' in kwargs:
+                # Every answer keeps its own budget, plus a few tokens of JSON quoting
+                kwargs['max_tokens'] = (kwargs['max_tokens'] + 8) * num_rows
+        if guided := params.get('guided'):
+            if 'json' in guided:
+                kwargs['response_format'] = {
+                    "type": "json_schema",
+                    "json_schema": {"name": node, "schema": guided['json']},
+                }
+            else:
+                # Regex and choice constraints have no standard response format
+                kwargs['extra_body'] = {f"guided_{kind}": value for kind, value in guided.items()}
+        return kwargs
+
+    def _build_rate_limiters(self) -> None:
+        """Create one rate limiter per provider, capped by the strictest limits of its columns."""
+        limits = defaultdict(dict)
+        for config in self.config.get('columns', {}).values():
+            provider_limits = limits[config['modelProvider']]
+            for key in ('requestsPerMinute', 'tokensPerMinute'):
+                if config.get(key):
+                    provider_limits[key] = min(config[key], provider_limits.get(key, config[key]))
+
+        self.rate_limiters = defaultdict(AdaptiveRateLimiter)
+        for provider, provider_limits in limits.items():
+            self.rate_limiters[provider] = AdaptiveRateLimiter(
+                requests_per_minute=provider_limits.get('requestsPerMinute'),
+                tokens_per_minute=provider_limits.get('tokensPerMinute'),
+            )
+        # Alternate providers have no known limits, they only adapt to their 429s. Their limiters
+        # are created upfront so workers never race to create them.
+        for provider in {provider for providers in self.providers.values() for provider in providers} - limits.keys():
+            self.rate_limiters[provider] = AdaptiveRateLimiter()
 
-        return InferenceClient(
-            provider=config['modelProvider'],
-            bill_to=bill_to,
-        )
+    def get_client_for_node(self, node, bill_to: str | None = None, provider: str | None = None) -> InferenceClient:
+        provider = provider or self.config['columns'][node]['modelProvider']
+        return self.clients.get(provider, bill_to=bill_to, timeout=self.request_timeouts.get(node))
+
+    def get_async_client_for_node(
+        self,
+        node,
+        bill_to: str | None = None,
+        provider: str | None = None,
+    ) -> AsyncInferenceClient:
+        provider = provider or self.config['columns'][node]['modelProvider']
+        return self.clients.get_async(provider, bill_to=bill_to, timeout=self.request_timeouts.get(node))
+
+    def _build_client_pool(self, engine: str) -> InferenceClientPool:
+        """Create the client pool of an engine, sized by the strictest maxConnections of each provider's columns."""
+        max_connections = {}
+        for config in self.config.get('columns', {}).values():
+            if size := config.get('maxConnections'):
+                provider = config['modelProvider']
+                max_connections[provider] = min(size, max_connections.get(provider, size))
+
+        default_max_connections = self.max_concurrent_requests if engine == "async" else self.max_workers
+        return InferenceClientPool(max_connections, default_max_connections, base_url=self.base_url)
 
     def _debug_log(self, message: str) -> None:
         """Print debug message if debug mode is enabled."""
         if self.debug:
             rprint(message)
 
-    def process_node(self, node: str, row: dict, bill_to: str | None = None) -> tuple[str, str]:
-        """Process a single node in the pipeline."""
+    def process_node(
+        self,
+        node: str,
+        row: dict,
+        bill_to: str | None = None,
+        queued_at: float | None = None,
+    ) -> tuple[str, str]:
+        """Process a single node in the pipeline. queued_at is when the cell was submitted to the worker pool."""
         try:
             if node in self.source_columns:
                 return node, row[node]
 
-            self._debug_log(f"[cyan]Processing node {node} with row data: {row}")
+            if self.debug:
+                self._debug_log(f"[cyan]Processing node {node} with row data: {row}")
 
             config = self.config['columns'][node]
-            prompt = self._prepare_prompt(config['prompt'], row)
+            prompt = self.templates[node].render(row)
+
+            cache_key = self._cache_key(node, prompt)
+            if cache_key and (cached := self.cache.get(cache_key)) is not None:
+                self._debug_log(f"[green]Cache hit for {node}")
+                self.metrics.increment(node, "cache_hits")
+                return node, cached
 
             self._debug_log(f"[cyan]Getting client for {node}...")
             client = self.get_client_for_node(node, bill_to=bill_to)
 
-            self._debug_log(f"[cyan]Generating completion for {node} with prompt: {prompt}")
-            result = self._generate_completion(client, config['modelName'], prompt)
+            if self.debug:
+                self._debug_log(f"[cyan]Generating completion for {node} with prompt: {prompt}")
+            result = self._generate_completion(
+                client, config['modelName'], prompt, self._completion_kwargs(node), node=node, queued_at=queued_at)
+
+            if not result or result.isspace():
+                raise ValueError(f"Empty or whitespace-only response from model")
+
+            if cache_key:
+                self.cache.put(cache_key, result)
+
+            if self.debug:
+                self._debug_log(f"[green]Completed {node} with result: {result[:100]}...")
+            return node, result
+
+        except Exception as e:
+            self.metrics.increment(node, "failures")
+            self._log_error(node, e)
+            raise
+
+    async def aprocess_node(self, node: str, row: dict, bill_to: str | None = None) -> tuple[str, str]:
+        """Process a single node in the pipeline with the async engine."""
+        queued_at = time.perf_counter()
+        try:
+            if self.debug:
+                self._debug_log(f"[cyan]Processing node {node} with row data: {row}")
+
+            config = self.config['columns'][node]
+            prompt = self.templates[node].render(row)
+
+            cache_key = self._cache_key(node, prompt)
+            if cache_key and (cached := self.cache.get(cache_key)) is not None:
+                self._debug_log(f"[green]Cache hit for {node}")
+                self.metrics.increment(node, "cache_hits")
+                return node, cached
+
+            client = self.get_async_client_for_node(node, bill_to=bill_to)
+
+            if self.debug:
+                self._debug_log(f"[cyan]Generating completion for {node} with prompt: {prompt}")
+            result = await self._agenerate_completion(
+                client, config['modelName'], prompt, self._completion_kwargs(node), node=node, queued_at=queued_at)
 
             if not result or result.isspace():
                 raise ValueError(f"Empty or whitespace-only response from model")
 
-            self._debug_log(f"[green]Completed {node} with result: {result[:100]}...")
+            if cache_key:
+                self.cache.put(cache_key, result)
+
+            if self.debug:
+                self._debug_log(f"[green]Completed {node} with result: {result[:100]}...")
             return node, result
 
         except Exception as e:
+            self.metrics.increment(node, "failures")
+            self._log_error(node, e)
+            raise
+
+    def process_pack(
+        self,
+        node: str,
+        rows: list[dict],
+        bill_to: str | None = None,
+        queued_at: float | None = None,
+    ) -> list[str | None]:
+        """
+        Generate a column for several rows with a single request asking for a JSON array of answers.
+
+        Rows found in the completion cache are left out of the request. Returns the answer of each
+        row, None for the rows whose answer couldn't be parsed or whose request failed with another
+        error than a rate limit, which are left to single-row requests. queued_at is when the first
+        cell of the pack was ready.
+        """
+        try:
+            prompts, answers = self._pack_lookup(node, rows)
+            if missing := [idx for idx, answer in enumerate(answers) if answer is None]:
+                config = self.config['columns'][node]
+                client = self.get_client_for_node(node, bill_to=bill_to)
+                try:
+                    content = self._generate_completion(
+                        client,
+                        config['modelName'],
+                        self._pack_prompt([prompts[idx] for idx in missing]),
+                        self._completion_kwargs(node, len(missing)),
+                        node=node,
+                        queued_at=queued_at,
+                    )
+                except Exception as e:
+                    if self._is_rate_limit_error(e):
+                        raise
+                    # A single bad row fails the whole request, so its rows are generated on their own
+                    self._log_error(node, e)
+                    content = None
+                for idx, answer in zip(missing, self._unpack_answers(node, [prompts[idx] for idx in missing], content)):
+                    answers[idx] = answer
+            return answers
+
+        except Exception as e:
+            self.metrics.increment(node, "failures", len(rows))
+            self._log_error(node, e)
+            raise
+
+    async def aprocess_pack(
+        self,
+        node: str,
+        rows: list[dict],
+        bill_to: str | None = None,
+        queued_at: float | None = None,
+    ) -> list[str | None]:
+        """Generate a column for several rows with a single request, with the async engine."""
+        try:
+            prompts, answers = self._pack_lookup(node, rows)
+            if missing := [idx for idx, answer in enumerate(answers) if answer is None]:
+                config = self.config['columns'][node]
+                client = self.get_async_client_for_node(node, bill_to=bill_to)
+                try:
+                    content = await self._agenerate_completion(
+                        client,
+                        config['modelName'],
+                        self._pack_prompt([prompts[idx] for idx in missing]),
+                        self._completion_kwargs(node, len(missing)),
+                        node=node,
+                        queued_at=queued_at,
+                    )
+                except Exception as e:
+                    if self._is_rate_limit_error(e):
+                        raise
+                    # A single bad row fails the whole request, so its rows are generated on their own
+                    self._log_error(node, e)
+                    content = None
+                for idx, answer in zip(missing, self._unpack_answers(node, [prompts[idx] for idx in missing], content)):
+                    answers[idx] = answer
+            return answers
+
+        except Exception as e:
+            self.metrics.increment(node, "failures", len(rows))
             self._log_error(node, e)
             raise
 
-    def _prepare_prompt(self, prompt: str, row: dict) -> str:
-        """Prepare prompt template by filling in values from row."""
-        for key, value in row.items():
-            placeholder = f"{{{{{key}}}}}"
-            if placeholder in prompt:
-                self._debug_log(f"[cyan]Replacing {placeholder} with: {value}")
-                prompt = prompt.replace(placeholder, str(value))
+    def _pack_lookup(self, node: str, rows: list[dict]) -> tuple[list[str], list[str | None]]:
+        """Render the prompt of every row of a pack, and return them with their cached answers."""
+        prompts = [self.templates[node].render(row) for row in rows]
+        answers = []
+        for prompt in prompts:
+            cache_key = self._cache_key(node, prompt)
+            answers.append(self.cache.get(cache_key) if cache_key else None)
+            if answers[-1] is not None:
+                self.metrics.increment(node, "cache_hits")
+        return prompts, answers
+
+    def _pack_prompt(self, prompts: list[str]) -> str:
+        """Render the prompts of several rows into a single prompt asking for a JSON array of answers."""
+        tasks = "".join(f"\n\n### Task {idx}\n\n{prompt}" for idx, prompt in enumerate(prompts, start=1))
+        return self.PACK_PROMPT.format(count=len(prompts)) + tasks
+
+    def _unpack_answers(self, node: str, prompts: list[str], content: str | None) -> list[str | None]:
+        """
+        Split the completion of a packed request into the answer of each prompt, and cache them.
 
-        self._debug_log(f"[yellow]Final prompt:\n{prompt}")
-        return prompt
+        The whole pack is rejected when the completion isn't a JSON array with one answer per
+        prompt, since answers can't be matched to rows otherwise. Empty answers are rejected on
+        their own.
+        """
+        answers = None
+        start, end = (content.find("["), content.rfind("]")) if content else (-1, -1)
+        if 0 <= start < end:
+            try:
+                answers = json.loads(content[start:end + 1])
+            except json.JSONDecodeError:
+                pass
+        if not isinstance(answers, list) or len(answers) != len(prompts):
+            self._debug_log(f"[yellow]Could not split the packed answer of {node}, generating its rows on their own")
+            answers = [None] * len(prompts)
+
+        stop = self.generation_params[node].get('stop') or []
+        for idx, answer in enumerate(answers):
+            if answer is not None and not isinstance(answer, str):
+                answer = json.dumps(answer, ensure_ascii=False)
+            for sequence in stop:
+                answer = answer.split(sequence, 1)[0] if answer else answer
+            answers[idx] = answer if answer and not answer.isspace() else None
+
+            if answers[idx] is not None and (cache_key := self._cache_key(node, prompts[idx])):
+                self.cache.put(cache_key, answers[idx])
+
+        with self._stats_lock:
+            stats = self.pack_stats[node]
+            stats["requests"] += 1
+            stats["cells"] += len(prompts)
+            stats["fallbacks"] += sum(answer is None for answer in answers)
+        return answers
+
+    def _cache_key(self, node: str, prompt: str) -> str | None:
+        """Return the completion cache key for a materialized prompt, if caching is enabled."""
+        if self.cache is None:
+            return None
+        config = self.config['columns'][node]
+        # With a base_url, completions come from that endpoint, not from the column's provider
+        provider = self.base_url or config['modelProvider']
+        return self.cache.make_key(provider, config['modelName'], self.generation_params[node], prompt)
 
-    def _generate_completion(self, client: InferenceClient, model: str, prompt: str) -> str:
-        """Generate completion using the specified model."""
+    def _generate_completion(
+        self,
+        client: InferenceClient,
+        model: str,
+        prompt: str,
+        completion_kwargs: dict | None = None,
+        *,
+        node: str,
+        queued_at: float | None = None,
+    ) -> str:
+        """
+        Generate completion using the specified model, recording its metrics under the node.
+
+        With hedgePercentile, a request still running after that percentile of the column's
+        latencies is duplicated to its first alternate provider (or the same provider), and the
+        first answer wins. The other request keeps running to measure the latency hedging saved,
+        until its current attempt answers or times out: it isn't retried.
+        """
+        threshold = self._hedge_threshold(node)
+        if threshold is None:
+            return self._request_completion(client, model, prompt, completion_kwargs, node=node, queued_at=queued_at)
+
+        sent = threading.Event()
+        answered = threading.Event()
+        primary = self._hedge_executor.submit(
+            self._request_completion, client, model, prompt, completion_kwargs,
+            node=node, queued_at=queued_at, on_sent=sent.set, abandoned=answered,
+        )
+        # The hedging delay starts once the request is sent, not while it waits for the rate limiter
+        while not sent.wait(0.05) and not primary.done():
+            pass
+        started = time.perf_counter()
+        primary.add_done_callback(lambda _: self._record_hedging(node, unhedged_latency=time.perf_counter() - started))
+
+        try:
+            if wait([primary], timeout=threshold).done:
+                return primary.result()
+
+            hedge_client = self.get_client_for_node(node, self.bill_to, provider=self._hedge_provider(node, client))
+            self._debug_log(f"[yellow]Hedging {node} on {hedge_client.provider} after {threshold:.2f}s")
+            hedge = self._hedge_executor.submit(
+                self._request_completion, hedge_client, model, prompt, completion_kwargs, node=node, abandoned=answered)
+            self._record_hedging(node, hedged=True)
+
+            error = None
+            for future in as_completed([primary, hedge]):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if future is hedge:
+                    self._record_hedging(node, hedge_won=True)
+                else:
+                    hedge.cancel()
+                return result
+            raise error
+        finally:
+            answered.set()
+            self._record_hedging(node, latency=time.perf_counter() - started)
+
+    async def _agenerate_completion(
+        self,
+        client: AsyncInferenceClient,
+        model: str,
+        prompt: str,
+        completion_kwargs: dict | None = None,
+        *,
+        node: str,
+        queued_at: float | None = None,
+    ) -> str:
+        """Generate completion using the specified model without blocking the event loop, hedging like _generate_completion."""
+        threshold = self._hedge_threshold(node)
+        if threshold is None:
+            return await self._arequest_completion(
+                client, model, prompt, completion_kwargs, node=node, queued_at=queued_at)
+
+        sent = asyncio.Event()
+        primary = asyncio.create_task(self._arequest_completion(
+            client, model, prompt, completion_kwargs, node=node, queued_at=queued_at, on_sent=sent.set))
+        sent_waiter = asyncio.create_task(sent.wait())
+        # The hedging delay starts once the request is sent, not while it waits for the rate limiter
+        await asyncio.wait([primary, sent_waiter], return_when=asyncio.FIRST_COMPLETED)
+        sent_waiter.cancel()
+        started = time.perf_counter()
+        primary.add_done_callback(lambda _: self._record_hedging(node, unhedged_latency=time.perf_counter() - started))
+
+        try:
+            done, _ = await asyncio.wait([primary], timeout=threshold)
+            if done:
+                return primary.result()
+
+            hedge_client = self.get_async_client_for_node(
+                node, self.bill_to, provider=self._hedge_provider(node, client))
+            self._debug_log(f"[yellow]Hedging {node} on {hedge_client.provider} after {threshold:.2f}s")
+            hedge = asyncio.create_task(self._arequest_completion(
+                hedge_client, model, prompt, completion_kwargs, node=node))
+            self._record_hedging(node, hedged=True)
+
+            error = None
+            for next_done in asyncio.as_completed([primary, hedge]):
+                try:
+                    result = await next_done
+                except Exception as e:
+                    error = error or e
+                    continue
+                if primary.done() and not primary.cancelled() and primary.exception() is None:
+                    hedge.cancel()
+                else:
+                    # The primary request keeps running until it answers, for at most a request timeout
+                    self._record_hedging(node, hedge_won=True)
+                    self._hedged_requests.add(primary)
+                    primary.add_done_callback(self._hedged_requests.discard)
+                    asyncio.get_running_loop().call_later(self.request_timeouts[node], primary.cancel)
+                return result
+            raise error
+        finally:
+            self._record_hedging(node, latency=time.perf_counter() - started)
+
+    def _hedge_threshold(self, node: str) -> float | None:
+        """Return the latency after which a request of the column is hedged, if it hedges."""
+        if (percentile := self.hedge_percentiles.get(node)) is None:
+            return None
+        return self.metrics.latency_quantile(node, percentile / 100, min_count=self.HEDGE_MIN_REQUESTS)
+
+    def _hedge_provider(self, node: str, client) -> str:
+        """Hedge on the first alternate provider of the column, or on the same provider without one."""
+        return next((provider for provider in self.providers[node] if provider != client.provider), client.provider)
+
+    def _record_hedging(
+        self,
+        node: str,
+        *,
+        hedged: bool = False,
+        hedge_won: bool = False,
+        latency: float | None = None,
+        unhedged_latency: float | None = None,
+    ) -> None:
+        """
+        Record the hedging of a request. latency is how long the cell waited for its first answer,
+        and unhedged_latency how long it would have waited without hedging: the latency of its
+        primary request, or a lower bound if the run ended before it answered.
+        """
+        with self._stats_lock:
+            stats = self.hedge_stats[node]
+            stats["hedges"] += hedged
+            stats["hedges_won"] += hedge_won
+            if latency is not None:
+                stats["latency"].observe(latency)
+            if unhedged_latency is not None:
+                stats["unhedged_latency"].observe(unhedged_latency)
+
+    def _request_completion(
+        self,
+        client: InferenceClient,
+        model: str,
+        prompt: str,
+        completion_kwargs: dict | None = None,
+        *,
+        node: str,
+        queued_at: float | None = None,
+        on_sent: Callable[[], None] | None = None,
+        abandoned: threading.Event | None = None,
+    ) -> str:
+        """
+        Send a completion request, retrying after rate limits. After repeated rate limits, server
+        errors or timeouts, the request moves on to the next alternate provider of the column.
+        Once abandoned is set, e.g. by the other request of a hedge, the request isn't retried.
+        """
         messages = [{"role": "user", "content": prompt}]
+        providers = [client.provider] + [provider for provider in self.providers[node] if provider != client.provider]
+        limiter = self.rate_limiters[client.provider]
+        estimated_tokens = self._estimate_tokens(prompt)
 
-        # Implement retry with exponential backoff for rate limiting
-        max_retries = 5
-        retry_count = 0
-        base_delay = self.request_delay or 1.0  # Use request_delay if set, otherwise default to 1 second
+        ready_at = queued_at or time.perf_counter()
 
-        while retry_count < max_retries:
+        max_retries = 5
+        position = attempt = errors = 0
+        abandoned = abandoned or threading.Event()
+        while True:
+            attempt += 1
+            while not abandoned.is_set() and (delay := limiter.reserve(estimated_tokens)) > 0:
+                self.metrics.increment(node, "rate_limit_wait", delay)
+                time.sleep(delay)
+            if abandoned.is_set():
+                raise TimeoutError(f"Request of {node} abandoned, the other request of its hedge answered")
             try:
-                # Add delay if specified to avoid rate limiting
-                if retry_count > 0 or self.request_delay > 0:
-                    # Calculate exponential backoff with jitter
-                    if retry_count > 0:
-                        delay = base_delay * (2 ** retry_count) + random.uniform(0, 1)
-                        self._debug_log(
-                            f"[yellow]Rate limit hit. Retrying in {delay:.2f} seconds (attempt {retry_count + 1}/{max_retries})")
-                    else:
-                        delay = base_delay
-                    time.sleep(delay)
+                with self.clients.connection(client.provider):
+                    sent_at = time.perf_counter()
+                    self.metrics.observe_queue_wait(node, sent_at - ready_at)
+                    if on_sent is not None:
+                        on_sent()
+                    completion = client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        **(completion_kwargs or {}),
+                    )
+            except Exception as e:
+                has_alternate = position + 1 < len(providers)
+                if self._handle_request_error(e, node, limiter, estimated_tokens, attempt, max_retries, errors, has_alternate):
+                    position += 1
+                    attempt = errors = 0
+                    client = self.get_client_for_node(node, self.bill_to, provider=providers[position])
+                    limiter = self.rate_limiters[client.provider]
+                else:
+                    errors += 1
+                ready_at = time.perf_counter()
+                continue
 
-                completion = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                )
-                return completion.choices[0].message.content
+            limiter.on_success(self._used_tokens(completion, estimated_tokens) - estimated_tokens)
+            return self._record_completion(node, completion, time.perf_counter() - sent_at, estimated_tokens)
 
+    async def _arequest_completion(
+        self,
+        client: AsyncInferenceClient,
+        model: str,
+        prompt: str,
+        completion_kwargs: dict | None = None,
+        *,
+        node: str,
+        queued_at: float | None = None,
+        on_sent: Callable[[], None] | None = None,
+    ) -> str:
+        """Send a completion request like _request_completion, without blocking the event loop."""
+        messages = [{"role": "user", "content": prompt}]
+        providers = [client.provider] + [provider for provider in self.providers[node] if provider != client.provider]
+        limiter = self.rate_limiters[client.provider]
+        estimated_tokens = self._estimate_tokens(prompt)
+
+        ready_at = queued_at or time.perf_counter()
+
+        max_retries = 5
+        position = attempt = errors = 0
+        while True:
+            attempt += 1
+            # Wait for the send slot outside the semaphore so throttled cells don't hold it
+            while (delay := limiter.reserve(estimated_tokens)) > 0:
+                self.metrics.increment(node, "rate_limit_wait", delay)
+                await asyncio.sleep(delay)
+            try:
+                async with self.clients.async_connection(client.provider):
+                    sent_at = time.perf_counter()
+                    self.metrics.observe_queue_wait(node, sent_at - ready_at)
+                    if on_sent is not None:
+                        on_sent()
+                    completion = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        **(completion_kwargs or {}),
+                    )
             except Exception as e:
-                # Check if it's a rate limit error
-                if "429" in str(e) or "rate_limit" in str(e).lower():
-                    retry_count += 1
-                    if retry_count >= max_retries:
-                        self._debug_log(f"[red]Max retries reached for rate limit. Giving up.")
-                        raise
+                has_alternate = position + 1 < len(providers)
+                if self._handle_request_error(e, node, limiter, estimated_tokens, attempt, max_retries, errors, has_alternate):
+                    position += 1
+                    attempt = errors = 0
+                    client = self.get_async_client_for_node(node, self.bill_to, provider=providers[position])
+                    limiter = self.rate_limiters[client.provider]
                 else:
-                    # Not a rate limit error, re-raise
-                    raise
+                    errors += 1
+                ready_at = time.perf_counter()
+                continue
+
+            limiter.on_success(self._used_tokens(completion, estimated_tokens) - estimated_tokens)
+            return self._record_completion(node, completion, time.perf_counter() - sent_at, estimated_tokens)
 
-        # Should not reach here, but just in case
-        raise Exception("Failed to generate completion after maximum retries")
+    def _handle_request_error(
+        self,
+        e: Exception,
+        node: str,
+        limiter: AdaptiveRateLimiter,
+        tokens: int,
+        attempt: int,
+        max_retries: int,
+        errors: int,
+        has_alternate: bool,
+    ) -> bool:
+        """
+        Re-raise errors that can't be retried. Otherwise return whether the request fails over to
+        the next provider, after FAILOVER_AFTER consecutive errors, or is retried on the same one.
+
+        Rate limits are retried on a provider without alternates, server errors and timeouts are
+        only retried when an alternate can take over.
+        """
+        failover = has_alternate and errors + 1 >= self.FAILOVER_AFTER
+        if self._is_rate_limit_error(e):
+            self.metrics.increment(node, "rate_limited")
+            if failover:
+                limiter.on_rate_limited(self._retry_after(e), tokens=tokens)
+            else:
+                self._handle_rate_limit(limiter, e, tokens, attempt, max_retries)
+        elif not (has_alternate and self._is_server_error(e)):
+            raise e
+
+        self.metrics.increment(node, "retries")
+        if failover:
+            self._debug_log(f"[yellow]Failing over {node} after {errors + 1} errors: {self._error_reason(e)}")
+            with self._stats_lock:
+                self.hedge_stats[node]["failovers"] += 1
+        return failover
+
+    def _handle_rate_limit(
+        self,
+        limiter: AdaptiveRateLimiter,
+        e: Exception,
+        tokens: int,
+        attempt: int,
+        max_retries: int,
+    ) -> None:
+        """Slow the provider down for every worker, and re-raise once out of retries."""
+        retry_after = self._retry_after(e)
+        limiter.on_rate_limited(retry_after, tokens=tokens)
+        if attempt >= max_retries:
+            self._debug_log(f"[red]Max retries reached for rate limit. Giving up.")
+            raise e
+
+        self._debug_log(
+            f"[yellow]Rate limit hit. Retrying at {limiter.rate:.2f} req/s"
+            f"{f' after {retry_after:.0f}s' if retry_after else ''} (attempt {attempt + 1}/{max_retries})")
+
+    def _record_completion(self, node: str, completion, latency: float, estimated_tokens: int) -> str:
+        """Record the latency and token usage of a completion, and return its content."""
+        content = completion.choices[0].message.content
+        usage = getattr(completion, "usage", None)
+        self.metrics.observe_request(
+            node,
+            latency,
+            prompt_tokens=getattr(usage, "prompt_tokens", None) or estimated_tokens,
+            completion_tokens=getattr(usage, "completion_tokens", None) or self._estimate_tokens(content or ""),
+        )
+        return content
+
+    @staticmethod
+    def _estimate_tokens(prompt: str) -> int:
+        # Rough chars-per-token heuristic, corrected with the reported usage after each response
+        return len(prompt) // 4
+
+    @staticmethod
+    def _used_tokens(completion, default: int) -> int:
+        usage = getattr(completion, "usage", None)
+        return getattr(usage, "total_tokens", None) or default
+
+    @staticmethod
+    def _is_rate_limit_error(e: Exception) -> bool:
+        status_code = getattr(getattr(e, "response", None), "status_code", None)
+        if status_code is not None:
+            return status_code == 429
+        return "429" in str(e) or "rate_limit" in str(e).lower()
+
+    @staticmethod
+    def _is_server_error(e: Exception) -> bool:
+        """Whether a request failed on the provider side, with a 5xx response or a timeout."""
+        status_code = getattr(getattr(e, "response", None), "status_code", None)
+        if status_code is not None:
+            return status_code >= 500
+        return isinstance(e, TimeoutError) or "Timeout" in type(e).__name__
+
+    @staticmethod
+    def _retry_after(e: Exception) -> float | None:
+        """Return the delay requested by the provider's Retry-After header, if any."""
+        headers = getattr(getattr(e, "response", None), "headers", None) or {}
+        value = headers.get("Retry-After")
+        if not value:
+            return None
 
-    def generate_row(self, progress, task_nodes, row_num, row_data=None):
-        """Process a single node in the pipeline."""
         try:
-            row = {}
-            if row_data:
-                row.update(row_data)
-                progress.update(task_nodes, description=f"[cyan]Row {row_num}: Loaded source data")
-
-            queue = deque(self.root_nodes)
-            in_progress = set()
-            processed_nodes = set()
-
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                while queue or in_progress:
-                    ready_nodes = [
-                        node for node in queue
-                        if node not in processed_nodes
-                           and node not in in_progress
-                           and all(dep in row for dep in self.reverse_graph[node])
-                    ]
-
-                    for node in ready_nodes:
-                        queue.remove(node)
-                        progress.update(task_nodes, description=f"[cyan]Row {row_num}: Processing {node}")
-
-                    futures = {
-                        executor.submit(self.process_node, node, row, self.bill_to): node
-                        for node in ready_nodes
-                    }
-                    in_progress.update(futures.values())
-
-                    for future in as_completed(futures):
-                        node = futures[future]
-                        try:
-                            node, result = future.result()
-                            row[node] = result
-                            in_progress.remove(node)
-                            processed_nodes.add(node)
-                            progress.advance(task_nodes)
-
-                            for dependent in self.graph[node]:
-                                if (dependent not in processed_nodes and
-                                        dependent not in queue and
-                                        dependent not in in_progress):
-                                    queue.append(dependent)
-                        except Exception as e:
-                            in_progress.remove(node)
-                            processed_nodes.add(node)
-                            progress.update(task_nodes, description=f"[red]Row {row_num}: Failed {node}")
-                            raise
+            return max(0.0, float(value))
+        except ValueError:
+            pass
 
-            return row
-        except Exception as e:
-            self._debug_log(f"\n[red]Error processing row {row_num}: {str(e)}")
-            raise
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def run(self, engine: str = "threads", writer: ShardedDatasetWriter | None = None) -> Dataset | None:
+        """
+        Generate all rows.
+
+        Args:
+            engine: Execution engine, either "threads" (blocking clients on a worker pool) or
+                "async" (AsyncInferenceClient on an event loop, bounded per provider)
+            writer: Sink for finished rows. If None, rows are written to Parquet shards in a
+                temporary directory and returned as a dataset.
+
+        Returns:
+            The generated dataset, or None if the rows went to the given writer
+        """
+        if engine not in ("threads", "async"):
+            raise ValueError(f"Unknown engine: {engine}. Expected 'threads' or 'async'.")
+
+        # Replacing huggingface_hub's client factory closes its shared session, so the HTTP pool is
+        # sized once, before the writer uploads shards over that session
+        pool = self._build_client_pool(engine)
+        providers = {provider for providers in self.providers.values() for provider in providers}
+        _configure_http_pool(max(1, sum(pool.pool_size(provider) for provider in providers)))
+
+        owns_writer = writer is None
+        self.writer = writer or ShardedDatasetWriter(
+            tempfile.mkdtemp(prefix="extend_dataset_"),
+            self.output_features,
+        )
+        output_writer = self.writer
+        if self.source_projection == "join":
+            # Generated rows are staged with their source index, and joined with the untouched
+            # source columns once generation is done
+            self.writer = ShardedDatasetWriter(
+                tempfile.mkdtemp(prefix="extend_dataset_"),
+                self._row_features(self.source_dataset.features, with_index=True),
+            )
+
+        # Rows restored from checkpoints go first
+        if self.checkpointer is not None:
+            for row in self.checkpointer.iter_rows(with_index=self._indexed_rows, num_rows=self.num_rows):
+                self.writer.write(row)
+                self.completed_rows += 1
 
-    def run(self):
         start_time = time.time()
         with Progress(
                 SpinnerColumn(),
@@ -313,68 +2312,543 @@ class Pipeline:
                 expand=True
         ) as progress:
             task_rows = progress.add_task("[bold cyan]Generating dataset rows", total=self.num_rows)
-            task_nodes = progress.add_task("[cyan]Processing nodes (per row)", total=len(self.config['columns']))
+            task_cells = progress.add_task(
+                "[cyan]Processing cells",
+                total=self.num_rows * len(self.config['columns']) if self.num_rows is not None else None,
+            )
 
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # If num_rows is None, use the entire dataset
+            if self.num_rows is None:
+                source = self.source_dataset
+                # Update progress bar with unknown total
+                progress.update(task_rows, total=None)
+            else:
+                source = self.source_dataset.take(self.num_rows)
 
-                # If num_rows is None, use the entire dataset
-                if self.num_rows is None:
-                    dataset_iter = enumerate(self.source_dataset)
-                    # Update progress bar with unknown total
-                    progress.update(task_rows, total=None)
-                else:
-                    dataset_iter = enumerate(self.source_dataset.take(self.num_rows))
-
-                futures = {
-                    executor.submit(
-                        self.generate_row,
-                        progress,
-                        task_nodes,
-                        i + 1,
-                        dict(source_row)  # Convert to dict if streaming
-                    ): i
-                    for i, source_row in dataset_iter
-                }
+            dataset_iter = self._iter_pending_rows(source)
+            progress.update(task_rows, completed=self.completed_rows)
 
-                for future in as_completed(futures):
-                    i = futures[future]
-                    row_num = i + 1
-                    try:
-                        row = future.result()
-                        self.results.append(row)
-                        progress.advance(task_rows)
-                        progress.update(task_rows,
-                                        description=f"[bold green]✓ Completed {len(self.results)}/{self.num_rows} rows")
-                        progress.reset(task_nodes)  # Reset node progress for next row
-                    except Exception as e:
-                        progress.update(task_rows, description=f"[bold red]✗ Row {row_num} failed")
-                        rprint(f"\n[red]Error in row {row_num}: {str(e)}")
-                        continue
+            try:
+                self._run_engine(engine, progress, task_rows, task_cells, dataset_iter)
+
+                if self._partial_rows and self.retry_failed:
+                    # Re-run only the failed and skipped cells, keeping the completed ones
+                    partial_rows, self._partial_rows = self._partial_rows, {}
+                    retried_cells = sum(len(errors) for _, errors in partial_rows.values())
+                    if self.num_rows is not None:
+                        progress.update(task_cells, total=progress.tasks[task_cells].total + retried_cells)
+                    progress.update(
+                        task_rows,
+                        description=f"[bold yellow]Retrying {retried_cells} cells of {len(partial_rows)} rows",
+                    )
+                    self._run_engine(engine, progress, task_rows, task_cells, (
+                        (i, {column: value for column, value in row.items() if column not in errors})
+                        for i, (row, errors) in partial_rows.items()
+                    ))
+            finally:
+                # Persist completed rows even if the run is interrupted
+                if self.checkpointer is not None:
+                    self.checkpointer.flush()
+
+            # Keep the rows whose cells still failed, with nulls in place of those cells. They are
+            # not checkpointed, so a resumed run generates them again.
+            for i, (row, errors) in sorted(self._partial_rows.items()):
+                self.failed_cells[i] = errors
+                self._write_row(progress, task_rows, i, row)
+                self.metrics.row_failed()
+
+        if output_writer is not self.writer:
+            with self.console.status("[bold green]Joining the untouched source columns..."):
+                self._join_source_columns(self.writer.to_dataset(), output_writer)
+            shutil.rmtree(self.writer.directory)
+            self.writer = output_writer
+            self._partial_rows = {}
 
         total_time = time.time() - start_time
         minutes = int(total_time // 60)
         seconds = int(total_time % 60)
 
-        if len(self.results) == self.num_rows:
+        if self.completed_rows == self.num_rows and not self.failed_cells:
             rprint(Panel(
                 f"[bold green]✓[/] Successfully generated all {self.num_rows} rows!\nTotal time: {minutes}m {seconds}s"))
         else:
             rprint(Panel(
-                f"[bold yellow]![/] Completed with {len(self.results)}/{self.num_rows} rows generated\nTotal time: {minutes}m {seconds}s"))
+                f"[bold yellow]![/] Completed with {self.completed_rows}/{self.num_rows} rows generated\nTotal time: {minutes}m {seconds}s"))
+
+        if self.failed_cells:
+            rprint(Panel(self._failed_cells_summary()))
+
+        if self.cache is not None:
+            rprint(Panel(self.cache.summary()))
+
+        if self.pack_stats:
+            summary = ["[bold blue]Row packing[/]"]
+            for node, stats in self.pack_stats.items():
+                summary.append(
+                    f"• [cyan]{node}[/]: {stats['requests']} requests for {stats['cells']} cells, "
+                    f"{stats['fallbacks']} cells generated on their own")
+            rprint(Panel("\n".join(summary)))
+
+        if self.dedup_stats:
+            summary = ["[bold blue]Prompt deduplication[/]"]
+            for node, stats in self.dedup_stats.items():
+                ratio = 1 - stats["requests"] / stats["cells"] if stats["cells"] else 0.0
+                summary.append(
+                    f"• [cyan]{node}[/]: {stats['requests']} requests for {stats['cells']} cells ({ratio:.1%} deduplicated)")
+            rprint(Panel("\n".join(summary)))
+
+        if self.hedge_stats:
+            summary = ["[bold blue]Hedging and failover[/]"]
+            for node, stats in self.hedge_stats.items():
+                line = f"• [cyan]{node}[/]: {stats['failovers']} failovers"
+                if stats["latency"].count:
+                    p99 = stats["latency"].quantile(0.99)
+                    unhedged_p99 = stats["unhedged_latency"].quantile(0.99)
+                    line += (
+                        f", {stats['hedges']} hedged requests ({stats['hedges_won']} won), "
+                        f"p99 {p99:.2f}s against {unhedged_p99:.2f}s unhedged ({unhedged_p99 - p99:.2f}s saved)")
+                summary.append(line)
+            rprint(Panel("\n".join(summary)))
+
+        summary = ["[bold blue]Rate limiting[/]"]
+        for provider, limiter in self.rate_limiters.items():
+            summary.append(
+                f"• [cyan]{provider}[/]: {limiter.requests} requests, {limiter.throttled} throttled (429), "
+                + (f"final rate {limiter.rate:.1f} req/s" if limiter.throttling else "not throttled")
+            )
+        rprint(Panel("\n".join(summary)))
+        rprint(Panel(self.metrics.summary()))
 
-        # Create Hugging Face dataset with both source and generated columns
-        dataset_dict = {}
+        if owns_writer:
+            return self.writer.to_dataset()
 
-        # Add source columns first
-        for col in self.source_columns:
-            dataset_dict[col] = [row.get(col) for row in self.results]
+        self.writer.close()
+        return None
 
-        # Add generated columns
-        for col in self.config['columns']:
-            dataset_dict[col] = [row.get(col) for row in self.results]
+    def _run_engine(self, engine: str, progress, task_rows, task_cells, dataset_iter) -> None:
+        if engine == "async":
+            self.clients = self._build_client_pool(engine)
+            asyncio.run(self._run_async(progress, task_rows, task_cells, dataset_iter))
+        else:
+            self.clients = self._build_client_pool(engine)
+            # Hedged requests run off the worker, which waits for the first one to answer
+            if self.hedge_percentiles:
+                self._hedge_executor = ThreadPoolExecutor(max_workers=3 * self.max_workers)
+            try:
+                self._run_threads(progress, task_rows, task_cells, dataset_iter)
+            finally:
+                if self.hedge_percentiles:
+                    self._hedge_executor.shutdown(wait=False, cancel_futures=True)
+            self.clients.close()
+
+    def _failed_cells_summary(self, max_cells: int = 20) -> str:
+        cells = [
+            (i, column, error) for i, errors in sorted(self.failed_cells.items()) for column, error in errors.items()
+        ]
+        counts = defaultdict(int)
+        for _, column, _ in cells:
+            counts[column] += 1
+
+        summary = [f"[bold red]Failed cells[/] ({len(cells)} cells in {len(self.failed_cells)} rows, left null)"]
+        summary.extend(f"• [cyan]{column}[/]: {count} cells" for column, count in counts.items())
+        summary.append("")
+        summary.extend(f"• Row {i + 1}, [cyan]{column}[/]: {error}" for i, column, error in cells[:max_cells])
+        if len(cells) > max_cells:
+            summary.append(f"... and {len(cells) - max_cells} more")
+        return "\n".join(summary)
+
+    def _iter_pending_rows(self, source):
+        """Enumerate source rows, skipping the ones restored from checkpoints."""
+        done = self._checkpointed_indices
+        if not done:
+            yield from enumerate(source)
+            return
+
+        # Checkpointed rows are mostly a prefix of the source, which the stream can skip over
+        prefix = 0
+        while prefix in done:
+            prefix += 1
+
+        for i, row in enumerate(source.skip(prefix) if prefix else source, start=prefix):
+            if i not in done:
+                yield i, row
+
+    def _run_threads(self, progress, task_rows, task_cells, dataset_iter) -> None:
+        """Run the pipeline on a single bounded thread pool."""
+        # Every (row, column) cell is a task for a single worker pool. A cell is submitted as
+        # soon as the columns it references are available in its own row, regardless of what
+        # the other rows are doing. Only a bounded window of rows is pulled from the stream:
+        # the next source row is admitted when a previous one completes, so memory stays flat.
+        # Cells of columns setting packRows wait for their pack to fill up, and a worker sends
+        # the whole pack as a single request.
+        rows: dict[int, dict] = {}  # rows in flight, by source index
+        waiting: dict[int, set[str]] = {}  # cells not yet submitted, by source index
+        remaining: dict[int, int] = {}  # cells not yet completed, by source index
+        errors: dict[int, dict[str, str]] = {}  # failed and skipped cells, by source index
+        futures = {}  # cell future -> [(source index, column), ...] waiting on it
+        shared = DedupTable(self.DEDUP_MAX_COMPLETED)  # (column, prompt) -> future of deduplicated columns
+        shared_keys = {}  # future of a deduplicated column -> its (column, prompt)
+        packs = defaultdict(list)  # column -> [(row, cell future, ready time), ...] of its next pack
+        pack_deadlines = {}  # column -> time its next pack is sent, even if it isn't full
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            def submit_cell(i: int, node: str) -> None:
+                row = rows[i]
+                key = self._dedup_key(node, row)
+                if key is not None and (future := shared.get(key)) is not None:
+                    # Completed futures are simply waited on again, so they fan out immediately
+                    futures.setdefault(future, []).append((i, node))
+                    return
+
+                if self.pack_rows[node] > 1:
+                    future = Future()
+                    packs[node].append((row, future, time.perf_counter()))
+                    pack_deadlines.setdefault(node, time.perf_counter() + self.PACK_WAIT_SECONDS)
+                    if len(packs[node]) >= self.pack_rows[node]:
+                        submit_pack(node)
+                else:
+                    future = executor.submit(self.process_node, node, row, self.bill_to, time.perf_counter())
+                futures[future] = [(i, node)]
+                if key is not None:
+                    shared.add(key, future)
+                    shared_keys[future] = key
+                    self.dedup_stats[node]["requests"] += 1
+
+            def submit_pack(node: str) -> None:
+                cells = packs.pop(node)
+                del pack_deadlines[node]
+                pack = executor.submit(
+                    self.process_pack, node, [row for row, _, _ in cells], self.bill_to, cells[0][2])
+                pack.add_done_callback(lambda pack: resolve_pack(node, cells, pack))
+
+            def resolve_pack(node: str, cells: list, pack: Future) -> None:
+                # Runs in the worker that sent the pack
+                try:
+                    answers = pack.result()
+                except Exception as e:
+                    for _, future, _ in cells:
+                        future.set_exception(e)
+                    return
+
+                for (row, future, _), answer in zip(cells, answers):
+                    if answer is not None:
+                        future.set_result((node, answer))
+                        continue
 
-        dataset = Dataset.from_dict(dataset_dict)
-        return dataset
+                    # Rows whose answer couldn't be parsed are generated on their own
+                    single = executor.submit(self.process_node, node, row, self.bill_to, time.perf_counter())
+                    single.add_done_callback(lambda single, future=future: forward_result(single, future))
+
+            def forward_result(source: Future, target: Future) -> None:
+                if (e := source.exception()) is not None:
+                    target.set_exception(e)
+                else:
+                    target.set_result(source.result())
+
+            def submit_ready_cells(i: int, nodes) -> None:
+                row = rows[i]
+                for node in nodes:
+                    if node in waiting[i] and all(dep in row for dep in self.reverse_graph[node]):
+                        waiting[i].remove(node)
+                        progress.update(task_cells, description=f"[cyan]Row {i + 1}: Processing {node}")
+                        submit_cell(i, node)
+
+            def complete_row(i: int) -> None:
+                del waiting[i], remaining[i]
+                self._complete_row(progress, task_rows, i, rows.pop(i), errors.pop(i))
+
+            def fail_cell(i: int, node: str, e: Exception) -> None:
+                # The cells depending on a failed cell can't run, so they are skipped along with it
+                failed = {node: self._error_reason(e)}
+                failed.update(
+                    (dependent, f"Skipped: {node} failed") for dependent in self._dependents(node)
+                    if dependent in waiting[i]
+                )
+                for column, reason in failed.items():
+                    waiting[i].discard(column)
+                    rows[i][column] = None
+                    errors[i][column] = reason
+
+                remaining[i] -= len(failed)
+                progress.advance(task_cells, len(failed))
+                if not remaining[i]:
+                    complete_row(i)
+
+            def admit_next_row() -> bool:
+                start = time.perf_counter()
+                try:
+                    i, source_row = next(dataset_iter)
+                except StopIteration:
+                    return False
+                finally:
+                    self.metrics.add_source_wait(time.perf_counter() - start)
+
+                rows[i] = dict(source_row)  # Convert to dict if streaming
+                # Retried rows already hold the cells that completed before
+                waiting[i] = set(self.config['columns']) - rows[i].keys()
+                remaining[i] = len(waiting[i])
+                errors[i] = {}
+                if remaining[i]:
+                    submit_ready_cells(i, self.topological_order)
+                else:
+                    complete_row(i)
+                return True
+
+            while len(rows) < self.max_rows_in_flight and admit_next_row():
+                pass
+
+            while futures:
+                if packs and len(futures) <= sum(len(cells) for cells in packs.values()):
+                    # Nothing in flight can add cells to the pending packs, send them as they are
+                    for node in list(packs):
+                        submit_pack(node)
+
+                timeout = max(0.0, min(pack_deadlines.values()) - time.perf_counter()) if pack_deadlines else None
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                for node, deadline in list(pack_deadlines.items()):
+                    if deadline <= time.perf_counter():
+                        submit_pack(node)
+
+                for future in done:
+                    if (key := shared_keys.pop(future, None)) is not None:
+                        # Let later duplicates retry instead of sharing a failure
+                        if future.exception() is None:
+                            shared.complete(key)
+                        else:
+                            shared.discard(key)
+
+                    for i, node in futures.pop(future):
+                        if i not in rows:
+                            # Another cell of this row already failed
+                            continue
+
+                        try:
+                            _, result = future.result()
+                        except Exception as e:
+                            fail_cell(i, node, e)
+                        else:
+                            rows[i][node] = result
+                            remaining[i] -= 1
+                            progress.advance(task_cells)
+                            if remaining[i]:
+                                submit_ready_cells(i, self.graph[node])
+                            else:
+                                complete_row(i)
+
+                    while len(rows) < self.max_rows_in_flight and admit_next_row():
+                        pass
+
+    async def _run_async(self, progress, task_rows, task_cells, dataset_iter) -> None:
+        """Run the pipeline on an event loop, bounding in-flight requests per provider."""
+        row_tasks = {}  # row task -> source index
+        self._shared_tasks = DedupTable(self.DEDUP_MAX_COMPLETED)  # (column, prompt) -> task of deduplicated columns
+        self._async_packs = {}  # column -> [(row, cell future, ready time), ...] of its next pack
+        self._async_pack_timers = {}  # column -> timer sending its next pack, even if it isn't full
+        self._pack_tasks = set()  # packs being sent
+        self._hedged_requests = set()  # primary requests still running after their hedge answered
+
+        async def admit_next_row() -> bool:
+            # Reading from the Hub stream may block, so keep it off the event loop
+            start = time.perf_counter()
+            item = await asyncio.to_thread(next, dataset_iter, None)
+            self.metrics.add_source_wait(time.perf_counter() - start)
+            if item is None:
+                return False
+
+            i, source_row = item
+            task = asyncio.create_task(self._agenerate_row(progress, task_cells, dict(source_row)))
+            row_tasks[task] = i
+            return True
+
+        try:
+            while len(row_tasks) < self.max_rows_in_flight and await admit_next_row():
+                pass
+
+            while row_tasks:
+                done, _ = await asyncio.wait(row_tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    i = row_tasks.pop(task)
+                    try:
+                        row, errors = task.result()
+                    except Exception as e:
+                        self._fail_row(progress, task_rows, i, e)
+                    else:
+                        self._complete_row(progress, task_rows, i, row, errors)
+
+                while len(row_tasks) < self.max_rows_in_flight and await admit_next_row():
+                    pass
+        finally:
+            for task in list(self._hedged_requests):
+                task.cancel()
+            await asyncio.gather(*self._hedged_requests, return_exceptions=True)
+            await self.clients.aclose()
+
+    async def _agenerate_row(self, progress, task_cells, row: dict) -> tuple[dict, dict[str, str]]:
+        """
+        Generate the missing cells of a row, starting each one as soon as its dependencies are done.
+
+        Failed cells, and the cells depending on them, are set to None. Returns the row and the
+        error of each of those cells.
+        """
+        cells = {}
+        errors = {}
+
+        async def generate_cell(node: str) -> None:
+            await asyncio.gather(*(cells[dep] for dep in self.reverse_graph[node] if dep in cells))
+
+            if failed := [dep for dep in self.reverse_graph[node] if dep in errors]:
+                row[node] = None
+                # Point at the cell that actually failed, not at a skipped one
+                reason = errors[failed[0]]
+                errors[node] = reason if reason.startswith("Skipped") else f"Skipped: {failed[0]} failed"
+                progress.advance(task_cells)
+                return
+
+            try:
+                key = self._dedup_key(node, row)
+                if key is None:
+                    _, row[node] = await self._agenerate_cell(node, row)
+                else:
+                    if (task := self._shared_tasks.get(key)) is None:
+                        task = asyncio.create_task(self._agenerate_cell(node, row))
+                        # Let later duplicates retry instead of sharing a failure
+                        task.add_done_callback(
+                            lambda t: self._shared_tasks.complete(key) if not t.cancelled() and t.exception() is None
+                            else self._shared_tasks.discard(key))
+                        self._shared_tasks.add(key, task)
+                        self.dedup_stats[node]["requests"] += 1
+                    _, row[node] = await task
+            except Exception as e:
+                row[node] = None
+                errors[node] = self._error_reason(e)
+
+            progress.advance(task_cells)
+
+        # Dependencies always come first in topological order, so their tasks already exist.
+        # Retried rows already hold the cells that completed before.
+        for node in self.topological_order:
+            if node not in row:
+                cells[node] = asyncio.create_task(generate_cell(node))
+
+        for result in await asyncio.gather(*cells.values(), return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+
+        return row, errors
+
+    async def _agenerate_cell(self, node: str, row: dict) -> tuple[str, str]:
+        """Generate a cell with its own request, or in the next pack of its column if it sets packRows."""
+        if self.pack_rows[node] == 1:
+            return await self.aprocess_node(node, row, self.bill_to)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        cells = self._async_packs.setdefault(node, [])
+        cells.append((row, future, time.perf_counter()))
+        if len(cells) >= self.pack_rows[node]:
+            self._send_async_pack(node)
+        elif len(cells) == 1:
+            self._async_pack_timers[node] = loop.call_later(self.PACK_WAIT_SECONDS, self._send_async_pack, node)
+        return node, await future
+
+    def _send_async_pack(self, node: str) -> None:
+        cells = self._async_packs.pop(node)
+        if timer := self._async_pack_timers.pop(node, None):
+            timer.cancel()
+        task = asyncio.create_task(self._aresolve_pack(node, cells))
+        # The event loop only keeps weak references to tasks
+        self._pack_tasks.add(task)
+        task.add_done_callback(self._pack_tasks.discard)
+
+    async def _aresolve_pack(self, node: str, cells: list) -> None:
+        """Send a pack and resolve the future of each of its cells."""
+        try:
+            answers = await self.aprocess_pack(node, [row for row, _, _ in cells], self.bill_to, cells[0][2])
+        except Exception as e:
+            for _, future, _ in cells:
+                future.set_exception(e)
+            return
+
+        async def resolve(row: dict, future: asyncio.Future, answer: str | None) -> None:
+            try:
+                if answer is None:
+                    # Rows whose answer couldn't be parsed are generated on their own
+                    _, answer = await self.aprocess_node(node, row, self.bill_to)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(answer)
+
+        await asyncio.gather(*(resolve(row, future, answer) for (row, future, _), answer in zip(cells, answers)))
+
+    def _dedup_key(self, node: str, row: dict, count: bool = True) -> tuple[str, str] | None:
+        """Return the key grouping cells of a deduplicated column by materialized prompt."""
+        if not self.config['columns'][node].get('dedup'):
+            return None
+
+        if count:
+            self.dedup_stats[node]["cells"] += 1
+        return node, self.templates[node].render(row)
+
+    def _complete_row(self, progress, task_rows, i: int, row: dict, errors: dict[str, str] | None = None) -> None:
+        if errors:
+            # Hold rows with failed cells back for the retry pass
+            self._partial_rows[i] = (row, errors)
+            return
+
+        self._write_row(progress, task_rows, i, row)
+        self.metrics.row_completed()
+        if self.checkpointer is not None:
+            self.checkpointer.add(i, row)
+
+    def _join_source_columns(self, generated: Dataset, writer: ShardedDatasetWriter) -> None:
+        """
+        Write the generated rows in source order, with the source columns left out of generation
+        read from a second pass over the source stream. Source rows whose generation failed are skipped.
+        """
+        index_column = RowCheckpointer.INDEX_COLUMN
+        untouched = [col for col in self.source_features if col not in self.source_dataset.features]
+        source = iter(())
+        if untouched:
+            source = self._open_source_dataset(columns=untouched)
+            source = enumerate(source if self.num_rows is None else source.take(self.num_rows))
+
+        for row in generated.sort(index_column):
+            i = row[index_column] if self.num_shards > 1 else row.pop(index_column)
+            if untouched:
+                # Rows are sorted by source index, so the stream only moves forward
+                j, source_row = next(source)
+                while j < i:
+                    j, source_row = next(source)
+                row.update(source_row)
+            writer.write(row)
+
+    def _write_row(self, progress, task_rows, i: int, row: dict) -> None:
+        self.writer.write({**row, RowCheckpointer.INDEX_COLUMN: i} if self._indexed_rows else row)
+        self.completed_rows += 1
+        progress.advance(task_rows)
+        progress.update(task_rows, description=f"[bold green]✓ Completed {self.completed_rows}/{self.num_rows} rows")
+
+    def _fail_row(self, progress, task_rows, i: int, e: Exception) -> None:
+        self.metrics.row_failed()
+        progress.update(task_rows, description=f"[bold red]✗ Row {i + 1} failed")
+        rprint(f"\n[red]Error in row {i + 1}: {str(e)}")
+
+    def _dependents(self, node: str) -> list[str]:
+        """Return the generated columns depending on a column, directly or transitively, in topological order."""
+        dependents = set()
+        stack = list(self.graph[node])
+        while stack:
+            dependent = stack.pop()
+            if dependent not in dependents:
+                dependents.add(dependent)
+                stack.extend(self.graph[dependent])
+        return [column for column in self.topological_order if column in dependents]
+
+    @staticmethod
+    def _error_reason(e: Exception) -> str:
+        return f"{type(e).__name__}: {e}"
 
     @staticmethod
     def _log_error(node: str, e: Exception) -> None:
@@ -388,17 +2862,28 @@ class Pipeline:
     def _load_source_dataset(
         repo_id: str,
         subset: str | None = None,
-        split: str = "train"
+        split: str = "train",
+        columns: list[str] | None = None,
     ) -> Dataset:
 
-        """Load the source dataset from Hugging Face Hub."""
+        """Load the source dataset from Hugging Face Hub, reading only the given columns if set."""
+        from datasets import load_dataset
 
-        return load_dataset(
+        if columns is not None:
+            try:
+                # Parquet data files are read without the other columns
+                return load_dataset(repo_id, subset, split=split, streaming=True, columns=columns)
+            except (TypeError, ValueError):
+                # Other formats don't prune columns, they are dropped from every row instead
+                pass
+
+        dataset = load_dataset(
             repo_id,
             subset,
             split=split,
             streaming=True
         )
+        return dataset if columns is None else dataset.select_columns(columns)
 
     def _display_configuration_summary(self) -> None:
         summary = [
@@ -406,9 +2891,23 @@ class Pipeline:
             f"• Source columns: [cyan]{len(self.source_columns)}[/]",
             f"• Generated columns: [cyan]{len(self.config.get('columns', {}))}[/]",
             f"• Worker threads: [cyan]{self.max_workers}[/]",
+            f"• Rows in flight: [cyan]{self.max_rows_in_flight}[/]",
             f"• Rows to generate: [cyan]{self.num_rows}[/]",
         ]
 
+        if self.reused_columns:
+            summary.append(f"• Reused columns: [cyan]{', '.join(self.reused_columns)}[/]")
+
+        if self.projected_columns is not None:
+            summary.append(
+                f"• Streamed source columns: [cyan]{len(self.projected_columns)}[/]"
+                f"{' (the others are joined back)' if self.source_projection == 'join' else ''}")
+
+        if self.checkpointer is not None:
+            summary.append(f"• Checkpoints: [cyan]{self.checkpointer.directory}[/]")
+            if self._checkpointed_indices:
+                summary.append(f"• Resumed rows: [cyan]{len(self._checkpointed_indices)}[/]")
+
         if self.source_columns:
             summary.append("\n[bold blue]Source Dataset:[/]")
             for col in sorted(self.source_columns):
@@ -420,7 +2919,30 @@ class Pipeline:
             for node, config in self.config['columns'].items():
                 model_name = config['modelName']
                 provider = config['modelProvider']
-                summary.append(f"• [cyan]{node}[/]: {model_name} ({provider})")
+                limits = [
+                    f"{config[key]} {label}"
+                    for key, label in (
+                        ('requestsPerMinute', 'RPM'),
+                        ('tokensPerMinute', 'TPM'),
+                        ('maxConnections', 'connections'),
+                        ('maxTokens', 'max tokens'),
+                    )
+                    if config.get(key)
+                ]
+                if config.get('dedup'):
+                    limits.append("dedup")
+                if self.pack_rows[node] > 1:
+                    limits.append(f"{self.pack_rows[node]} rows per request")
+                if config.get('guided'):
+                    limits.append(f"guided {', '.join(config['guided'])}")
+                if node in self.request_timeouts:
+                    limits.append(f"{self.request_timeouts[node]:g}s timeout")
+                if node in self.hedge_percentiles:
+                    limits.append(f"hedged after p{self.hedge_percentiles[node]:g}")
+                if alternates := self.providers[node][1:]:
+                    limits.append(f"fails over to {', '.join(alternates)}")
+                summary.append(
+                    f"• [cyan]{node}[/]: {model_name} ({provider}{', ' + ', '.join(limits) if limits else ''})")
 
             summary.append("\n[bold blue]Node Dependencies:[/]")
             # Add dependency information for each node
@@ -449,7 +2971,27 @@ def main(
     create_pr: bool = False,
     num_rows: int | None = None,
     bill_to: str | None = None,
+    base_url: str | None = None,
     max_workers: int | None = None,
+    max_rows_in_flight: int | None = None,
+    engine: str = "threads",
+    max_concurrent_requests: int = 100,
+    cache_path: str | None = None,
+    cache_max_size_mb: float = 1024,
+    checkpoint_dir: str | None = None,
+    checkpoint_every: int = 1000,
+    resume: bool = False,
+    output_dir: str | None = None,
+    shard_size_mb: float = 500,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    metrics_port: int | None = None,
+    metrics_path: str | None = None,
+    retry_failed: bool = True,
+    failure_report: str | None = None,
+    incremental_from: str | None = None,
+    source_projection: str = "all",
+    validate_only: bool = False,
     debug: bool = False,
 ):
     """
@@ -463,10 +3005,47 @@ def main(
         destination_split: Split name for the destination dataset (default: "train").
         create_pr: Whether to create a pull request for the destination dataset (default: False).
         bill_to: Billing account for the inference client (if applicable).
+        base_url: Send every request to this OpenAI-compatible endpoint instead of the column providers.
         num_rows: Number of rows to use (if None, uses entire dataset).
         max_workers: Maximum number of concurrent workers (defaults to CPU count - 1).
+        max_rows_in_flight: Maximum number of source rows being processed at once (defaults to 2 * max_workers,
+            times the largest packRows of the columns).
+        engine: Execution engine, "threads" or "async" (default: "threads").
+        max_concurrent_requests: Connection pool size per provider with the async engine (default: 100).
+        cache_path: Path to a SQLite completion cache reused across runs (disabled if not set).
+        cache_max_size_mb: Maximum size of the completion cache before old entries are evicted (default: 1024).
+        checkpoint_dir: Directory where completed rows are periodically checkpointed (disabled if not set).
+        checkpoint_every: Number of completed rows per checkpoint shard (default: 1000).
+        resume: Resume from the checkpoints of a previous run with the same configuration (default: False).
+        output_dir: Local directory for the output Parquet shards (defaults to a temporary directory).
+        shard_size_mb: Size of each output shard, uploaded as soon as it is complete (default: 500).
+        num_shards: Split the source dataset into this many contiguous shards, one per worker (default: 1).
+        shard_index: Index of the shard processed by this worker (default: 0). Its output is written to
+            output_dir/shard-<index>-of-<num_shards> if output_dir is set, otherwise it is staged in the
+            destination repo under shards/<destination_split>/. Run merge_shards.py once every shard is done.
+        metrics_port: Serve run metrics in the Prometheus format on this port at /metrics (disabled if not set).
+        metrics_path: Write a JSON summary of the run metrics to this path at the end (disabled if not set).
+        retry_failed: Re-run failed cells and the cells they skipped once after the main pass (default: True).
+        failure_report: Write the cells that still failed, left null in the output, to this JSON file.
+        incremental_from: Repository ID of a previous output of this script, used as the source dataset
+            instead of repo_id. Its destination_split is read, columns whose fingerprint (prompt, model,
+            provider, parameters and upstream fingerprints) is unchanged are copied through, and only the
+            changed columns and their descendants are regenerated.
+        source_projection: Source columns streamed during generation: "all", "referenced" to read
+            and output only the columns the prompts reference, or "join" to read only those and
+            join the other source columns back by row index when the output is written (default: "all").
+        validate_only: Validate the configuration against the source columns and display the
+            summary, without loading the source dataset or generating anything (default: False).
         debug: Enable debug logging (default: False).
     """
+    from huggingface_hub import CommitOperationAdd
+
+    cache = CompletionCache(cache_path, max_size_mb=cache_max_size_mb) if cache_path and not validate_only else None
+
+    previous_fingerprints = None
+    if incremental_from:
+        previous_fingerprints = _load_fingerprints(incremental_from, destination_split)
+        repo_id, split = incremental_from, destination_split
 
     pipeline = Pipeline(
         repo_id=repo_id,
@@ -475,16 +3054,91 @@ def main(
         config=config,
         num_rows=num_rows,
         bill_to=bill_to,
-        request_delay=0.5,
+        base_url=base_url,
         max_workers=max_workers,
+        max_rows_in_flight=max_rows_in_flight,
+        max_concurrent_requests=max_concurrent_requests,
+        cache=cache,
+        checkpoint_dir=checkpoint_dir,
+        checkpoint_every=checkpoint_every,
+        resume=resume,
+        num_shards=num_shards,
+        shard_index=shard_index,
+        previous_fingerprints=previous_fingerprints,
+        retry_failed=retry_failed,
+        source_projection=source_projection,
+        validate_only=validate_only,
         debug=debug,
     )
+    if validate_only:
+        rprint(f"\n[bold green]✓[/] Configuration [cyan]{config}[/] is valid for {repo_id} ({split}).")
+        return
+
+    fingerprints = json.dumps({"columns": pipeline.column_fingerprints}, indent=2, sort_keys=True).encode("utf-8")
+
+    if num_shards > 1:
+        shard_name = f"shard-{shard_index:05d}-of-{num_shards:05d}"
+        writer = ShardedDatasetWriter(
+            os.path.join(output_dir, shard_name) if output_dir else tempfile.mkdtemp(prefix="extend_dataset_"),
+            pipeline.output_features,
+            split=destination_split,
+            max_shard_size_mb=shard_size_mb,
+            # Without a shared output directory, the shard is staged on the Hub for the merge step
+            repo_id=None if output_dir else destination,
+            path_in_repo=f"shards/{destination_split}/{shard_name}",
+        )
+    else:
+        writer = ShardedDatasetWriter(
+            output_dir or tempfile.mkdtemp(prefix="extend_dataset_"),
+            pipeline.output_features,
+            split=destination_split,
+            max_shard_size_mb=shard_size_mb,
+            repo_id=destination,
+            create_pr=create_pr,
+        )
 
-    augmented_dataset = pipeline.run()
-    augmented_dataset.push_to_hub(destination, split=destination_split, create_pr=create_pr)
-
-    rprint(
-        f"\n[bold green]✓[/] Successfully pushed augmented dataset to [cyan] https://huggingface.co/datasets/{destination}[/].")
+    if metrics_port is not None:
+        pipeline.metrics.serve(metrics_port)
+        rprint(f"[bold green]Serving run metrics on http://localhost:{metrics_port}/metrics[/]")
+
+    try:
+        pipeline.run(engine=engine, writer=writer)
+    finally:
+        pipeline.metrics.close()
+        if metrics_path:
+            pipeline.metrics.write_json(metrics_path)
+    if cache is not None:
+        cache.close()
+
+    if failure_report:
+        with open(failure_report, "w") as f:
+            json.dump([
+                {"row_index": i, "column": column, "error": error}
+                for i, errors in sorted(pipeline.failed_cells.items())
+                for column, error in errors.items()
+            ], f, indent=2)
+
+    if num_shards > 1 and output_dir:
+        writer.close()
+        with open(os.path.join(writer.directory, "fingerprints.json"), "wb") as f:
+            f.write(fingerprints)
+        rprint(f"\n[bold green]✓[/] Shard {shard_index} of {num_shards} written to [cyan]{writer.directory}[/].")
+    elif num_shards > 1:
+        writer.push(
+            commit_message=f"Stage {shard_name} of the {destination_split} split",
+            additions=[CommitOperationAdd(
+                path_in_repo=f"{writer.path_in_repo}/fingerprints.json", path_or_fileobj=fingerprints)],
+            update_card=False,
+        )
+        rprint(f"\n[bold green]✓[/] Shard {shard_index} of {num_shards} staged in [cyan]{destination}[/].")
+    else:
+        writer.push(
+            commit_message=f"Upload {destination_split} split generated with {os.path.basename(config)}",
+            additions=[CommitOperationAdd(
+                path_in_repo=FINGERPRINTS_PATH.format(split=destination_split), path_or_fileobj=fingerprints)],
+        )
+        rprint(
+            f"\n[bold green]✓[/] Successfully pushed augmented dataset to [cyan] https://huggingface.co/datasets/{destination}[/].")
 
 
 if __name__ == "__main__":
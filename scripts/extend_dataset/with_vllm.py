@@ -10,20 +10,637 @@
 #     "typer",
 # ]
 # ///
+from __future__ import annotations
+
+import asyncio
+import bisect
 import dataclasses
+import gc
+import hashlib
+import inspect
+import itertools
+import json
 import multiprocessing
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 from collections import defaultdict
-from typing import Tuple
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Callable, Tuple
 
 import requests
 import typer
 import yaml
-from datasets import load_dataset, Value, Features, Dataset
 from rich import print as rprint
 from rich.console import Console
 from rich.panel import Panel
-from vllm import LLM, SamplingParams
-import torch
+from rich.progress import BarColumn, MofNCompleteColumn, Progress, TextColumn, TimeElapsedColumn
+
+# vllm, torch and datasets take seconds to import, so they are only imported where they are
+# used. --help and --validate-only never need them.
+if TYPE_CHECKING:
+    from datasets import Dataset
+    from vllm import LLM, RequestOutput, SamplingParams
+
+
+# === Shared code: begin ===
+# The generation scripts run as single files (e.g. `hf jobs uv run <script URL>`), so the code they
+# share is copied into both. This section is identical in with_inference_client.py and with_vllm.py:
+# edit it in with_inference_client.py, then run `python check_shared_code.py --write`.
+
+
+class CompletionCache:
+    """
+    Persistent, content-addressed cache of model completions backed by SQLite.
+
+    Entries are keyed by a hash of the provider, model, sampling parameters and materialized
+    prompt, so reruns with an unchanged column config reuse previous completions. When the
+    cache grows over max_size_mb, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 1024) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, completion TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    @staticmethod
+    def make_key(provider: str, model: str, params: dict, prompt: str) -> str:
+        payload = json.dumps([provider, model, params, prompt], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT completion FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, completion: str) -> None:
+        size = len(key) + len(completion.encode("utf-8"))
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, completion, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, completion, size, time.time()),
+            )
+            self._size += size - (previous[0] if previous else 0)
+            self.writes += 1
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Evict down to 90% of the limit so we don't evict again on the very next write
+        target = int(self.max_size * 0.9)
+        while self._size > target:
+            oldest = self._conn.execute(
+                "SELECT key, size FROM completions ORDER BY last_access LIMIT 1000"
+            ).fetchall()
+            if not oldest:
+                break
+
+            to_delete = []
+            for key, size in oldest:
+                if self._size <= target:
+                    break
+                to_delete.append((key,))
+                self._size -= size
+
+            self._conn.executemany("DELETE FROM completions WHERE key = ?", to_delete)
+            self.evictions += len(to_delete)
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return "\n".join([
+            f"[bold blue]Completion cache[/] ({self.path})",
+            f"• Hits: [cyan]{self.hits}[/] / {lookups} lookups ({hit_rate:.1%})",
+            f"• Writes: [cyan]{self.writes}[/]",
+            f"• Evictions: [cyan]{self.evictions}[/]",
+            f"• Size: [cyan]{self._size / 1024 / 1024:.1f}[/] / {self.max_size / 1024 / 1024:.0f} MB",
+        ])
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class PromptTemplate:
+    """
+    A column prompt parsed once into literal segments and {{column}} placeholder slots.
+
+    Rendering formats all slots with a single pre-built format string, instead of scanning the
+    prompt for every key of the row. Placeholders that can't be filled are kept verbatim.
+    """
+
+    PLACEHOLDER_PATTERN = re.compile(r"\{\{([^{}]+)\}\}")
+
+    def __init__(self, template: str) -> None:
+        self.template = template
+        self.literals = self.PLACEHOLDER_PATTERN.split(template)[::2]
+        self.placeholders = self.PLACEHOLDER_PATTERN.findall(template)
+        self.columns = set(self.placeholders)
+
+        escaped = [literal.replace("{", "{{").replace("}", "}}") for literal in self.literals]
+        self._format = "".join(
+            f"{literal}{{{idx}}}" for idx, literal in enumerate(escaped[:-1])
+        ) + escaped[-1]
+
+    def render(self, row: dict) -> str:
+        return self._format.format(*[
+            str(row[name]) if name in row else f"{{{{{name}}}}}"
+            for name in self.placeholders
+        ])
+
+    def render_batch(self, batch: dict[str, list], num_rows: int) -> list[str]:
+        """Render the template for every row of a columnar batch."""
+        columns = [
+            batch[name] if name in batch else [f"{{{{{name}}}}}"] * num_rows
+            for name in self.placeholders
+        ]
+        return [
+            self._format.format(*[str(value) for value in values])
+            for values in zip(*columns)
+        ] if columns else [self.template] * num_rows
+
+
+# YAML column keys holding generation parameters, mapped to their sampling parameter names
+GENERATION_PARAMS = {
+    'maxTokens': 'max_tokens',
+    'stop': 'stop',
+    'temperature': 'temperature',
+    'topP': 'top_p',
+    'guided': 'guided',
+}
+
+
+GUIDED_OUTPUT_TYPES = ('json', 'regex', 'choice')
+
+
+def _generation_params(column: str, config: dict) -> dict:
+    """
+    Collect the generation parameters set in a column config, keyed by sampling parameter name.
+
+    `guided` constrains the output with exactly one of a JSON schema (`json`), a regular
+    expression (`regex`) or a list of allowed answers (`choice`).
+    """
+    params = {name: config[key] for key, name in GENERATION_PARAMS.items() if config.get(key) is not None}
+    if isinstance(params.get('stop'), str):
+        params['stop'] = [params['stop']]
+
+    if 'guided' in params:
+        guided = params['guided']
+        if not isinstance(guided, dict) or len(guided) != 1 or next(iter(guided)) not in GUIDED_OUTPUT_TYPES:
+            raise ValueError(f"guided of {column} must set exactly one of {GUIDED_OUTPUT_TYPES}, got {guided}")
+        if isinstance(guided.get('json'), str):
+            params['guided'] = {'json': json.loads(guided['json'])}
+
+    return params
+
+
+# Source columns carried through generation: all of them, only the ones the prompts reference, or
+# only those while the untouched ones are joined back by row index when the output is written
+SOURCE_PROJECTIONS = ("all", "referenced", "join")
+
+
+def _referenced_source_columns(source_columns: set[str], columns: dict[str, dict]) -> set[str]:
+    """Return the source columns read by the generated columns, as columnsReferences or prompt placeholders."""
+    referenced = set()
+    for config in columns.values():
+        referenced.update(config.get('columnsReferences') or [])
+        referenced.update(PromptTemplate(config['prompt']).columns)
+    return referenced & source_columns
+
+
+# Per-column fingerprints of a generated split, committed next to its data files. Paths starting
+# with a dot are ignored when the dataset is loaded.
+FINGERPRINTS_PATH = ".fingerprints/{split}.json"
+
+
+def _column_fingerprints(columns: dict[str, dict], targets: dict[str, tuple[str, str]]) -> dict[str, str]:
+    """
+    Fingerprint every generated column from its prompt, (provider, model) target, generation
+    parameters, dtype and the fingerprints of the generated columns it references.
+
+    Changing the config of a column changes the fingerprint of all its descendants, so comparing
+    fingerprints with a previous run finds every column that has to be regenerated.
+    """
+    fingerprints = {}
+
+    def fingerprint(column: str, visiting: frozenset = frozenset()) -> str:
+        if column in visiting:
+            raise ValueError(f"Circular dependencies detected between columns: {sorted(visiting)}")
+        if column not in fingerprints:
+            config = columns[column]
+            payload = {
+                "prompt": config['prompt'],
+                "target": list(targets[column]),
+                "params": _generation_params(column, config),
+                "dtype": config.get('dtype'),
+                # Source columns only contribute their name
+                "references": {
+                    ref: fingerprint(ref, visiting | {column}) if ref in columns else None
+                    for ref in sorted(config.get('columnsReferences') or [])
+                },
+            }
+            payload = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+            fingerprints[column] = hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+        return fingerprints[column]
+
+    for column in columns:
+        fingerprint(column)
+    return fingerprints
+
+
+def _stale_columns(
+    fingerprints: dict[str, str],
+    previous_fingerprints: dict[str, str],
+    available_columns: set[str],
+) -> tuple[set[str], set[str]]:
+    """
+    Compare column fingerprints with the ones recorded in a previous output.
+
+    Returns:
+        The configured columns to regenerate, because they changed or are missing from the
+        previous output, and the columns of the previous output to drop before regenerating,
+        which also covers generated columns removed from the config since.
+    """
+    stale = {
+        column for column, fingerprint in fingerprints.items()
+        if column not in available_columns or previous_fingerprints.get(column) != fingerprint
+    }
+    dropped = (stale | (previous_fingerprints.keys() - fingerprints.keys())) & available_columns
+    return stale, dropped
+
+
+def _load_fingerprints(repo_id: str, split: str) -> dict[str, str]:
+    """Load the column fingerprints recorded with a generated split, or none if it has no record."""
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.errors import EntryNotFoundError
+
+    try:
+        path = hf_hub_download(repo_id, FINGERPRINTS_PATH.format(split=split), repo_type="dataset")
+    except EntryNotFoundError:
+        rprint(f"[yellow]Warning: {repo_id} has no column fingerprints for {split}, every column is regenerated.")
+        return {}
+
+    with open(path) as f:
+        return json.load(f)["columns"]
+
+
+def _hub_split_metadata(repo_id: str, split: str, subset: str | None = None) -> tuple[list[str] | None, int | None]:
+    """
+    Read the column names and row count of a Hub dataset split without loading the dataset.
+
+    The split info of the dataset card is used when it has both, otherwise the footers of the
+    split's Parquet files: the ones pushed by the datasets library (or these scripts), then the
+    Hub's Parquet conversion. Values that can't be determined are None, including when the Hub
+    can't be reached or repo_id isn't a Hub dataset, e.g. a local directory.
+    """
+    try:
+        return _read_hub_split_metadata(repo_id, split, subset)
+    except _hub_unavailable_errors():
+        return None, None
+
+
+def _hub_unavailable_errors() -> tuple[type[Exception], ...]:
+    """Return the errors of Hub requests that can't be answered, as opposed to bugs."""
+    import importlib
+
+    from huggingface_hub.errors import HfHubHTTPError, HFValidationError
+
+    errors = [HfHubHTTPError, HFValidationError, OSError]
+    # Connection errors of the HTTP client of huggingface_hub aren't OSErrors
+    for module in ("httpx", "httpx2"):
+        try:
+            errors.append(importlib.import_module(module).TransportError)
+        except ImportError:
+            pass
+    return tuple(errors)
+
+
+def _read_hub_split_metadata(repo_id: str, split: str, subset: str | None) -> tuple[list[str] | None, int | None]:
+    from huggingface_hub import HfApi
+    from huggingface_hub.errors import RevisionNotFoundError
+
+    api = HfApi()
+    config_name = subset or "default"
+    columns = None
+
+    card_data = api.dataset_info(repo_id).card_data
+    infos = card_data.get("dataset_info") if card_data else None
+    for info in (infos if isinstance(infos, list) else [infos] if infos else []):
+        if info.get("config_name", "default") != config_name:
+            continue
+        columns = [feature["name"] for feature in info.get("features", []) if "name" in feature] or None
+        num_rows = next((s.get("num_examples") for s in info.get("splits", []) if s.get("name") == split), None)
+        if columns and num_rows is not None:
+            return columns, num_rows
+
+    for revision, prefix in ((None, f"{subset or 'data'}/{split}-"), ("refs/convert/parquet", f"{config_name}/{split}/")):
+        try:
+            files = [
+                path for path in api.list_repo_files(repo_id, repo_type="dataset", revision=revision)
+                if path.startswith(prefix) and path.endswith(".parquet")
+            ]
+        except RevisionNotFoundError:
+            continue
+        if files:
+            return _parquet_metadata(repo_id, files, revision=revision)
+
+    return columns, None
+
+
+def _parquet_metadata(repo_id: str, files: list[str], revision: str | None = None) -> tuple[list[str], int]:
+    """Sum the row counts in the footers of Parquet files of a dataset repo, reading only the footers."""
+    import pyarrow.parquet as pq
+    from huggingface_hub import HfFileSystem
+
+    fs = HfFileSystem()
+    num_rows = 0
+    for path in files:
+        with fs.open(f"datasets/{repo_id}/{path}", revision=revision) as f:
+            metadata = pq.read_metadata(f)
+        num_rows += metadata.num_rows
+    return metadata.schema.to_arrow_schema().names, num_rows
+
+
+class LatencyHistogram:
+    """Histogram of durations in seconds, with fixed bucket bounds like a Prometheus histogram."""
+
+    BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self) -> None:
+        # The last bucket counts durations over the largest bound
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket, like Prometheus' histogram_quantile."""
+        rank = q * self.count
+        cumulative = 0
+        for idx, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if idx == len(self.BUCKETS):
+                    return self.BUCKETS[-1]
+                lower = self.BUCKETS[idx - 1] if idx else 0.0
+                return lower + (self.BUCKETS[idx] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            **{f"p{int(q * 100)}": self.quantile(q) for q in (0.5, 0.95, 0.99)},
+        }
+
+
+class RunMetrics:
+    """
+    Per-column request metrics of a run, shared by every worker.
+
+    Latency covers a single model request. Queue wait is the time a ready cell spent before its
+    request was sent (worker pool, connection slots and rate limiter delays), and source wait
+    the time spent blocked on the source stream, so a slow run can be attributed to the
+    provider, the scheduler or the source. Metrics can be served in the Prometheus text format
+    during the run, and written as a JSON summary at the end.
+    """
+
+    COUNTERS = (
+        "requests",
+        "cache_hits",
+        "rate_limited",
+        "retries",
+        "failures",
+        "prompt_tokens",
+        "completion_tokens",
+        "rate_limit_wait",
+    )
+
+    def __init__(self) -> None:
+        self.started_at = time.time()
+        self.rows_completed = 0
+        self.rows_failed = 0
+        self.source_wait = 0.0
+        self.columns = defaultdict(lambda: {
+            **dict.fromkeys(self.COUNTERS, 0),
+            "latency": LatencyHistogram(),
+            "queue_wait": LatencyHistogram(),
+        })
+
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._server = None
+
+    def increment(self, column: str, counter: str, value: float = 1) -> None:
+        with self._lock:
+            self.columns[column][counter] += value
+
+    def observe_request(self, column: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        with self._lock:
+            metrics = self.columns[column]
+            metrics["requests"] += 1
+            metrics["prompt_tokens"] += prompt_tokens
+            metrics["completion_tokens"] += completion_tokens
+            metrics["latency"].observe(latency)
+
+    def observe_queue_wait(self, column: str, seconds: float) -> None:
+        with self._lock:
+            self.columns[column]["queue_wait"].observe(seconds)
+
+    def latency_quantile(self, column: str, q: float, min_count: int = 1) -> float | None:
+        """Return a quantile of the request latency of a column, or None before min_count requests."""
+        with self._lock:
+            if column not in self.columns or self.columns[column]["latency"].count < min_count:
+                return None
+            return self.columns[column]["latency"].quantile(q)
+
+    def add_source_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.source_wait += seconds
+
+    def row_completed(self, count: int = 1) -> None:
+        with self._lock:
+            self.rows_completed += count
+
+    def row_failed(self, count: int = 1) -> None:
+        with self._lock:
+            self.rows_failed += count
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed = self.elapsed
+            columns = {
+                column: {
+                    **{counter: metrics[counter] for counter in self.COUNTERS},
+                    "completion_tokens_per_s": metrics["completion_tokens"] / elapsed if elapsed else 0.0,
+                    "latency_s": metrics["latency"].to_dict(),
+                    "queue_wait_s": metrics["queue_wait"].to_dict(),
+                }
+                for column, metrics in self.columns.items()
+            }
+            totals = {
+                counter: sum(metrics[counter] for metrics in columns.values()) for counter in self.COUNTERS
+            }
+            return {
+                "started_at": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+                "elapsed_s": elapsed,
+                "rows_completed": self.rows_completed,
+                "rows_failed": self.rows_failed,
+                "rows_per_s": self.rows_completed / elapsed if elapsed else 0.0,
+                "source_wait_s": self.source_wait,
+                "totals": {
+                    **totals,
+                    "completion_tokens_per_s": totals["completion_tokens"] / elapsed if elapsed else 0.0,
+                },
+                "columns": columns,
+            }
+
+    def write_json(self, path: str) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def add(name: str, kind: str, help_text: str, samples: list[tuple[str, float]]) -> None:
+            lines.extend([f"# HELP extend_dataset_{name} {help_text}", f"# TYPE extend_dataset_{name} {kind}"])
+            lines.extend(f"extend_dataset_{sample} {value}" for sample, value in samples)
+
+        with self._lock:
+            columns = sorted(self.columns.items())
+            for counter, help_text in (
+                ("requests", "Model requests that returned a completion."),
+                ("cache_hits", "Cells served from the completion cache."),
+                ("rate_limited", "Requests rejected with a 429."),
+                ("retries", "Requests retried after a 429."),
+                ("failures", "Cells that failed."),
+                ("prompt_tokens", "Prompt tokens of the model requests."),
+                ("completion_tokens", "Completion tokens of the model requests."),
+                ("rate_limit_wait", "Seconds requests were delayed by the rate limiter."),
+            ):
+                name = f"{counter}_seconds_total" if counter == "rate_limit_wait" else f"{counter}_total"
+                add(name, "counter", help_text, [
+                    (f'{name}{{column="{column}"}}', metrics[counter]) for column, metrics in columns
+                ])
+
+            for histogram, help_text in (
+                ("latency", "Latency of a model request."),
+                ("queue_wait", "Time a ready cell waited before its request was sent."),
+            ):
+                name = f"request_{histogram}_seconds" if histogram == "latency" else f"{histogram}_seconds"
+                samples = []
+                for column, metrics in columns:
+                    cumulative = 0
+                    for bound, count in zip((*LatencyHistogram.BUCKETS, "+Inf"), metrics[histogram].counts):
+                        cumulative += count
+                        samples.append((f'{name}_bucket{{column="{column}",le="{bound}"}}', cumulative))
+                    samples.append((f'{name}_sum{{column="{column}"}}', metrics[histogram].sum))
+                    samples.append((f'{name}_count{{column="{column}"}}', metrics[histogram].count))
+                add(name, "histogram", help_text, samples)
+
+            add("rows_completed_total", "counter", "Rows generated.", [("rows_completed_total", self.rows_completed)])
+            add("rows_failed_total", "counter", "Rows with failed cells.", [("rows_failed_total", self.rows_failed)])
+            add("source_wait_seconds_total", "counter", "Seconds spent waiting on the source stream.",
+                [("source_wait_seconds_total", self.source_wait)])
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0") -> None:
+        """Serve the metrics on http://host:port/metrics from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                data = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def summary(self) -> str:
+        summary = self.to_dict()
+        lines = [
+            "[bold blue]Run metrics[/]",
+            f"• Rows: [cyan]{summary['rows_completed']}[/] completed, {summary['rows_failed']} failed "
+            f"({summary['rows_per_s']:.2f} rows/s)",
+            f"• Source wait: [cyan]{summary['source_wait_s']:.1f}s[/]",
+        ]
+        for column, metrics in summary["columns"].items():
+            latency, queue_wait = metrics["latency_s"], metrics["queue_wait_s"]
+            lines.append(
+                f"• [cyan]{column}[/]: {metrics['requests']} requests "
+                f"(p50 {latency['p50']:.2f}s, p95 {latency['p95']:.2f}s, p99 {latency['p99']:.2f}s), "
+                f"queue wait p95 {queue_wait['p95']:.2f}s, "
+                f"{metrics['prompt_tokens']} → {metrics['completion_tokens']} tokens "
+                f"({metrics['completion_tokens_per_s']:.1f} tokens/s), {metrics['cache_hits']} cache hits, "
+                f"{metrics['rate_limited']} rate limited, {metrics['retries']} retries, {metrics['failures']} failures"
+            )
+        return "\n".join(lines)
+
+
+# === Shared code: end ===
+
+
+DEFAULT_VLLM_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
+# Index of each output row within its source shard, used to merge shards back in source order
+SOURCE_INDEX_COLUMN = "__source_row_index__"
 
 
 @dataclasses.dataclass
@@ -35,68 +652,106 @@ class ProcessorConfig:
         source_columns (set[str]): Set of source column names.
         columns (dict[str, dict]): Mapping of generated column names to their configurations.
         reverse_graph (dict[str, list[str]]): Reverse dependency graph mapping each node to its dependencies.
+        templates (dict[str, PromptTemplate]): Compiled prompt template of each generated column.
+        generation_params (dict[str, dict]): Generation parameters set by each generated column.
         max_workers (int): Maximum number of worker threads to use.
         num_rows (int): Number of rows to generate.
+        vllm_model (str): Model generating every column, overriding their modelName (optional).
+        fingerprints (dict[str, str]): Fingerprint of every configured column, including reused ones.
+        reused_columns (list[str]): Columns copied through from a previous output instead of generated.
     """
     source_columns: set[str]
     columns: dict[str, dict]
     graph: dict[str, list[str]]
     reverse_graph: dict[str, list[str]]
+    templates: dict[str, PromptTemplate] = dataclasses.field(default_factory=dict)
+    generation_params: dict[str, dict] = dataclasses.field(default_factory=dict)
     max_workers: int | None = None
     batch_size: int | None = None
     num_rows: int | None = None
     vllm_model: str | None = None
+    fingerprints: dict[str, str] = dataclasses.field(default_factory=dict)
+    reused_columns: list[str] = dataclasses.field(default_factory=list)
 
     @property
-    def sorted_columns(self) -> list[str]:
-        """Return a sorted list of generated column names."""
-        columns = []
-
-        idx = 0
-        while len(columns) < len(self.columns):
-            column, parents = list(self.reverse_graph.items())[idx]
-            if all(p in self.source_columns for p in parents) and column not in columns:
-                columns.append(column)
-                idx = 0
-            elif all(p in self.source_columns or p in columns for p in parents) and column not in columns:
-                columns.append(column)
-                idx = 0
-            else:
-                idx += 1
+    def column_levels(self) -> list[list[str]]:
+        """Return generated columns grouped into dependency levels, in generation order."""
+        return _topological_levels(self.columns, self.reverse_graph)
 
-        return columns
+    @property
+    def model_schedule(self) -> list[tuple[str, list[str]]]:
+        """Return the (model, columns) generation passes, grouped to load each model as few times as possible."""
+        return _model_schedule(self.columns, self.reverse_graph, self.column_model)
+
+    def column_model(self, column: str) -> str:
+        """Return the model generating a column."""
+        return self.vllm_model or self.columns[column].get('modelName') or DEFAULT_VLLM_MODEL
+
+    @property
+    def sorted_columns(self) -> list[str]:
+        """Return generated column names in topological order."""
+        return [column for level in self.column_levels for column in level]
 
 
 def load_processor_config(
     *,
     config_path: str,
-    dataset: Dataset,
+    dataset: Dataset | None = None,
+    source_columns: list[str] | None = None,
     max_workers: int | None = None,
     num_rows: int | None = None,
     batch_size: int | None = 1000,
     vllm_model: str | None = None,
+    previous_fingerprints: dict[str, str] | None = None,
 ) -> ProcessorConfig:
+    """
+    Load and validate a column config against the source dataset.
+
+    :param source_columns: Columns of the source dataset, read from its metadata, instead of the
+        dataset itself.
+    :param previous_fingerprints: Column fingerprints recorded with the dataset, when it is the
+        output of a previous run. Columns with an unchanged fingerprint become source columns and
+        only the others are generated. The caller drops the columns missing from source_columns.
+    """
     with Console().status("[bold green]Loading configuration..."):
         config = _load_config(config_path)
-        source_columns = set(dataset.features.keys())
+        source_columns = set(dataset.features.keys() if dataset is not None else source_columns)
 
-        # Validate no overlap between source and generated columns
+        # Fingerprint the full config, before it is narrowed down to the columns to regenerate
         columns = config.get('columns', {})
+        fingerprints = _column_fingerprints(columns, {
+            col: ("vllm", vllm_model or col_config.get('modelName') or DEFAULT_VLLM_MODEL)
+            for col, col_config in columns.items()
+        })
+        reused_columns = []
+        if previous_fingerprints is not None:
+            stale, dropped = _stale_columns(fingerprints, previous_fingerprints, source_columns)
+            reused_columns = sorted(set(columns) - stale)
+            source_columns -= dropped
+            columns = {col: col_config for col, col_config in columns.items() if col in stale}
+
+        # Validate no overlap between source and generated columns
         columns_to_generate = set(columns.keys())
         if overlap := (source_columns & columns_to_generate):
             raise ValueError(f"Columns defined in both source dataset and generation config: {overlap}")
 
         graph, reverse_graph = _build_dependency_graph(source_columns, columns)
+        templates = _compile_prompts(source_columns, columns)
+        generation_params = {col: _generation_params(col, col_config) for col, col_config in columns.items()}
 
         processor_config = ProcessorConfig(
             source_columns=source_columns,
             columns=columns,
             reverse_graph=reverse_graph,
             graph=graph,
+            templates=templates,
+            generation_params=generation_params,
             max_workers=max_workers,
             num_rows=num_rows,
             batch_size=batch_size,
             vllm_model=vllm_model,
+            fingerprints=fingerprints,
+            reused_columns=reused_columns,
         )
 
         _display_configuration_summary(processor_config)
@@ -113,9 +768,11 @@ def _display_configuration_summary(
         f"• Generated columns: [cyan]{len(config.columns)}[/]",
         f"• Worker threads: [cyan]{config.max_workers}[/]",
         f"• Rows to generate: [cyan]{config.num_rows}[/]",
-        f"• VLLM model: [cyan]{config.vllm_model}[/]",
+        f"• VLLM model: [cyan]{config.vllm_model or 'per column'}[/]",
         f"• Batch size: [cyan]{config.batch_size}[/]",
     ]
+    if config.reused_columns:
+        summary.append(f"• Reused columns: [cyan]{', '.join(config.reused_columns)}[/]")
 
     if config.source_columns:
         summary.append("\n[bold blue]Source Dataset:[/]")
@@ -123,6 +780,10 @@ def _display_configuration_summary(
             summary.append(f"• [cyan]{col}[/]")
 
     if config.columns:
+        summary.append("\n[bold blue]Generation passes:[/]")
+        for idx, (model, level) in enumerate(config.model_schedule, start=1):
+            summary.append(f"• [cyan]{idx}[/] ({model}): {', '.join(level)}")
+
         summary.append("\n[bold blue]Node Dependencies:[/]")
         # Add dependency information for each node
         for node in config.columns:
@@ -176,9 +837,137 @@ def _build_dependency_graph(
     if not root_nodes and columns:
         raise ValueError("No root nodes found! Circular dependencies may exist.")
 
+    # Raises if the generated columns contain a cycle
+    _topological_levels(columns, reverse_graph)
+
     return graph, reverse_graph
 
 
+def _topological_levels(
+    columns: dict[str, dict],
+    reverse_graph: dict[str, list[str]]
+) -> list[list[str]]:
+    """
+    Sort generated columns with Kahn's algorithm, grouping them into dependency levels.
+
+    Columns in the same level only depend on source columns or on columns of previous levels,
+    so they can be generated together.
+    """
+    in_degree = {
+        col: sum(1 for dep in reverse_graph.get(col, []) if dep in columns)
+        for col in columns
+    }
+    dependents = defaultdict(list)
+    for col in columns:
+        for dep in reverse_graph.get(col, []):
+            if dep in columns:
+                dependents[dep].append(col)
+
+    levels = []
+    level = [col for col, degree in in_degree.items() if degree == 0]
+    while level:
+        levels.append(level)
+        next_level = []
+        for col in level:
+            for dependent in dependents[col]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    next_level.append(dependent)
+        level = next_level
+
+    if sum(len(level) for level in levels) < len(columns):
+        cyclic = sorted(col for col, degree in in_degree.items() if degree > 0)
+        raise ValueError(f"Circular dependencies detected between columns: {cyclic}")
+
+    return levels
+
+
+# Sampling parameters of columns that don't set their own
+DEFAULT_SAMPLING_PARAMS = {'temperature': 0.7, 'top_p': 0.9, 'max_tokens': 2048}
+
+
+def _sampling_params(params: dict) -> SamplingParams | dict:
+    """
+    Build the vLLM sampling parameters of a column from its generation parameters. Without vLLM,
+    e.g. to run a simulated engine on CPU, the parameters are returned as a plain dict.
+    """
+    params = {**DEFAULT_SAMPLING_PARAMS, **params}
+    try:
+        from vllm import SamplingParams
+    except ImportError:
+        return params
+
+    if guided := params.pop('guided', None):
+        from vllm.sampling_params import StructuredOutputsParams
+
+        params['structured_outputs'] = StructuredOutputsParams(**guided)
+    return SamplingParams(**params)
+
+
+def _model_schedule(
+    columns: dict[str, dict],
+    reverse_graph: dict[str, list[str]],
+    column_model: Callable[[str], str],
+) -> list[tuple[str, list[str]]]:
+    """
+    Order generation passes so that every model is loaded as few times as possible.
+
+    Once a model is loaded, it generates every column it can, one pass per dependency level,
+    before the next model is loaded. The next model is the one able to generate the most
+    columns at that point.
+
+    :return: The (model, columns) generation passes in execution order.
+    """
+    done = set()
+
+    def model_passes(model: str) -> list[list[str]]:
+        generated = set(done)
+        passes = []
+        while level := [
+            col for col in columns
+            if col not in generated and column_model(col) == model
+            and all(dep in generated for dep in reverse_graph.get(col, []) if dep in columns)
+        ]:
+            passes.append(level)
+            generated.update(level)
+        return passes
+
+    models = list(dict.fromkeys(column_model(col) for col in columns))
+    schedule = []
+    while len(done) < len(columns):
+        candidates = {model: model_passes(model) for model in models}
+        model = max(models, key=lambda m: sum(len(level) for level in candidates[m]))
+        if not candidates[model]:
+            raise ValueError(f"Circular dependencies detected between columns: {sorted(set(columns) - done)}")
+
+        for level in candidates[model]:
+            schedule.append((model, level))
+            done.update(level)
+
+    return schedule
+
+
+def _compile_prompts(
+    source_columns: set[str],
+    columns: dict[str, dict]
+) -> dict[str, PromptTemplate]:
+    """Parse every column prompt once and check its placeholders against the column references."""
+    templates = {}
+    for col, config in columns.items():
+        template = PromptTemplate(config['prompt'])
+        references = set(config.get('columnsReferences') or [])
+
+        # Generated columns must be referenced so they are generated before this one
+        if unreferenced := {name for name in template.columns - references if name in columns}:
+            raise ValueError(f"Prompt of {col} uses columns missing from its columnsReferences: {unreferenced}")
+        if unknown := template.columns - references - source_columns - set(columns):
+            rprint(f"[yellow]Warning: Prompt of {col} uses unknown columns {unknown}, they will be left as-is.")
+
+        templates[col] = template
+
+    return templates
+
+
 def _load_config(path: str) -> dict:
     """
     Load a configuration file from a local path or a URL.
@@ -199,64 +988,569 @@ def _load_config(path: str) -> dict:
         return yaml.safe_load(f)
 
 
-def process_column(
+def _record_prefix_cache_usage(stats: dict[str, dict] | None, column: str, output) -> None:
+    """Add the prompt tokens of a request output, and those served from the prefix cache, to a column."""
+    if stats is None or not getattr(output, "prompt_token_ids", None):
+        return
+    stats[column]["prompt_tokens"] += len(output.prompt_token_ids)
+    stats[column]["cached_tokens"] += getattr(output, "num_cached_tokens", None) or 0
+
+
+def _record_request_metrics(metrics: RunMetrics | None, column: str, output, latency: float) -> None:
+    """Record the latency and token counts of a request output under its column."""
+    if metrics is None:
+        return
+    metrics.observe_request(
+        column,
+        latency,
+        prompt_tokens=len(getattr(output, "prompt_token_ids", None) or []),
+        completion_tokens=len(getattr(output.outputs[0], "token_ids", None) or []),
+    )
+
+
+def _prefix_cache_summary(stats: dict[str, dict]) -> str:
+    summary = ["[bold green]Prefix cache[/]"]
+    for column, column_stats in stats.items():
+        if column_stats["prompt_tokens"]:
+            hit_rate = column_stats["cached_tokens"] / column_stats["prompt_tokens"]
+            summary.append(
+                f"• [cyan]{column}[/]: {hit_rate:.1%} of {column_stats['prompt_tokens']} prompt tokens cached "
+                f"({column_stats['cached_tokens']} prefill tokens saved)")
+    return "\n".join(summary)
+
+
+class VLLMStreamingEngine:
+    """
+    Continuous-batching engine on top of vLLM's async engine.
+
+    Every request joins the running batch as soon as it is submitted and resolves as soon as
+    its own sequence finishes, instead of waiting for the slowest prompt of a batch.
+    """
+
+    def __init__(self, model: str, **engine_kwargs) -> None:
+        from vllm import AsyncEngineArgs, AsyncLLMEngine
+
+        self.engine = AsyncLLMEngine.from_engine_args(AsyncEngineArgs(model=model, **engine_kwargs))
+        self._tokenizer = None
+        self._request_ids = itertools.count()
+
+    async def generate(self, messages: list[dict], sampling_params: SamplingParams) -> RequestOutput:
+        """Generate a chat completion and return its final request output."""
+        if self._tokenizer is None:
+            tokenizer = self.engine.get_tokenizer()
+            # Older engines expose the tokenizer through a coroutine
+            self._tokenizer = await tokenizer if inspect.isawaitable(tokenizer) else tokenizer
+
+        prompt = self._tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        final_output = None
+        async for output in self.engine.generate(prompt, sampling_params, str(next(self._request_ids))):
+            final_output = output
+
+        return final_output
+
+    def shutdown(self) -> None:
+        self.engine.shutdown()
+
+
+class SimulatedStreamingEngine:
+    """
+    CPU stand-in for VLLMStreamingEngine, to exercise the streaming scheduler without a GPU.
+
+    Each request echoes its prompt after `latency` seconds, which is either a constant or a
+    function of the request messages. Outputs have the attributes of vLLM's RequestOutput that
+    the generation reads, with one token per prompt character and no prefix cache hits.
+    """
+
+    def __init__(self, latency: float | Callable[[list[dict]], float] = 0.0) -> None:
+        self.latency = latency
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def generate(self, messages: list[dict], sampling_params: SamplingParams) -> SimpleNamespace:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency(messages) if callable(self.latency) else self.latency)
+        finally:
+            self.in_flight -= 1
+
+        prompt = messages[-1]['content']
+        return SimpleNamespace(
+            prompt_token_ids=[ord(char) for char in prompt],
+            outputs=[SimpleNamespace(text=f"Generated from: {prompt}", token_ids=[])],
+            num_cached_tokens=0,
+        )
+
+    def shutdown(self) -> None:
+        pass
+
+
+async def stream_columns(
     *,
     dataset: Dataset,
-    llm: LLM,
+    engine: VLLMStreamingEngine | SimulatedStreamingEngine,
     processor_config: ProcessorConfig,
-    column_name: str
+    cache: CompletionCache | None = None,
+    max_rows_in_flight: int = 1024,
+    prefix_cache_stats: dict[str, dict] | None = None,
+    metrics: RunMetrics | None = None,
 ) -> Dataset:
-    column_config = processor_config.columns[column_name]
+    """
+    Generate every column with continuous batching.
 
-    def prepare_prompt(prompt: str, row: dict) -> str:
-        """Prepare prompt template by filling in values from row."""
-        for key, value in row.items():
-            placeholder = f"{{{{{key}}}}}"
-            if placeholder in prompt:
-                prompt = prompt.replace(placeholder, str(value))
+    Cells are submitted to the engine as soon as their row is admitted and the columns they
+    reference are generated, so a downstream column starts for a row while other rows are
+    still waiting on upstream columns. At most max_rows_in_flight rows are held at once.
+    Request latencies and token counts are recorded in metrics when provided.
+    """
+    from datasets import Value
 
-        return prompt
+    columns = processor_config.sorted_columns
+    generated = {column: [None] * dataset.num_rows for column in columns}
+    dependencies = {
+        column: [dep for dep in processor_config.reverse_graph.get(column, []) if dep in columns]
+        for column in columns
+    }
 
-    def map_function(batch: dict):
-        prompt_template = column_config["prompt"]
+    sampling_params = {column: _sampling_params(processor_config.generation_params[column]) for column in columns}
+    cache_params = {
+        column: {**DEFAULT_SAMPLING_PARAMS, **processor_config.generation_params[column]} for column in columns
+    }
+
+    # With dedup enabled, every distinct prompt of a column is sent to the model only once
+    shared: dict[tuple[str, str], asyncio.Task] = {}
+    dedup_stats = {column: {"cells": 0, "requests": 0} for column in columns}
+
+    async def complete(column: str, prompt: str) -> str:
+        model = processor_config.column_model(column)
+        cache_key = cache.make_key("vllm", model, cache_params[column], prompt) if cache else None
+        if cache is not None and (result := cache.get(cache_key)) is not None:
+            if metrics is not None:
+                metrics.increment(column, "cache_hits")
+            return result
+
+        start = time.perf_counter()
+        try:
+            output = await engine.generate([{"role": "user", "content": prompt}], sampling_params[column])
+        except Exception:
+            if metrics is not None:
+                metrics.increment(column, "failures")
+            raise
+        _record_request_metrics(metrics, column, output, time.perf_counter() - start)
+        _record_prefix_cache_usage(prefix_cache_stats, column, output)
+        result = output.outputs[0].text.strip()
+        if cache is not None:
+            cache.put(cache_key, result)
+        return result
+
+    async def generate_cell(row: dict, column: str, upstream: list[asyncio.Task]) -> None:
+        await asyncio.gather(*upstream)
+        prompt = processor_config.templates[column].render(row)
+
+        if not processor_config.columns[column].get("dedup"):
+            row[column] = await complete(column, prompt)
+            return
 
-        sampling_params = SamplingParams(
-            temperature=0.7,
-            top_p=0.9,
-            max_tokens=2048,  # Adjust max tokens as needed
+        dedup_stats[column]["cells"] += 1
+        key = (column, prompt)
+        if key not in shared:
+            dedup_stats[column]["requests"] += 1
+            shared[key] = asyncio.create_task(complete(column, prompt))
+        row[column] = await shared[key]
+
+    async def generate_row(idx: int, row: dict) -> None:
+        tasks = {}
+        for column in columns:
+            tasks[column] = asyncio.create_task(
+                generate_cell(row, column, [tasks[dep] for dep in dependencies[column]])
+            )
+        await asyncio.gather(*tasks.values())
+
+        for column in columns:
+            generated[column][idx] = row[column]
+        if metrics is not None:
+            metrics.row_completed()
+
+    rows = iter(enumerate(dataset))
+    pending = set()
+    with Progress(
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        MofNCompleteColumn(),
+        TimeElapsedColumn(),
+    ) as progress:
+        task_rows = progress.add_task("Generating rows", total=dataset.num_rows)
+
+        while True:
+            while len(pending) < max_rows_in_flight and (item := next(rows, None)) is not None:
+                pending.add(asyncio.create_task(generate_row(*item)))
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # Propagate the first failure, as a failed llm.chat call does in batched mode
+                task.result()
+            progress.update(task_rows, advance=len(done))
+
+    for column, stats in dedup_stats.items():
+        if stats["cells"]:
+            ratio = 1 - stats["requests"] / stats["cells"]
+            rprint(
+                f"[bold blue]Deduplicated {column}:[/] {stats['requests']} requests for "
+                f"{stats['cells']} cells ({ratio:.1%} deduplicated)")
+
+    for column in columns:
+        dataset = dataset.add_column(
+            column,
+            generated[column],
+            feature=Value(processor_config.columns[column].get("dtype", "string")),
         )
 
+    return dataset
+
+
+def _length_sorted_indices(
+    *,
+    dataset: Dataset,
+    llm: LLM,
+    processor_config: ProcessorConfig,
+    column_names: list[str],
+) -> list[int]:
+    """
+    Order rows by the token length of their longest materialized prompt in a generation pass.
+
+    Batching rows of similar prompt length keeps the KV cache densely packed and keeps short
+    prompts from waiting on the long stragglers of their batch.
+    """
+    tokenizer = llm.get_tokenizer()
+    templates = [processor_config.templates[column] for column in column_names]
+    referenced = set().union(*(template.columns for template in templates)) & set(dataset.column_names)
+
+    if not referenced:
+        # Every row renders the same prompts
+        return list(range(dataset.num_rows))
+
+    lengths = []
+    for batch in dataset.select_columns(sorted(referenced)).iter(batch_size=processor_config.batch_size or 1000):
+        num_rows = len(next(iter(batch.values())))
+        prompt_lengths = [
+            [len(ids) for ids in tokenizer(template.render_batch(batch, num_rows), add_special_tokens=False)["input_ids"]]
+            for template in templates
+        ]
+        lengths.extend(max(row_lengths) for row_lengths in zip(*prompt_lengths))
+
+    return sorted(range(len(lengths)), key=lengths.__getitem__)
+
+
+def process_columns(
+    *,
+    dataset: Dataset,
+    llm: LLM,
+    processor_config: ProcessorConfig,
+    column_names: list[str],
+    cache: CompletionCache | None = None,
+    length_bucketing: bool = False,
+    prefix_caching: bool = False,
+    prefix_cache_stats: dict[str, dict] | None = None,
+    metrics: RunMetrics | None = None,
+) -> Dataset:
+    """
+    Generate independent columns in a single pass over the dataset.
+
+    The prompts of every column are submitted to the model together in one llm.chat call per
+    batch, so vLLM fills its batch with the union of the columns instead of one at a time.
+    With length_bucketing, rows are batched in order of prompt length and restored to their
+    source order afterwards. With prefix_caching, the prompts of a batch are submitted sorted,
+    so prompts sharing a template prefix run back to back and reuse its cached KV blocks.
+    Prompt and prefix-cache token counts are added to prefix_cache_stats when provided, and
+    every prompt of an llm.chat call is recorded in metrics with the latency of the whole call.
+    """
+    from datasets import Features, Value
+
+    # With dedup enabled, every distinct prompt of a column is sent to the model only once
+    deduplicated: dict[str, dict[str, str]] = {column: {} for column in column_names}
+    dedup_stats = {column: {"cells": 0, "requests": 0} for column in column_names}
+
+    # Each column samples with its own parameters, falling back to the defaults
+    sampling_params = {
+        column: _sampling_params(processor_config.generation_params[column]) for column in column_names
+    }
+    cache_params = {
+        column: {**DEFAULT_SAMPLING_PARAMS, **processor_config.generation_params[column]} for column in column_names
+    }
+
+    def map_function(batch: dict):
+        num_rows = len(next(iter(batch.values())))
+        pending = {}  # column -> (prompts, requests, results, cache keys, missing request indices)
         batch_messages = []
-        rows = [dict(zip(batch.keys(), values)) for values in zip(*batch.values())]
-        for row in rows:
-            prompt = prepare_prompt(prompt_template, row)
-            messages = [{"role": "user", "content": prompt}]
-            batch_messages.append(messages)
+        batch_sampling_params = []
 
-        # Process the batch of messages
-        outputs = llm.chat(batch_messages, sampling_params=sampling_params)
+        for column in column_names:
+            prompts = processor_config.templates[column].render_batch(batch, num_rows)
 
-        results = []
-        for output in outputs:
-            # Get the result for each row
-            result = output.outputs[0].text.strip()
-            results.append(result)
+            if processor_config.columns[column].get("dedup"):
+                requests = list(dict.fromkeys(prompt for prompt in prompts if prompt not in deduplicated[column]))
+                dedup_stats[column]["cells"] += len(prompts)
+                dedup_stats[column]["requests"] += len(requests)
+            else:
+                requests = prompts
+
+            results: list[str | None] = [None] * len(requests)
+            cache_keys = []
+            if cache is not None:
+                cache_keys = [
+                    cache.make_key("vllm", processor_config.column_model(column), cache_params[column], prompt)
+                    for prompt in requests
+                ]
+                results = [cache.get(key) for key in cache_keys]
+
+            # Only send prompts without a cached completion to the model
+            missing = [idx for idx, result in enumerate(results) if result is None]
+            if metrics is not None and cache is not None:
+                metrics.increment(column, "cache_hits", len(requests) - len(missing))
+            batch_messages.extend([{"role": "user", "content": requests[idx]}] for idx in missing)
+            batch_sampling_params.extend([sampling_params[column]] * len(missing))
+            pending[column] = (prompts, requests, results, cache_keys, missing)
+
+        submit_order = list(range(len(batch_messages)))
+        if prefix_caching:
+            submit_order.sort(key=lambda idx: batch_messages[idx][0]["content"])
+
+        # Process the messages of all columns at once
+        outputs = [None] * len(batch_messages)
+        latency = 0.0
+        if batch_messages:
+            start = time.perf_counter()
+            submitted = llm.chat(
+                [batch_messages[idx] for idx in submit_order],
+                sampling_params=[batch_sampling_params[idx] for idx in submit_order],
+            )
+            latency = time.perf_counter() - start
+            for idx, output in zip(submit_order, submitted):
+                outputs[idx] = output
 
-        return {column_name: results}
+        generated = {}
+        offset = 0
+        for column, (prompts, requests, results, cache_keys, missing) in pending.items():
+            for idx, output in zip(missing, outputs[offset:offset + len(missing)]):
+                # Get the result for each row
+                _record_request_metrics(metrics, column, output, latency)
+                _record_prefix_cache_usage(prefix_cache_stats, column, output)
+                result = output.outputs[0].text.strip()
+                results[idx] = result
+                if cache is not None:
+                    cache.put(cache_keys[idx], result)
+            offset += len(missing)
 
-    return dataset.map(
+            if processor_config.columns[column].get("dedup"):
+                # Scatter the completions back to every row with the same prompt
+                deduplicated[column].update(zip(requests, results))
+                results = [deduplicated[column][prompt] for prompt in prompts]
+
+            generated[column] = results
+
+        return generated
+
+    order = None
+    if length_bucketing:
+        order = _length_sorted_indices(
+            dataset=dataset,
+            llm=llm,
+            processor_config=processor_config,
+            column_names=column_names,
+        )
+        dataset = dataset.select(order)
+
+    dataset = dataset.map(
         map_function,
         batched=True,
         batch_size=processor_config.batch_size,  # Adjust batch size as needed
         features=Features({
             **dataset.features,
-            column_name: Value(column_config.get("dtype", "string")),  # Ensure the new column is of type string
+            **{
+                # Ensure the new columns are of type string
+                column: Value(processor_config.columns[column].get("dtype", "string"))
+                for column in column_names
+            },
         }),
     )
 
+    if order is not None:
+        # Scatter the rows back into their source order
+        source_order = [0] * len(order)
+        for position, idx in enumerate(order):
+            source_order[idx] = position
+        dataset = dataset.select(source_order)
+
+    for column, stats in dedup_stats.items():
+        if stats["cells"]:
+            ratio = 1 - stats["requests"] / stats["cells"]
+            rprint(
+                f"[bold blue]Deduplicated {column}:[/] {stats['requests']} requests for "
+                f"{stats['cells']} cells ({ratio:.1%} deduplicated)")
+
+    return dataset
+
+
+def _checkpoint_hash(
+    *,
+    repo_id: str,
+    split: str,
+    processor_config: ProcessorConfig,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    projected_columns: list[str] | None = None,
+) -> str:
+    """Hash everything that determines the content of the generated columns."""
+    payload = {
+        "repo_id": repo_id,
+        "split": split,
+        "num_rows": processor_config.num_rows,
+        "vllm_model": processor_config.vllm_model,
+        "columns": processor_config.columns,
+    }
+    if num_shards > 1:
+        payload["shard"] = [shard_index, num_shards]
+    if projected_columns is not None:
+        # Checkpointed passes only hold the projected source columns
+        payload["source_columns"] = projected_columns
+    payload = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _load_latest_checkpoint(checkpoint_dir: str, passes: list[str]) -> tuple[Dataset | None, int]:
+    """
+    Load the checkpoint of the last generation pass that completed.
+
+    :return: The checkpointed dataset (or None) and the number of passes it covers.
+    """
+    from datasets import Dataset
+
+    for idx in range(len(passes), 0, -1):
+        path = os.path.join(checkpoint_dir, f"{passes[idx - 1]}.parquet")
+        if os.path.exists(path):
+            return Dataset.from_parquet(path), idx
+
+    return None, 0
+
+
+def _save_checkpoint(dataset: Dataset, checkpoint_dir: str, name: str) -> None:
+    path = os.path.join(checkpoint_dir, f"{name}.parquet")
+    # Write to a temporary file first so a crash never leaves a truncated checkpoint behind
+    dataset.to_parquet(f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+def _release_llm_memory() -> None:
+    """Free the GPU memory of an LLM whose last reference was dropped, before loading the next one."""
+    gc.collect()
+    try:
+        import torch
+    except ImportError:
+        # Stub LLMs run without torch
+        return
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def generate_passes(
+    *,
+    dataset: Dataset,
+    passes: list[tuple[str, list[str]]],
+    llm_factory: Callable[[str], LLM],
+    processor_config: ProcessorConfig,
+    cache: CompletionCache | None = None,
+    checkpoint_dir: str | None = None,
+    length_bucketing: bool = False,
+    prefix_caching: bool = False,
+    prefix_cache_stats: dict[str, dict] | None = None,
+    metrics: RunMetrics | None = None,
+) -> Dataset:
+    """
+    Run (model, columns) generation passes in order, loading a model only when it changes.
+
+    The previous model is released before the next one is loaded, so a single GPU holds one
+    model at a time.
+    """
+    llm, loaded_model = None, None
+    for model, level in passes:
+        if model != loaded_model:
+            if llm is not None:
+                llm = None
+                _release_llm_memory()
+            rprint(f"[bold green]Loading model {model}[/]")
+            llm, loaded_model = llm_factory(model), model
+
+        dataset = process_columns(
+            dataset=dataset,
+            llm=llm,
+            processor_config=processor_config,
+            column_names=level,
+            cache=cache,
+            length_bucketing=length_bucketing,
+            prefix_caching=prefix_caching,
+            prefix_cache_stats=prefix_cache_stats,
+            metrics=metrics,
+        )
+        if checkpoint_dir:
+            _save_checkpoint(dataset, checkpoint_dir, "+".join(level))
+
+    if metrics is not None:
+        # Rows are only complete once the last pass is done
+        metrics.row_completed(dataset.num_rows)
+    return dataset
+
+
+def _write_shard(
+    dataset: Dataset,
+    *,
+    shard_name: str,
+    split: str,
+    output_dir: str | None,
+    destination: str,
+    fingerprints: bytes,
+) -> None:
+    """
+    Write the output of one source shard locally, or stage it in the destination repo for the merge step.
+
+    The column fingerprints are written next to the shard, for the merge step to record them.
+    """
+    from huggingface_hub import CommitOperationAdd, HfApi
+
+    if output_dir:
+        path = os.path.join(output_dir, shard_name, f"{split}-00000.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        dataset.to_parquet(path)
+        with open(os.path.join(output_dir, shard_name, "fingerprints.json"), "wb") as f:
+            f.write(fingerprints)
+        rprint(f"[bold green]Shard written to {path}[/]")
+        return
+
+    api = HfApi()
+    api.create_repo(destination, repo_type="dataset", exist_ok=True)
+    path_in_repo = f"shards/{split}/{shard_name}"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"{split}-00000.parquet")
+        dataset.to_parquet(path)
+        api.create_commit(
+            destination,
+            operations=[
+                CommitOperationAdd(path_in_repo=f"{path_in_repo}/{split}-00000.parquet", path_or_fileobj=path),
+                CommitOperationAdd(path_in_repo=f"{path_in_repo}/fingerprints.json", path_or_fileobj=fingerprints),
+            ],
+            commit_message=f"Stage {shard_name} of the {split} split",
+            repo_type="dataset",
+        )
+    rprint(f"[bold green]Shard staged in https://huggingface.co/datasets/{destination}[/]")
+
 
 def check_cuda_availability():
     """Check if CUDA is available and exit if not."""
+    import torch
+
     if not torch.cuda.is_available():
         rprint(f"[bold red]CUDA is not available![/]")
         raise RuntimeError("CUDA is not available")
@@ -276,27 +1570,102 @@ def main(
     vllm_model: str | None = None,
     max_workers: int | None = None,
     batch_size: int | None = 512,
+    cache_path: str | None = None,
+    cache_max_size_mb: float = 1024,
+    checkpoint_dir: str | None = None,
+    resume: bool = False,
+    streaming: bool = False,
+    max_rows_in_flight: int = 1024,
+    length_bucketing: bool = False,
+    prefix_caching: bool = False,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    output_dir: str | None = None,
+    metrics_port: int | None = None,
+    metrics_path: str | None = None,
+    incremental_from: str | None = None,
+    source_projection: str = "all",
+    validate_only: bool = False,
 ):
-    check_cuda_availability()
+    """
+    Extend a dataset with columns generated by local vLLM models.
+
+    With num_shards > 1, this worker only processes the contiguous source shard shard_index, and
+    num_rows applies to that shard. Its output is written to output_dir/shard-<index>-of-<num_shards>
+    if output_dir is set, otherwise it is staged in the destination repo under
+    shards/<destination_split>/. Run merge_shards.py once every shard is done.
+
+    Run metrics (request latencies, token counts and throughput per column) are served in the
+    Prometheus format on metrics_port at /metrics during the run, and written as JSON to
+    metrics_path at the end. In batched mode, each prompt is recorded with the latency of its
+    whole llm.chat call, and the engine's own queueing is not measured.
+
+    With incremental_from, the destination_split of that previous output is used as the source
+    dataset instead of repo_id. Columns whose fingerprint (prompt, model, parameters and upstream
+    fingerprints) is unchanged are copied through, and only the changed columns and their
+    descendants are regenerated.
+
+    With source_projection "referenced", only the source columns the prompts reference are carried
+    through generation and written to the output, with the generated columns. With "join", the
+    other source columns are left out of generation and joined back by row index to the output,
+    which keeps the source order. Generated columns reused from a previous output are always kept.
+
+    With validate_only, the config is validated against the source columns read from the Hub
+    metadata and the summary is displayed, without loading the dataset, the model or CUDA.
+    """
+    if streaming and checkpoint_dir:
+        raise ValueError("--checkpoint-dir is not supported with --streaming, columns are not generated in passes")
+    if streaming and length_bucketing:
+        raise ValueError("--length-bucketing is not supported with --streaming, requests are not batched")
+    if source_projection not in SOURCE_PROJECTIONS:
+        raise ValueError(f"Unknown source projection: {source_projection}. Expected one of {SOURCE_PROJECTIONS}.")
+
+    max_workers = max_workers or max(1, multiprocessing.cpu_count() - 1)
+
+    previous_fingerprints = None
+    if incremental_from:
+        previous_fingerprints = _load_fingerprints(incremental_from, destination_split)
+        repo_id, split = incremental_from, destination_split
+
+    if validate_only:
+        source_columns, source_rows = _hub_split_metadata(repo_id, split)
+        if source_columns is None:
+            raise ValueError(f"Could not read the columns of {repo_id} ({split}) from the Hub metadata")
+        if num_rows is None and num_shards == 1:
+            num_rows = source_rows
+        load_processor_config(
+            source_columns=source_columns,
+            config_path=config,
+            max_workers=max_workers,
+            num_rows=num_rows,
+            batch_size=batch_size,
+            vllm_model=vllm_model,
+            previous_fingerprints=previous_fingerprints,
+        )
+        rprint(f"[bold green]Configuration {config} is valid for {repo_id} ({split})[/]")
+        return
+
+    from datasets import load_dataset
+    from huggingface_hub import HfApi
+    from vllm import LLM
 
-    if vllm_model is None:
-        vllm_model = "meta-llama/Llama-3.1-8B-Instruct"
-        rprint(f"[bold orange]Using default VLLM model: {vllm_model}[/]")
+    check_cuda_availability()
 
-    llm = LLM(
-        model=vllm_model,
+    engine_kwargs = dict(
         trust_remote_code=True,
         gpu_memory_utilization=0.9,  # Adjust as needed
         max_model_len=29456,  # Adjust based on model/hardware capabilities
     )
-
-    max_workers = max_workers or max(1, multiprocessing.cpu_count() - 1)
+    if prefix_caching:
+        engine_kwargs["enable_prefix_caching"] = True
 
     dataset: Dataset = load_dataset(
         repo_id,
         split=split,
         num_proc=max_workers,
     )
+    if num_shards > 1:
+        dataset = dataset.shard(num_shards=num_shards, index=shard_index, contiguous=True)
 
     if num_rows is None:
         num_rows = dataset.num_rows
@@ -310,24 +1679,134 @@ def main(
         num_rows=num_rows,
         batch_size=batch_size,
         vllm_model=vllm_model,
+        previous_fingerprints=previous_fingerprints,
     )
+    if stale_columns := [col for col in dataset.column_names if col not in processor_config.source_columns]:
+        dataset = dataset.remove_columns(stale_columns)
+
+    projected_columns = None
+    untouched_dataset = None
+    if source_projection != "all":
+        projected = _referenced_source_columns(processor_config.source_columns, processor_config.columns)
+        projected |= set(processor_config.reused_columns)
+        projected_columns = [col for col in dataset.column_names if col in projected]
+        rprint(f"[bold blue]Generating from {len(projected_columns)} of {dataset.num_columns} source columns[/]")
+        if source_projection == "join":
+            # Generation passes keep the source order, so the other columns line up by row index
+            untouched_dataset = dataset.remove_columns(projected_columns)
+            source_order = dataset.column_names
+        # The dataset is memory-mapped, selecting columns copies nothing and map() only rewrites these
+        dataset = dataset.select_columns(projected_columns)
+    fingerprints = json.dumps({"columns": processor_config.fingerprints}, indent=2, sort_keys=True).encode("utf-8")
 
-    for column in processor_config.sorted_columns:
-        dataset = process_column(
+    cache = CompletionCache(cache_path, max_size_mb=cache_max_size_mb) if cache_path else None
+    prefix_cache_stats = defaultdict(lambda: {"prompt_tokens": 0, "cached_tokens": 0})
+    metrics = RunMetrics()
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
+        rprint(f"[bold green]Serving run metrics on http://localhost:{metrics_port}/metrics[/]")
+
+    schedule = processor_config.model_schedule
+    passes = ["+".join(level) for _, level in schedule]
+    completed = 0
+    if checkpoint_dir:
+        checkpoint_dir = os.path.join(
+            checkpoint_dir,
+            _checkpoint_hash(
+                repo_id=repo_id,
+                split=split,
+                processor_config=processor_config,
+                num_shards=num_shards,
+                shard_index=shard_index,
+                projected_columns=projected_columns,
+            ),
+        )
+        if resume:
+            checkpoint, completed = _load_latest_checkpoint(checkpoint_dir, passes)
+            if checkpoint is not None:
+                dataset = checkpoint
+                rprint(f"[bold green]Resuming after generation pass '{passes[completed - 1]}' from {checkpoint_dir}[/]")
+        elif os.path.exists(checkpoint_dir):
+            shutil.rmtree(checkpoint_dir)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    if streaming:
+        models = {model for model, _ in schedule}
+        if len(models) > 1:
+            raise ValueError(f"--streaming runs a single model, but columns use {sorted(models)}. Set --vllm-model.")
+
+        llm = VLLMStreamingEngine(models.pop() if models else DEFAULT_VLLM_MODEL, **engine_kwargs)
+        try:
+            dataset = asyncio.run(stream_columns(
+                dataset=dataset,
+                engine=llm,
+                processor_config=processor_config,
+                cache=cache,
+                max_rows_in_flight=max_rows_in_flight,
+                prefix_cache_stats=prefix_cache_stats,
+                metrics=metrics,
+            ))
+        finally:
+            llm.shutdown()
+    else:
+        dataset = generate_passes(
             dataset=dataset,
-            llm=llm,
+            passes=schedule[completed:],
+            llm_factory=lambda model: LLM(model=model, **engine_kwargs),
             processor_config=processor_config,
-            column_name=column,
+            cache=cache,
+            checkpoint_dir=checkpoint_dir,
+            length_bucketing=length_bucketing,
+            prefix_caching=prefix_caching,
+            prefix_cache_stats=prefix_cache_stats,
+            metrics=metrics,
         )
+    metrics.close()
+
+    if cache is not None:
+        rprint(Panel(cache.summary()))
+        cache.close()
+
+    if any(stats["prompt_tokens"] for stats in prefix_cache_stats.values()):
+        rprint(Panel(_prefix_cache_summary(prefix_cache_stats)))
+
+    rprint(Panel(metrics.summary()))
+    if metrics_path:
+        metrics.write_json(metrics_path)
 
     augmented_dataset = dataset
+    if untouched_dataset is not None:
+        from datasets import concatenate_datasets
 
-    augmented_dataset.push_to_hub(
+        augmented_dataset = concatenate_datasets([untouched_dataset, dataset], axis=1).select_columns(
+            source_order + [col for col in dataset.column_names if col not in source_order])
+    if num_shards > 1:
+        _write_shard(
+            # Generation passes keep the source order, so row positions are the source indices
+            augmented_dataset.add_column(SOURCE_INDEX_COLUMN, list(range(augmented_dataset.num_rows))),
+            shard_name=f"shard-{shard_index:05d}-of-{num_shards:05d}",
+            split=destination_split,
+            output_dir=output_dir,
+            destination=destination,
+            fingerprints=fingerprints,
+        )
+        return
+
+    commit_info = augmented_dataset.push_to_hub(
         destination,
         split=destination_split,
         create_pr=create_pr,
         num_proc=max_workers,
     )
+    # With create_pr, the fingerprints go to the pull request opened by push_to_hub
+    HfApi().upload_file(
+        path_or_fileobj=fingerprints,
+        path_in_repo=FINGERPRINTS_PATH.format(split=destination_split),
+        repo_id=destination,
+        repo_type="dataset",
+        revision=commit_info.pr_revision,
+        commit_message=f"Record the column fingerprints of the {destination_split} split",
+    )
 
     rprint(f"[bold green]Dataset successfully extended and pushed to https://huggingface.co/datasets/{destination}[/]")
 